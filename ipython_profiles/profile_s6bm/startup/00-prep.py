@@ -2,13 +2,84 @@
 import IPython
 globals().update(IPython.get_ipython().user_ns)
 
-print(f'Enter {__file__}...')
+# ----- startup time profiler ----- #
+import sys
+import time
+import types
+import builtins
+import threading
+import importlib
+
+_startup_t0 = time.perf_counter()
+_startup_files = {}    # {startup file: wall time in seconds}
+_startup_imports = {}  # {top level module: wall time in seconds}
+
+
+class _ImportTimer():
+    """Record the wall time of each new top level import during startup"""
+
+    def __init__(self):
+        self._orig_import = builtins.__import__
+        self._local = threading.local()
+
+    def __call__(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules or getattr(self._local, 'depth', 0):
+            return self._orig_import(name, globals, locals, fromlist, level)
+        self._local.depth = 1
+        t0 = time.perf_counter()
+        try:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        finally:
+            self._local.depth = 0
+            _startup_imports[name] = _startup_imports.get(name, 0) + time.perf_counter() - t0
+
+    def install(self):
+        builtins.__import__ = self
+
+    def uninstall(self):
+        if builtins.__import__ is self:
+            builtins.__import__ = self._orig_import
+
+_import_timer = _ImportTimer()
+_import_timer.install()
+
+
+def _stop_import_timer(*args):
+    """restore __import__ before the first cell, even if a startup file failed"""
+    _import_timer.uninstall()
+    IPython.get_ipython().events.unregister('pre_run_cell', _stop_import_timer)
+
+IPython.get_ipython().events.register('pre_run_cell', _stop_import_timer)
+
+
+def _startup_enter(fname):
+    print(f'Enter {fname}...')
+    _startup_files[fname] = time.perf_counter()
+
+
+def _startup_leave(fname):
+    _startup_files[fname] = time.perf_counter() - _startup_files[fname]
+    print(f'leaving {fname}...\n')
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder of a module that is only imported on first attribute access"""
+
+    def __getattr__(self, attr):
+        if self.__name__ not in sys.modules:
+            t0 = time.perf_counter()
+            importlib.import_module(self.__name__)
+            _startup_imports[f'{self.__name__} (lazy)'] = time.perf_counter() - t0
+        return getattr(sys.modules[self.__name__], attr)
+
+
+_startup_enter(__file__)
 # ----- Ipython control config and standard library import ----- #
 # NOTE:
 # Do not change the order of import, otherwise it will fail
 import os
 import matplotlib
-import matplotlib.pyplot as plt
+plt = LazyModule('matplotlib.pyplot')
 
 import socket
 import getpass
@@ -20,6 +91,9 @@ import apstools
 import numpy as np
 from datetime import datetime
 
+# rarely used, only imported on first use
+APS_devices = LazyModule('apstools.devices')
+
 print("*****")
 
 # get system info
@@ -35,13 +109,14 @@ print(f'''
     have imported 
         os
         matplotlib
-        matplotlib.pyplot as plt <-- interactive, using widget as backend
+        matplotlib.pyplot as plt <-- interactive, using widget as backend, lazy
         socket
         getpass
         yaml
         bluesky
         ophyd
         apstools
+        apstools.devices as APS_devices <-- lazy
         numpy 
         datetime
         databroker
@@ -49,27 +124,656 @@ print(f'''
 ''')
 
 
+# ----- Background document writer ----- #
+# Documents are handed to a writer thread so that the RunEngine never waits
+# on a network round trip to the database.  When the database is not
+# reachable, documents are spilled to a local journal and replayed later.
+import json
+import queue
+import atexit
+import event_model
+
+DOCUMENT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.s6bm', 'journal')
+
+def _json_default(obj):
+    """make numpy values JSON serializable"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
+
+
+class PartialInsert(Exception):
+    def __init__(self, n_done, error):
+        self.n_done = n_done
+        self.error = error
+        super().__init__(f"{n_done} documents inserted before {error!r}")
+
+
+def insert_documents(db, docs, use_event_page=True):
+    """
+    insert [(name, doc)] into db in order, consecutive events of the same
+    stream are packed into one event_page, raise PartialInsert with the
+    number of inserted docs on failure
+    """
+    events = []
+    n_done = 0
+
+    def flush_events():
+        nonlocal n_done
+        if not events:
+            return
+        if use_event_page:
+            db.insert('event_page', event_model.pack_event_page(*events))
+            n_done += len(events)
+        else:
+            for event in events:
+                db.insert('event', event)
+                n_done += 1
+        events.clear()
+
+    try:
+        for name, doc in docs:
+            if name == 'event' and (not events or events[-1]['descriptor'] == doc['descriptor']):
+                events.append(doc)
+                continue
+            flush_events()
+            if name == 'event':
+                events.append(doc)
+            else:
+                db.insert(name, doc)
+                n_done += 1
+        flush_events()
+    except Exception as err:
+        raise PartialInsert(n_done, err) from err
+    return n_done
+
+
+class BufferedDocumentWriter():
+    """
+    Callback that inserts documents into db from a background thread.
+
+    Documents are queued (bounded, the RunEngine blocks when it is full)
+    and inserted in batches, with consecutive events of the same stream
+    packed into a single event_page.  The queue is drained at every stop
+    document.  If an insert fails, the documents go to a JSONL journal in
+    journal_dir until replay() succeeds, which is retried every
+    retry_interval seconds.
+    """
+
+    exit_timeout = 10  # sec, at most spent on the queue at interpreter exit
+
+    def __init__(self, db,
+            maxsize=10000,
+            batch_size=200,
+            drain_timeout=60,
+            retry_interval=60,
+            journal_dir=DOCUMENT_JOURNAL_DIR,
+            use_event_page=True,
+        ):
+        self.db = db
+        self.batch_size = batch_size
+        self.drain_timeout = drain_timeout
+        self.retry_interval = retry_interval
+        self.journal_dir = journal_dir
+        self.use_event_page = use_event_page
+        self.offline = False
+        self._failed_at = None
+        self._lock = threading.RLock()
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stats = {
+            'documents': 0, 'batches': 0, 'journaled': 0,
+            'max_depth': 0, 'latency_total': 0.0, 'latency_max': 0.0,
+        }
+        self._thread = threading.Thread(
+            target=self._run,
+            name='BufferedDocumentWriter',
+            daemon=True,
+        )
+        self._thread.start()
+        atexit.register(self.close, timeout=self.exit_timeout)
+
+    def __call__(self, name, doc):
+        self._queue.put((name, doc, time.perf_counter()))
+        self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+        if name == 'stop':
+            if not self.drain(timeout=self.drain_timeout):
+                print(f"🙈: document writer is still busy after {self.drain_timeout} s")
+
+    def drain(self, timeout=None):
+        """block until all queued documents are written, False on timeout"""
+        marker = threading.Event()
+        self._queue.put((None, marker, time.perf_counter()))
+        return marker.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        drain the queue and stop the writer thread, the documents still
+        queued after timeout are saved to the journal instead
+        """
+        if not self._thread.is_alive():
+            return
+        if not self.drain(timeout=timeout):
+            self._spill_queue()
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def _spill_queue(self):
+        """move the queued documents to the journal (the batch being written is not)"""
+        docs = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                continue
+            if item[0] is None:
+                item[1].set()  # release the drain markers
+            else:
+                docs.append(item)
+        if not docs:
+            return
+        self._journal(docs, suffix='_spill')
+        print(f"🙈: {self.db} is not responding, {len(docs)} queued documents saved to {self.journal_dir}")
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def metrics(self):
+        """return queue depth, throughput and enqueue-to-insert latency"""
+        n = self._stats['documents']
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self._stats['max_depth'],
+            'documents': n,
+            'batches': self._stats['batches'],
+            'journaled': self._stats['journaled'],
+            'latency_mean': self._stats['latency_total']/n if n else 0.0,
+            'latency_max': self._stats['latency_max'],
+            'offline': self.offline,
+        }
+
+    def report(self):
+        """print the metrics of the writer"""
+        print("🙊: document writer metrics:")
+        for key, val in self.metrics().items():
+            print(f"\t{key}:\t{val}")
+        print()
+
+    # --- writer thread --- #
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        docs = []
+        for name, doc, t_enqueue in batch:
+            if name is None:
+                # drain marker, everything before it must be written first
+                self._write_docs(docs)
+                docs = []
+                doc.set()
+            else:
+                docs.append((name, doc, t_enqueue))
+        self._write_docs(docs)
+
+    def _write_docs(self, docs):
+        if not docs:
+            return
+        with self._lock:
+            if self.offline and time.time() - self._failed_at > self.retry_interval:
+                self.replay()
+            if self.offline:
+                self._journal(docs)
+            else:
+                try:
+                    insert_documents(
+                        self.db,
+                        [(name, doc) for name, doc, _ in docs],
+                        use_event_page=self.use_event_page,
+                    )
+                except PartialInsert as err:
+                    print(f"🙈: cannot write to {self.db} ({err.error!r}), spill to {self.journal_dir}")
+                    self.offline = True
+                    self._failed_at = time.time()
+                    self._journal(docs[err.n_done:])
+        now = time.perf_counter()
+        for _, _, t_enqueue in docs:
+            self._stats['latency_total'] += now - t_enqueue
+            self._stats['latency_max'] = max(self._stats['latency_max'], now - t_enqueue)
+        self._stats['documents'] += len(docs)
+        self._stats['batches'] += 1
+
+    def _journal(self, docs, suffix=''):
+        if not docs:
+            return
+        os.makedirs(self.journal_dir, exist_ok=True)
+        fn = os.path.join(self.journal_dir, f"{datetime.now():%Y%m%d}{suffix}.jsonl")
+        with open(fn, 'a') as f:
+            for name, doc, _ in docs:
+                f.write(json.dumps([name, doc], default=_json_default) + "\n")
+        self._stats['journaled'] += len(docs)
+
+    def replay(self):
+        """insert the journaled documents into db, True if all succeeded"""
+        with self._lock:
+            if not os.path.isdir(self.journal_dir):
+                self.offline = False
+                return True
+            for fn in sorted(os.listdir(self.journal_dir)):
+                fp = os.path.join(self.journal_dir, fn)
+                with open(fp, 'r') as f:
+                    docs = [json.loads(line) for line in f if line.strip()]
+                try:
+                    insert_documents(self.db, docs, use_event_page=self.use_event_page)
+                except PartialInsert as err:
+                    print(f"🙈: cannot replay {fp} ({err.error!r})")
+                    # keep only what is not in db yet
+                    with open(fp, 'w') as f:
+                        for doc in docs[err.n_done:]:
+                            f.write(json.dumps(doc, default=_json_default) + "\n")
+                    self._failed_at = time.time()
+                    return False
+                os.remove(fp)
+                print(f"🙊: replayed {len(docs)} documents from {fp}")
+            self.offline = False
+            return True
+
+
+# ----- Local document store ----- #
+# One JSONL file per run under LOCAL_STORE_DIR, moved from active/ to
+# finished/ at its stop document and to synced/ once uploaded to MongoDB.
+LOCAL_STORE_DIR = os.environ.get(
+    'S6BM_LOCAL_STORE',
+    os.path.join(os.path.expanduser('~'), '.s6bm', 'documents'),
+)
+
+class LocalDocumentStore():
+    """
+    Document store on local disk with the insert(name, doc) interface
+    of databroker.Broker, which can be used as the primary sink with
+    getRunEngine(db=LocalDocumentStore()).  Finished runs are uploaded
+    to a real database in batches with upload().
+    """
+
+    def __init__(self, root=LOCAL_STORE_DIR):
+        self.root = root
+        for sub in ['active', 'finished', 'synced']:
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        self._files = {}     # {run uid: open file}
+        self._run_of = {}    # {descriptor/resource uid: run uid}
+
+    def __repr__(self):
+        return f"LocalDocumentStore({self.root})"
+
+    def _path(self, state, uid):
+        return os.path.join(self.root, state, f"{uid}.jsonl")
+
+    def _find_run(self, name, doc):
+        if name == 'start':
+            return doc['uid']
+        if name in ('descriptor', 'stop'):
+            return doc['run_start']
+        if name in ('event', 'event_page'):
+            return self._run_of[doc['descriptor']]
+        if name == 'resource':
+            return doc['run_start']
+        if name in ('datum', 'datum_page'):
+            return self._run_of[doc['resource']]
+        raise ValueError(f"🙉: unknown document type, {name}")
+
+    def insert(self, name, doc):
+        run = self._find_run(name, doc)
+        if name in ('descriptor', 'resource'):
+            self._run_of[doc['uid']] = run
+        if run not in self._files:
+            self._files[run] = open(self._path('active', run), 'a')
+        f = self._files[run]
+        f.write(json.dumps([name, doc], default=_json_default) + "\n")
+        if name == 'stop':
+            f.close()
+            del self._files[run]
+            os.rename(self._path('active', run), self._path('finished', run))
+            self._run_of = {k: v for k, v in self._run_of.items() if v != run}
+
+    def runs(self, state='finished'):
+        """uid of runs in given state [active|finished|synced]"""
+        path = os.path.join(self.root, state)
+        return sorted(
+            (fn[:-len('.jsonl')] for fn in os.listdir(path) if fn.endswith('.jsonl')),
+            key=lambda uid: os.path.getmtime(self._path(state, uid)),
+        )
+
+    def read_run(self, uid, state='finished'):
+        """return [(name, doc)] of given run"""
+        with open(self._path(state, uid), 'r') as f:
+            return [tuple(json.loads(line)) for line in f if line.strip()]
+
+    def upload(self, db, batch_size=1000, use_event_page=True):
+        """
+        upload every finished run to db in batches of documents,
+        return the number of runs uploaded
+        """
+        n_runs = 0
+        for uid in self.runs('finished'):
+            docs = self.read_run(uid)
+            for i in range(0, len(docs), batch_size):
+                try:
+                    insert_documents(db, docs[i:i+batch_size], use_event_page=use_event_page)
+                except PartialInsert as err:
+                    # keep the remaining docs for the next upload
+                    with open(self._path('finished', uid), 'w') as f:
+                        for doc in docs[i+err.n_done:]:
+                            f.write(json.dumps(doc, default=_json_default) + "\n")
+                    print(f"🙈: upload of run {uid} stopped ({err.error!r})")
+                    return n_runs
+            os.rename(self._path('finished', uid), self._path('synced', uid))
+            n_runs += 1
+        print(f"🙊: uploaded {n_runs} runs from {self.root} to {db}")
+        return n_runs
+
+
 # ----- Setup base bluesky RunEngine and MongoDB ----- #
-# metadata streamed to MongoDB server over the network
+# metadata streamed to MongoDB server over the network, fall back to the
+# local store when the named config cannot be loaded
 import databroker
-metadata_db = databroker.Broker.named("mongodb_config")
+try:
+    metadata_db = databroker.Broker.named("mongodb_config")
+except Exception as err:
+    print(f"🙈: cannot load mongodb_config ({err!r}), use local store instead")
+    metadata_db = LocalDocumentStore()
 keywords_vars['metadata_db'] = 'Default metadata handler'
 
+keywords_func['sync_local_store'] = 'Upload finished runs in local store to MongoDB'
+def sync_local_store(store=None, db=None, batch_size=1000):
+    """
+    upload the finished runs in the local store (default: LOCAL_STORE_DIR)
+    to db (default: mongodb_config)
+    """
+    store = store or LocalDocumentStore()
+    db = db or databroker.Broker.named("mongodb_config")
+    return store.upload(db, batch_size=batch_size)
+
+# ----- Lightweight live view ----- #
+# Replaces the BestEffortCallback: the RunEngine only queues the documents,
+# a thread renders them at a fixed rate and the live plot is redrawn at the
+# same rate by a timer of the figure, so a long step scan does not pay for
+# a table row and a figure redraw per event.
+class DecimatedSeries():
+    """
+    Append-only series of at most max_points, every stride-th point is
+    kept and the stride doubles (every other point dropped) when full
+    """
+
+    def __init__(self, max_points=2000):
+        self.max_points = max_points
+        self.stride = 1
+        self.n = 0
+        self.x = []
+        self.y = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, x, y):
+        if self.n % self.stride == 0:
+            self.x.append(x)
+            self.y.append(y)
+            if len(self.x) > self.max_points:
+                self.x, self.y = self.x[::2], self.y[::2]
+                self.stride *= 2
+        self.n += 1
+
+
+def _scalar_keys(descriptor):
+    """the scalar (plottable) data keys of an event descriptor"""
+    return [
+        key for key, info in descriptor['data_keys'].items()
+        if info.get('dtype') in ('number', 'integer') and not info.get('shape') and not info.get('external')
+    ]
+
+
+class LiveView():
+    """
+    Callback showing the progress of the runs from a background thread.
+
+    Documents are queued by the RunEngine and rendered every 1/fps s:
+    the events of a refresh are coalesced into one table row (the last
+    event, with the number of events since the previous row), and the
+    scalar readings are kept as DecimatedSeries (at most max_points) for
+    plot().  With table=False only the stop summary (exit status,
+    duration, events per stream) is printed.
+
+    With plots and an interactive matplotlib session (e.g. %matplotlib),
+    the first max_columns scalars of the primary stream are plotted live
+    in the 'live_view' figure, redrawn every 1/fps s by a timer of the
+    figure (GUI thread) from a copy of the series.
+    """
+
+    def __init__(self, fps=2.0, table=True, plots=True, max_points=2000, max_columns=6):
+        self.fps = fps
+        self.table = table
+        self.plots = plots
+        self.max_points = max_points
+        self.max_columns = max_columns
+        self.series = {}  # {stream: {key: DecimatedSeries}} of the last run
+        self._lock = threading.Lock()  # series, between the render and GUI threads
+        self._start = None
+        self._open = 0      # runs started and not stopped (main thread)
+        self._queued = 0    # documents queued (main thread)
+        self._rendered = 0  # documents rendered (render thread)
+        self._figure = None
+        self._timer = None
+        self._lines = {}
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='LiveView', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)  # stop rendering before the interpreter shuts down
+
+    def __repr__(self):
+        return f"LiveView(fps={self.fps}, table={self.table}, plots={self.plots}, {len(self.series)} streams)"
+
+    def __call__(self, name, doc):
+        # the stop summary comes with the next refresh, the RE does not wait
+        self._queue.put((name, doc))
+        self._queued += 1
+        if name == 'start':
+            self._open += 1
+        elif name == 'stop':
+            self._open = max(self._open - 1, 0)
+        elif name == 'descriptor' and doc.get('name', 'primary') == 'primary':
+            # figures belong to the main thread, where the RE emits the documents
+            if self.plots and matplotlib.is_interactive():
+                self._live_plot(_scalar_keys(doc)[:self.max_columns])
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=2/self.fps + 1)
+
+    # --- render thread --- #
+    def _run(self):
+        while not self._closed.wait(1/self.fps):
+            docs = []
+            while True:
+                try:
+                    docs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._render(docs)
+            except Exception as err:
+                print(f"🙉: live view failed to render ({err!r})")
+            self._rendered += len(docs)
+
+    def _render(self, docs):
+        last = None
+        n_new = 0
+        for name, doc in docs:
+            if name == 'start':
+                self._on_start(doc)
+            elif name == 'descriptor':
+                self._on_descriptor(doc)
+            elif name == 'event' and self._start is not None:
+                if self._on_event(doc):
+                    last = doc
+                    n_new += 1
+            elif name == 'stop' and self._start is not None:
+                self._print_row(last, n_new)
+                last, n_new = None, 0
+                self._on_stop(doc)
+        self._print_row(last, n_new)
+
+    def _on_start(self, doc):
+        self._start = doc
+        self._streams = {}   # {descriptor uid: (stream, [scalar keys])}
+        self._n_events = {}  # {stream: n}
+        self._columns = None
+        with self._lock:
+            self.series = {}
+        if self.table:
+            print(f"🙊: run {doc['uid'][:8]} (scan_id {doc.get('scan_id')}, {doc.get('plan_name', '')}) started")
+
+    def _on_descriptor(self, doc):
+        keys = _scalar_keys(doc)
+        stream = doc.get('name', 'primary')
+        self._streams[doc['uid']] = (stream, keys)
+        with self._lock:
+            self.series.setdefault(stream, {})
+            for key in keys:
+                self.series[stream].setdefault(key, DecimatedSeries(self.max_points))
+
+    def _on_event(self, doc):
+        """keep the scalars, True if the event goes to the table"""
+        stream, keys = self._streams.get(doc['descriptor'], (None, []))
+        if stream is None:
+            return False
+        self._n_events[stream] = self._n_events.get(stream, 0) + 1
+        with self._lock:
+            for key in keys:
+                if key in doc['data']:
+                    self.series[stream][key].append(doc['seq_num'], doc['data'][key])
+        return stream == 'primary'
+
+    def _print_row(self, doc, n_new):
+        if doc is None or not self.table:
+            return
+        keys = self._streams[doc['descriptor']][1][:self.max_columns]
+        if self._columns != keys:
+            self._columns = keys
+            print(f"{'seq_num':>8} {'time':>8} " + " ".join(f"{key[-14:]:>14}" for key in keys))
+        stamp = datetime.fromtimestamp(doc['time']).strftime('%H:%M:%S')
+        values = " ".join(f"{doc['data'].get(key, float('nan')):>14.6g}" for key in keys)
+        more = f"  (+{n_new - 1})" if n_new > 1 else ""
+        print(f"{doc['seq_num']:>8} {stamp:>8} {values}{more}")
+
+    def _on_stop(self, doc):
+        start, self._start = self._start, None
+        events = ", ".join(f"{k}: {v}" for k, v in self._n_events.items()) or "no event"
+        status = doc.get('exit_status', '?')
+        icon = '🙊' if status == 'success' else '🙉'
+        print(f"{icon}: run {start['uid'][:8]} (scan_id {start.get('scan_id')}, {start.get('plan_name', '')}) "
+              f"{status} after {doc['time'] - start['time']:.1f} s, events {events}")
+        if doc.get('reason'):
+            print(f"    reason: {doc['reason']}")
+
+    # --- plots (main/GUI thread) --- #
+    def snapshot(self, stream='primary'):
+        """copy of the series of stream, {key: (x, y)}"""
+        with self._lock:
+            return {key: (list(s.x), list(s.y)) for key, s in self.series.get(stream, {}).items()}
+
+    def _live_plot(self, keys):
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        if not keys:
+            return
+        fig = plt.figure('live_view')
+        fig.clear()
+        axes = fig.subplots(len(keys), 1, sharex=True, squeeze=False)[:, 0]
+        self._figure = fig
+        self._lines = {key: ax.plot([], [], '.-')[0] for ax, key in zip(axes, keys)}
+        for ax, key in zip(axes, keys):
+            ax.set_ylabel(key)
+        axes[-1].set_xlabel('seq_num')
+        self._timer = fig.canvas.new_timer(interval=int(1000/self.fps))
+        self._timer.add_callback(self._redraw)
+        self._timer.start()
+
+    def _redraw(self):
+        """timer callback, update the lines from a snapshot of the series"""
+        running = self._open > 0 or self._rendered < self._queued
+        data = self.snapshot()
+        for key, line in self._lines.items():
+            x, y = data.get(key, ([], []))
+            line.set_data(x, y)
+            line.axes.relim()
+            line.axes.autoscale_view()
+        self._figure.canvas.draw_idle()
+        if not running and self._timer is not None:
+            self._timer.stop()  # last redraw of the run
+            self._timer = None
+
+    def plot(self, stream='primary', keys=None):
+        """plot the (downsampled) scalars of stream of the last run vs seq_num"""
+        series = self.snapshot(stream)
+        keys = keys or [key for key, (x, y) in series.items() if len(x)]
+        if not keys:
+            print(f"🙈: no scalar reading in stream {stream}")
+            return None
+        fig, axes = plt.subplots(len(keys), 1, sharex=True, squeeze=False)
+        for ax, key in zip(axes[:, 0], keys):
+            ax.plot(*series[key], '.-')
+            ax.set_ylabel(key)
+        axes[-1, 0].set_xlabel('seq_num')
+        return fig
+
+
 # setup RunEngine
 from bluesky import RunEngine
 
-from bluesky.callbacks.best_effort import BestEffortCallback
+live_view = None
+
+keywords_vars['session_callbacks'] = 'callbacks subscribed to every RunEngine of getRunEngine'
+session_callbacks = []  # e.g. theta_writer, added by the later startup scripts
 
 keywords_func['getRunEngine'] = 'Get a bluesky RunEngine'
-def getRunEngine(db=None):
+def getRunEngine(db=None, live_table=True):
     """
     Return an instance of RunEngine.  It is recommended to have only
     one RunEngine per session.
+    The progress is shown by live_view (LiveView, one per session),
+    live_table=False only prints the summary of each run.  The callbacks
+    in session_callbacks are subscribed too.
     """
+    global doc_writer, live_view
     RE = RunEngine({})
     db = db or metadata_db
-    RE.subscribe(db.insert)
-    RE.subscribe(BestEffortCallback())
+    doc_writer = BufferedDocumentWriter(db)
+    RE.subscribe(doc_writer)
+    if live_view is None:
+        live_view = LiveView()
+    live_view.table = live_table
+    RE.subscribe(live_view)
+    for callback in session_callbacks:
+        RE.subscribe(callback)
     RE.md['beamline_id'] = 'APS 6-BM-A'
     RE.md['proposal_id'] = 'internal test'
     RE.md['pid'] = os.getpid()
@@ -85,6 +789,8 @@ def getRunEngine(db=None):
     return RE
 RE = getRunEngine()
 keywords_vars['RE'] = 'Default RunEngine instance'
+keywords_vars['doc_writer'] = 'Background document writer of RE, see doc_writer.report()'
+keywords_vars['live_view'] = 'Live view of RE (table, run summary), see live_view.plot()'
 
 print(f"""
 🙈: A detault RunEngine, RE:
@@ -132,4 +838,33 @@ def hutch_light_on():
         print(f"🙈: the hutch is {'' if state else 'not'} on.")
     return state
 
-print(f'leaving {__file__}...\n')
+keywords_func['startup_report'] = 'Wall time spent per startup file and import'
+STARTUP_BUDGET = 5.0  # sec, expected launch time of this profile
+def startup_report(n_imports=10, logfile=None):
+    """
+    print the wall time spent in each startup file and the n slowest
+    imports, append the record (JSON) to logfile if given to track
+    the launch time over time
+    """
+    files = {os.path.basename(k): v for k, v in _startup_files.items()}
+    total = sum(files.values())
+    print(f"🙊: profile startup took {total:.2f} s (budget: {STARTUP_BUDGET:.1f} s)")
+    for key, val in files.items():
+        print(f"\t{key}:\t{val:.3f} s")
+    print(f"🙊: the {n_imports} slowest imports:")
+    for key, val in sorted(_startup_imports.items(), key=lambda x: -x[1])[:n_imports]:
+        print(f"\t{key}:\t{val:.3f} s")
+    print()
+    if logfile is not None:
+        import json
+        record = {
+            'date': datetime.isoformat(datetime.now(), " "),
+            'host': HOSTNAME,
+            'total': total,
+            'files': files,
+            'imports': _startup_imports,
+        }
+        with open(logfile, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+_startup_leave(__file__)
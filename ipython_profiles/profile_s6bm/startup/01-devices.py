@@ -1,7 +1,36 @@
-print(f'Enter {__file__}...')
+_startup_enter(__file__)
 # ----- Functions for hardware ----- #
 from bluesky.suspenders import SuspendFloor
 
+# ------------------ #
+# machine parameters #
+# ------------------ #
+from ophyd import Device
+from ophyd import Component
+from ophyd import Signal
+
+class SimulatedApsMachine(Device):
+    """Stand-in for the APS machine parameters (ring current) in debug/dryrun"""
+    current = Component(Signal, value=102.0)
+
+keywords_func['get_aps'] = 'Return a connection to sim/real APS machine parameters'
+def get_aps(mode='debug'):
+    """
+    return
+        simulated ring current <-- dryrun, debug
+        APS machine parameters <-- production
+    """
+    if mode.lower() in ['debug', 'dryrun']:
+        aps = SimulatedApsMachine(name="aps")
+    elif mode.lower() == 'production':
+        aps = APS_devices.ApsMachineParametersDevice(name="aps")
+    else:
+        raise ValueError(f"🙉: invalide mode, {mode}")
+    return aps
+
+aps = None  # place holder, see mode.set()
+keywords_vars['aps'] = "APS machine parameters (aps.current)"
+
 # ------- #
 # shutter #
 # ------- #
@@ -11,11 +40,13 @@ def get_shutter(mode='debug'):
     return
         simulated shutter <-- dryrun, debug
         acutal shutter    <-- production
-    """
-    import apstools.devices as APS_devices
-    aps = APS_devices.ApsMachineParametersDevice(name="APS")
 
-    if mode.lower() in ['debug', 'dryrun']:
+    NOTE: the ring current suspender of production is installed by
+          mode.set() once the switch succeeded
+    """
+    if mode.lower() == 'debug':
+        A_shutter = get_sim_beamline().shutter
+    elif mode.lower() == 'dryrun':
         A_shutter = APS_devices.SimulatedApsPssShutterWithStatus(name="A_shutter")
     elif mode.lower() == 'production':
         A_shutter = APS_devices.ApsPssShutterWithStatus(
@@ -23,18 +54,19 @@ def get_shutter(mode='debug'):
             "PA:06BM:STA_A_FES_OPEN_PL",
             name="A_shutter",
         )
-        suspend_APS_current = SuspendFloor(aps.current, 2, resume_thresh=10)
-        RE.install_suspender(suspend_APS_current)
     else:
         raise ValueError(f"🙉: invalide mode, {mode}")
 
     return A_shutter
 
-A_shutter = get_shutter(mode='debug')
+A_shutter = None  # place holder, see mode.set()
 keywords_vars['A_shutter'] = "shutter instance"
 # no scans until A_shutter is open
 suspend_A_shutter = None  # place holder
 keywords_vars['suspend_A_shutter'] = "no scans until A_shutter is open"
+# no scans while the ring current is low (production only)
+suspend_APS_current = None  # place holder, see mode.set()
+keywords_vars['suspend_APS_current'] = "RE suspender on the ring current (production)"
 
 # ----------------- #
 # Motors definition #
@@ -55,33 +87,28 @@ class TomoStage(MotorBundle):
 keywords_func['get_motors'] = 'Return a connection to sim/real tomostage motor'
 def get_motors(mode="debug"):
     """
-    sim motor <-- debug
+    sim stage <-- debug
     aerotech  <-- dryrun, production
     """
     if mode.lower() in ['dryrun', 'production']:
         tomostage = TomoStage(name='tomostage')
     elif mode.lower() == 'debug':
-        tomostage = MotorBundle(name="tomostage")
-        tomostage.preci = sim.motor
-        tomostage.samX  = sim.motor
-        tomostage.ksamX = sim.motor
-        tomostage.ksamZ = sim.motor
-        tomostage.samY  = sim.motor
+        tomostage = get_sim_beamline().tomostage
     else:
         raise ValueError(f"🙉: invalide mode, {mode}")
     return tomostage
 
-tomostage = get_motors(mode='debug')
+tomostage = None  # place holder, see mode.set()
 keywords_vars['tomostage'] = 'sim/real tomo stage'
-preci = tomostage.preci
+preci = None  # place holder
 keywords_vars['preci'] = 'rotation control'
-samX = tomostage.samX
+samX = None  # place holder
 keywords_vars['samX'] = 'tomo stage x-translation'
-ksamX = tomostage.ksamX
+ksamX = None  # place holder
 keywords_vars['ksamX'] = 'sample translation above rotation'
-ksamZ = tomostage.ksamZ
+ksamZ = None  # place holder
 keywords_vars['ksamZ'] = 'sample translation above rotation'
-samY = tomostage.samY
+samY = None  # place holder
 keywords_vars['samY'] = 'tomo stage y-translation'
 
 
@@ -97,6 +124,7 @@ import bluesky.plan_stubs as bps
 from bluesky.utils import FailedStatus
 
 import time
+import threading
 
 class TaxiFlyScanDevice(Device):
     """
@@ -140,61 +168,159 @@ class EnsemblePSOFlyDevice(TaxiFlyScanDevice):
 
     scan_control = Component(EpicsSignal, "scanControl")
     
+    # sec, wait for the last triggers once the motion profile is done
+    grace_period = 5
+    # sec, fail the fly scan if not done by then (None: no limit), also
+    # bounds the wait for the end of the motion after the last trigger
+    complete_timeout = None
+    _fly_status = None
+
+    def kickoff(self):
+        """nothing to start, the fly scan is started by complete() (Flyable protocol)"""
+        status = DeviceStatus(self)
+        status.set_finished()
+        return status
+
     def complete(self):
+        """
+        Finish as soon as all expected triggers are counted, or fail once
+        the grace period after the end of the motion (or the fly put
+        completion) has passed without them.  Nothing blocks in the CA
+        callbacks, the grace period runs on a timer thread.
+
+        NOTE: the status only means the data is there, the controller
+              still owns the axis until the fly put completes (run-down),
+              see plan().
+        """
         print("complete()")
         expected_triggers = self.expected_triggers.get()
         start = self.start.get()
         end = self.end.get()
         positive = end > start
-        status = DeviceStatus(self)
+        status = DeviceStatus(self, timeout=self.complete_timeout)
         print(f'start={start:.3}, end={end:.3}, positive={positive}')
-        
+        lock = threading.Lock()
+        timers = []
+        done = []
+
+        def cleanup(*args):
+            for timer in timers:
+                timer.cancel()
+            self.motor_rbv.clear_sub(motion_callback)
+            self.actual_triggers.clear_sub(trigger_callback)
+
+        def finish(msg, exc=None):
+            with lock:
+                if done:
+                    return
+                done.append(exc is None)
+            cleanup()
+            print(msg)
+            if exc is None:
+                status.set_finished()
+            else:
+                status.set_exception(exc)
+
         def check_triggers():
-            if self.actual_triggers.get() != expected_triggers:
-                status._finished(success=False)
-                
-        def callback(value, old_value, **kwargs):
-            # status._finished(success=False)
+            actual = self.actual_triggers.get()
+            if actual >= expected_triggers:
+                finish("Fly scan complete, all triggers received.")
+            else:
+                finish(
+                    "Not enough triggers received. Stopping with failed status.",
+                    NotEnoughTriggers(expected_triggers, actual),
+                )
+
+        def start_grace_period():
+            with lock:
+                if done or timers:
+                    return
+                print(f'Motion profile done.  Waiting {self.grace_period} s for the triggers.')
+                timer = threading.Timer(self.grace_period, check_triggers)
+                timer.daemon = True
+                timers.append(timer)
+                timer.start()
+
+        def trigger_callback(value, **kwargs):
+            if value >= expected_triggers:
+                finish("Fly scan complete, all triggers received.")
+
+        def motion_callback(value, **kwargs):
             if (positive and value > end) or ((not positive) and value < end):
-                print('Motion profile done.  Waiting, then checking triggers.')
-                time.sleep(5)  # grace period for triggers to finish
-                success = self.actual_triggers.get() == expected_triggers
-                if success:
-                    print("Fly scan completion was never confirmed, but we have enough trigger. Finishing successfully...")
-                    status._finished(success=True)
-                else:
-                    print("Not enough triggers received. Stopping with failed status.")
-                    status._finished(success=False)
-                self.motor_rbv.clear_sub(callback)
-                
-        # When we get put-completion from the SSEQ record,
-        # validate that we have the correct number of triggers immediately.
-        # If we do not, finish with failure.
-        fly_status = self.fly.set(self.fly.enum_strs[1])
-        fly_status.add_callback(check_triggers)
+                start_grace_period()
+
+        def on_status_done(status):
+            # clean up also if the status fails on its own (timeout)
+            with lock:
+                if not done:
+                    done.append(status.success)
+            cleanup()
+
+        status.add_callback(on_status_done)
+        # Watch the trigger count, which completes the scan as soon as
+        # the expected number is reached
+        self.actual_triggers.subscribe(trigger_callback, run=False)
         # Watch the motor readback, which is expected to provide readings past it
-        # setpoint / destination. Once it reaches its destination, wait for some
-        # interval and then fail if 
-        self.motor_rbv.subscribe(callback)
-        
+        # setpoint / destination. Once it reaches its destination, give the
+        # triggers a grace period and then fail if they are not all there.
+        self.motor_rbv.subscribe(motion_callback, run=False)
+        # When we get put-completion from the SSEQ record, the triggers
+        # also get the grace period to arrive.
+        fly_status = self.fly.set(self.fly.enum_strs[1])
+        fly_status.add_callback(lambda fly_status: start_grace_period())
+        self._fly_status = fly_status
+
         return status
         
     def plan(self):
+        """
+        Fly (complete) and return once all triggers are counted and the
+        motion is over, i.e. the fly put completed after the run-down, so
+        that the next move of the rotation motor is not sent while the
+        controller still owns the axis.
+        """
         print("plan() start")
+        group = f"{self.name}_complete"
         try:
-            yield from bps.complete(self, wait=True)
+            status = yield from bps.complete(self, group=group)
+            # a suspension (e.g. the shutter) rewinds to here, so the fly
+            # scan is never started twice
+            yield from bps.checkpoint()
+            yield from bps.wait(group=group)
+            # the group is gone once waited for, after a resume the wait
+            # returns at once while the controller is still flying
+            while status is not None and not status.done:
+                yield from bps.sleep(0.1)
+            if status is not None and not status.success:
+                raise FailedStatus(status)
         except FailedStatus:
             raise NotEnoughTriggers(self.expected_triggers.get(), self.actual_triggers.get())
+        if status is None:
+            return  # not run by a RunEngine, nothing flew (e.g. estimate_tomo_scan)
+        if self.actual_triggers.get() < self.expected_triggers.get():
+            raise NotEnoughTriggers(self.expected_triggers.get(), self.actual_triggers.get())
+        yield from self._wait_motion()
         print("plan() end")
 
+    def _wait_motion(self):
+        """wait (at most complete_timeout) for the fly put of the last complete()"""
+        fly_status = self._fly_status
+        t_end = None if self.complete_timeout is None else time.monotonic() + self.complete_timeout
+        while fly_status is not None and not fly_status.done:
+            if t_end is not None and time.monotonic() > t_end:
+                raise TimeoutError(f"🙉: {self.name} still flying {self.complete_timeout} s after the last trigger")
+            yield from bps.sleep(0.05)
+        if fly_status is not None and not fly_status.success:
+            print(f"🙈: fly put of {self.name} failed, {fly_status.exception()!r}")
+
 keywords_func['get_fly_motor'] = 'Return a connection to fly IOC control'
 def get_fly_motor(mode='debug'):
     """
-    sim motor <-- debug
+    sim fly   <-- debug
     fly motor <-- dryrun, production
     """
     if mode.lower() == 'debug':
-        psofly = sim.flyer1
+        psofly = get_sim_beamline().psofly
     elif mode.lower() in ['dryrun', 'production']:
         psofly = EnsemblePSOFlyDevice("6bmpreci:eFly:", name="psofly")
         #psofly = EnsemblePSOFlyDevice("1ide:hexFly1:", name="psofly")   # for test in 1-ID
@@ -202,7 +328,7 @@ def get_fly_motor(mode='debug'):
         raise ValueError(f"🙉: invalide mode, {mode}")
     return psofly
 
-psofly = get_fly_motor(mode='debug')
+psofly = None  # place holder, see mode.set()
 keywords_vars['psofly'] = 'fly control instance'
 
 
@@ -220,6 +346,15 @@ from ophyd import sim
 from pathlib import Path
 import epics
 
+# cam1:FrameType --> SaveDest, the dataset in the HDF5 file (configs/tomo6bma_layout.xml)
+HDF5_DATASETS = {
+    0: '/exchange/data_white_pre',
+    1: '/exchange/data',
+    2: '/exchange/data_white_post',
+    3: '/exchange/data_dark',
+}
+EPICS_EPOCH = 631152000  # 1990-01-01 in unix time
+
 class PointGreyDetectorCam6BM(PointGreyDetectorCam):
     """PointGrey Grasshopper3 cam plugin customizations (properties)"""
     auto_exposure_on_off = ADComponent(EpicsSignalWithRBV, "AutoExposureOnOff")
@@ -238,6 +373,7 @@ class PointGreyDetectorCam6BM(PointGreyDetectorCam):
 class HDF5Plugin6BM(HDF5Plugin):
     """AD HDF5 plugin customizations (properties)"""
     xml_file_name = ADComponent(EpicsSignalWithRBV, "XMLFileName")
+    swmr_mode = ADComponent(EpicsSignalWithRBV, "SWMRMode")
 
 class PointGreyDetector6BM(SingleTrigger, AreaDetector):
     """Point Gray area detector used at 6BM"""
@@ -255,46 +391,815 @@ def get_detector(mode='debug', ADPV_prefix = "1idPG2"):
     """
     sim det  <-- debug
     PG2      <-- dryrun, production
+
+    The detector is not configured here, see configure_detector (run by
+    mode.set() once the detector is connected).
     """
     if mode.lower() == 'debug':
-        det = sim.noisy_det
+        det = get_sim_beamline().det
     elif mode.lower() in ['dryrun', 'production']:
         det = PointGreyDetector6BM(f"{ADPV_prefix}:", name='det')
-
-        # we need to manually setup the PVs to store background and projections
-        # separately in a HDF5 archive
-        # this is the PV we use as the `SaveDest` attribute
-        # check the following page for important information
-        # https://github.com/BCDA-APS/use_bluesky/blob/master/notebooks/sandbox/images_darks_flats.ipynb
-        #
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType.ZRST", "/exchange/data_white_pre")
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType.ONST", "/exchange/data")
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType.TWST", "/exchange/data_white_post")
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType.THST", "/exchange/data_dark")
-        # ophyd needs this configuration
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType_RBV.ZRST", "/exchange/data_white_pre")
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType_RBV.ONST", "/exchange/data")
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType_RBV.TWST", "/exchange/data_white_post")
-        epics.caput(f"{ADPV_prefix}:cam1:FrameType_RBV.THST", "/exchange/data_dark")
-        # set the layout file for cam
-        # TODO: set _root_fp in 00-init level
-        _root_fp = '/home/beams29/S6BM/opt/bluesky_test/ipython-s6bm'
-        _attrib_fp = os.path.join(_root_fp,'configs/PG2_attributes.xml')
-        det.cam.nd_attributes_file.put(_attrib_fp)
-        # set attributes for HDF5 plugin
-        _layout_fp = os.path.join(_root_fp, 'configs/tomo6bma_layout.xml')
-        det.hdf1.xml_file_name.put(_layout_fp)
-        # turn off the problematic auto setting in cam
-        det.cam.auto_exposure_auto_mode.put(0)  
-        det.cam.sharpness_auto_mode.put(0)
-        det.cam.gain_auto_mode.put(0)
-        det.cam.frame_rate_auto_mode.put(0)
     else:
         raise ValueError(f"🙉: invalide mode, {mode}")
 
     return det
 
-det = get_detector(mode='debug')
+keywords_func['configure_detector'] = 'Set the frame type labels, layout and auto modes of a connected detector'
+def configure_detector(det, mode='debug'):
+    """
+    One time setup of the (connected) detector, nothing to do for the sim
+    det <-- debug
+    """
+    if mode.lower() == 'debug':
+        return
+    prefix = det.prefix.rstrip(':')
+    # we need to manually setup the PVs to store background and projections
+    # separately in a HDF5 archive
+    # this is the PV we use as the `SaveDest` attribute
+    # check the following page for important information
+    # https://github.com/BCDA-APS/use_bluesky/blob/master/notebooks/sandbox/images_darks_flats.ipynb
+    #
+    epics.caput(f"{prefix}:cam1:FrameType.ZRST", "/exchange/data_white_pre")
+    epics.caput(f"{prefix}:cam1:FrameType.ONST", "/exchange/data")
+    epics.caput(f"{prefix}:cam1:FrameType.TWST", "/exchange/data_white_post")
+    epics.caput(f"{prefix}:cam1:FrameType.THST", "/exchange/data_dark")
+    # ophyd needs this configuration
+    epics.caput(f"{prefix}:cam1:FrameType_RBV.ZRST", "/exchange/data_white_pre")
+    epics.caput(f"{prefix}:cam1:FrameType_RBV.ONST", "/exchange/data")
+    epics.caput(f"{prefix}:cam1:FrameType_RBV.TWST", "/exchange/data_white_post")
+    epics.caput(f"{prefix}:cam1:FrameType_RBV.THST", "/exchange/data_dark")
+    # set the layout file for cam
+    # TODO: set _root_fp in 00-init level
+    _root_fp = '/home/beams29/S6BM/opt/bluesky_test/ipython-s6bm'
+    _attrib_fp = os.path.join(_root_fp,'configs/PG2_attributes.xml')
+    det.cam.nd_attributes_file.put(_attrib_fp)
+    # set attributes for HDF5 plugin
+    _layout_fp = os.path.join(_root_fp, 'configs/tomo6bma_layout.xml')
+    det.hdf1.xml_file_name.put(_layout_fp)
+    # turn off the problematic auto setting in cam
+    det.cam.auto_exposure_auto_mode.put(0)  
+    det.cam.sharpness_auto_mode.put(0)
+    det.cam.gain_auto_mode.put(0)
+    det.cam.frame_rate_auto_mode.put(0)
+
+det = None  # place holder, see mode.set()
 keywords_vars['det'] = 'Area detector instance'
 
-print(f'leaving {__file__}...\n')
+
+# ----------------- #
+# fly scan watchdog #
+# ----------------- #
+from ophyd import Signal
+from bluesky.suspenders import SuspendCeil
+import bluesky.preprocessors as bpp
+
+class FlyScanStalled(Exception):
+    def __init__(self, counter, expected):
+        self.counter = counter
+        self.expected = expected
+        super().__init__(f"detector stalled at {counter} of {expected} images")
+
+class FlyScanWatchdog():
+    """
+    Watch the image counter of the detector during a fly scan.
+
+    The counter is monitored (no polling of the IOC), and a timer thread
+    updates frame_lag, the number of frames missed since the counter last
+    changed, from the expected frame period (acquire_time+readout_time).
+    The suspender trips when frame_lag exceeds max_missed_frames and aborts
+    the scan with FlyScanStalled.  The fly segment is not resumed (the
+    controller is still flying), its cleanup puts the detector back to
+    internal trigger.
+    """
+
+    def __init__(self, det, readout_time,
+            max_missed_frames=5,
+            first_frame_timeout=30,
+        ):
+        self.det = det
+        self.readout_time = readout_time
+        self.max_missed_frames = max_missed_frames
+        self.first_frame_timeout = first_frame_timeout
+        self.frame_lag = Signal(name='fly_frame_lag', value=0)
+        self.suspender = SuspendCeil(
+            self.frame_lag,
+            max_missed_frames,
+            resume_thresh=0.5,
+            pre_plan=self._on_stall,
+            tripped_message="detector image counter stalled during fly scan",
+        )
+        self._stop = threading.Event()
+        self._thread = None
+        self._cid = None
+
+    def _on_stall(self):
+        counter = self.det.cam.num_images_counter.get()
+        expected = self.n_expected
+        print(f"🙉: fly scan stalled at {counter} of {expected} images, aborting")
+        raise FlyScanStalled(counter, expected)
+        yield  # a plan for the suspender
+
+    def _on_counter(self, value, **kwargs):
+        self._last_count = value
+        self._last_change = time.monotonic()
+
+    def _watch(self):
+        while not self._stop.wait(self.frame_period/2):
+            if self._last_count >= self.n_expected:
+                lag = 0
+            elif self._last_count == self._start_count:
+                # motor still accelerating before the first trigger
+                idle = time.monotonic() - self._last_change
+                lag = max(0, idle - self.first_frame_timeout)/self.frame_period
+            else:
+                lag = (time.monotonic() - self._last_change)/self.frame_period
+            self.frame_lag.put(lag)
+
+    def start(self, n_expected):
+        """start watching for n_expected images"""
+        self.stop()
+        self.n_expected = n_expected
+        self.frame_period = self.det.cam.acquire_time.get() + self.readout_time
+        self._start_count = self._last_count = self.det.cam.num_images_counter.get()
+        self._last_change = time.monotonic()
+        self.frame_lag.put(0)
+        self._cid = self.det.cam.num_images_counter.subscribe(self._on_counter, run=False)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='FlyScanWatchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._cid is not None:
+            self.det.cam.num_images_counter.unsubscribe(self._cid)
+            self._cid = None
+        self.frame_lag.put(0)
+
+    def watch(self, plan, n_expected):
+        """run plan with the watchdog armed for n_expected images"""
+        def arm():
+            self.start(n_expected)
+            yield from bps.install_suspender(self.suspender)
+
+        def disarm():
+            yield from bps.remove_suspender(self.suspender)
+            self.stop()
+
+        return (yield from bpp.finalize_wrapper(bpp.pchain(arm(), plan), disarm()))
+
+# ------------------- #
+# fly scan telemetry  #
+# ------------------- #
+class FlyScanTelemetry(Device):
+    """
+    Record the achieved trigger/frame rate during a fly segment.
+
+    The trigger counter of psofly, the image counter of the detector and
+    the queue and dropped arrays of the file plugin are monitored; every
+    interval seconds a sample (rates, frame lag behind the triggers, plugin
+    queue) is taken and dropped frames are reported right away.  The
+    segment ends with the last frame, at most one frame period after the
+    fly is complete.  At the end the samples are saved as the event stream
+    'fly_telemetry' of the run and the effective frame rate is compared
+    with the expected one (from the slew speed and scan delta of the plan).
+    """
+    trigger_rate = Component(Signal, value=0.0)
+    frame_rate = Component(Signal, value=0.0)
+    frame_lag = Component(Signal, value=0)
+    queue_use = Component(Signal, value=0)
+    dropped = Component(Signal, value=0)
+
+    def __init__(self, *args, interval=0.5, max_lag=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.max_lag = max_lag
+        self.samples = []
+        self.summary = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._cids = []
+
+    def _updater(self, key):
+        def callback(value, **kwargs):
+            # the counters are reset when the fly (acquisition) starts
+            if key != 'queue_use' and value < self._start[key]:
+                self._start[key] = 0
+            if key == 'frames' and value > self._latest[key]:
+                self._t_frames.append(time.time())
+                del self._t_frames[1:-1]  # first and last
+            self._latest[key] = value
+        return callback
+
+    def _behind(self):
+        """frames still expected for the triggers sent"""
+        latest, start = self._latest, self._start
+        return (latest['triggers'] - start['triggers']) - (latest['frames'] - start['frames'])
+
+    def wait_frames(self):
+        """plan stub: wait (at most one frame period) for the frames of the last triggers"""
+        t_end = time.time() + (1/self.expected_fps if self.expected_fps else 0)
+        while self._thread is not None and self._behind() > 0 and time.time() < t_end:
+            yield from bps.sleep(0.01)
+
+    def _sample(self):
+        start, expected_fps = self._start, self.expected_fps
+        last_t, last = self._t0, dict(self._latest)
+        while not self._stop.wait(self.interval):
+            now, cur = time.time(), dict(self._latest)
+            dt = now - last_t
+            sample = {
+                'time': now,
+                'trigger_rate': (cur['triggers'] - last['triggers'])/dt,
+                'frame_rate': (cur['frames'] - last['frames'])/dt,
+                'frame_lag': (cur['triggers'] - start['triggers']) - (cur['frames'] - start['frames']),
+                'queue_use': cur['queue_use'],
+                'dropped': cur['dropped'] - start['dropped'],
+            }
+            if sample['dropped'] > last['dropped'] - start['dropped'] or sample['frame_lag'] > self.max_lag:
+                print(f"🙈: {sample['dropped']} frames dropped, "
+                      f"detector {sample['frame_lag']} frames behind the triggers, "
+                      f"{sample['frame_rate']:.1f} fps (expected {expected_fps:.1f})")
+            self.samples.append(sample)
+            last_t, last = now, cur
+
+    def start(self, det, psofly, plugin, expected_fps):
+        """take the baseline counters now and start sampling in a background thread"""
+        self.samples = []
+        self.summary = {}
+        self.expected_fps = expected_fps
+        sources = {
+            'triggers': psofly.actual_triggers,
+            'frames': det.cam.num_images_counter,
+            'queue_use': plugin.queue_use,
+            'dropped': plugin.dropped_arrays,
+        }
+        self._latest = {key: signal.get() for key, signal in sources.items()}
+        self._start = dict(self._latest)
+        self._t0, self._t_frames = time.time(), []
+        for key, signal in sources.items():
+            self._cids.append((signal, signal.subscribe(self._updater(key), run=False)))
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample,
+            name='FlyScanTelemetry',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """stop the clock (at the last frame) and the sampling, summarize the segment"""
+        if self._thread is None:
+            return
+        frame_times = list(self._t_frames)
+        duration = (frame_times[-1] if frame_times else time.time()) - self._t0
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        for signal, cid in self._cids:
+            signal.unsubscribe(cid)
+        self._cids = []
+        latest, start = self._latest, self._start
+        n_frames = latest['frames'] - start['frames']
+        self.summary = {
+            'duration': duration,
+            'frames': n_frames,
+            'triggers': latest['triggers'] - start['triggers'],
+            'dropped': latest['dropped'] - start['dropped'],
+            # between the first and the last frame, without the run-up
+            'effective_fps': (
+                (n_frames - 1)/(frame_times[-1] - frame_times[0])
+                if n_frames > 1 and frame_times[-1] > frame_times[0] else 0.0
+            ),
+            'expected_fps': self.expected_fps,
+        }
+
+    def report(self):
+        """print the summary of the last fly segment"""
+        s = self.summary
+        if not s:
+            return
+        print(f"🙊: fly segment took {s['duration']:.1f} s for {s['frames']} frames "
+              f"({s['triggers']} triggers, {s['dropped']} dropped): "
+              f"{s['effective_fps']:.2f} fps effective vs {s['expected_fps']:.2f} fps expected")
+
+    def save_stream(self, stream='fly_telemetry'):
+        """plan stub: save the samples as an event stream of the open run"""
+        for sample in self.samples:
+            for key in ['trigger_rate', 'frame_rate', 'frame_lag', 'queue_use', 'dropped']:
+                getattr(self, key).put(sample[key], timestamp=sample['time'])
+            yield from bps.create(name=stream)
+            yield from bps.read(self)
+            yield from bps.save()
+
+    def record(self, plan, det, psofly, plugin, expected_fps):
+        """run plan (the fly segment) while recording the telemetry"""
+        def segment():
+            ret = yield from plan
+            yield from self.wait_frames()
+            self.stop()  # not after the cleanup
+            return ret
+
+        def finalize():
+            self.stop()
+            self.report()
+            yield from self.save_stream()
+
+        self.start(det, psofly, plugin, expected_fps)
+        return (yield from bpp.finalize_wrapper(segment(), finalize()))
+
+
+# ------------------------- #
+# simulated 6-BM-A beamline #
+# ------------------------- #
+# NOTE:
+#  The simulated devices are fake (no IOC) twins of the real classes above,
+#  with the IOC behavior added through sim_put/sim_set_putter, so that the
+#  plans run the same code path as in production, in real time.
+from ophyd.sim import make_fake_device
+from ophyd.utils.epics_pvs import AlarmSeverity
+import os
+import queue
+
+def _is_on(value):
+    """True for the on/enable/yes values of a bo/mbbo record"""
+    return value in (1, True, '1', 'Enable', 'Yes', 'On', 'Capture', 'Acquire')
+
+class SimMotor(make_fake_device(EpicsMotor)):
+    """
+    EpicsMotor without IOC, moving with a trapezoidal profile (VELO, ACCL)
+    and a readback updated every update_period seconds.
+    """
+    update_period = 0.005
+
+    def __init__(self, *args, velocity=1.0, acceleration=0.2, egu='mm', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.velocity.sim_put(velocity)
+        self.acceleration.sim_put(acceleration)
+        self.motor_egu.sim_put(egu)
+        self.user_setpoint.sim_set_limits((0, 0))  # no soft limits
+        self.user_setpoint._use_limits = False
+        self.user_readback.alarm_severity = AlarmSeverity.NO_ALARM
+        self.user_readback.sim_put(0.0)
+        self.motor_done_move.sim_put(1)
+        self.user_setpoint.sim_set_putter(self._sim_move)
+        self.motor_stop.sim_set_putter(self._sim_stop)
+        self._motion = None  # stop event of the current move
+        self._motion_lock = threading.Lock()
+
+    def _sim_move(self, target, *args, velocity=None, **kwargs):
+        """
+        start a move (at velocity instead of VELO if given), return an event
+        set once it is over (done, stopped or retargeted)
+        """
+        self.user_setpoint.sim_put(target)
+        with self._motion_lock:
+            if self._motion is not None:
+                self._motion.set()  # retarget, no DMOV in between
+            else:
+                self.motor_is_moving.sim_put(1)
+                self.motor_done_move.sim_put(0)
+            self._motion = threading.Event()
+        over = threading.Event()
+        threading.Thread(target=self._run_profile, args=(target, self._motion, over, velocity), daemon=True).start()
+        return over
+
+    def _sim_stop(self, *args, **kwargs):
+        with self._motion_lock:
+            if self._motion is None:
+                return
+            self._motion.set()
+            self._motion = None
+        self.motor_is_moving.sim_put(0)
+        self.motor_done_move.sim_put(1)
+
+    def _run_profile(self, target, stop, over, velocity=None):
+        x0 = self.user_readback.get()
+        distance = abs(target - x0)
+        sign = 1 if target >= x0 else -1
+        velocity = self.velocity.get() if velocity is None else velocity
+        t_accl = max(self.acceleration.get(), 1e-3)
+        if velocity > 0 and distance > 0:
+            accel = velocity/t_accl
+            if distance < velocity*t_accl:
+                # never reach the full velocity
+                t_accl = np.sqrt(distance/accel)
+                velocity = accel*t_accl
+            t_total = 2*t_accl + (distance - velocity*t_accl)/velocity
+
+            def travel(t):
+                if t < t_accl:
+                    return 0.5*accel*t**2
+                if t < t_total - t_accl:
+                    return 0.5*velocity*t_accl + velocity*(t - t_accl)
+                return distance - 0.5*accel*(t_total - t)**2
+
+            t0 = time.monotonic()
+            while not stop.wait(self.update_period):
+                t = time.monotonic() - t0
+                if t >= t_total:
+                    break
+                self.user_readback.sim_put(x0 + sign*travel(t))
+        with self._motion_lock:
+            done = self._motion is stop and not stop.is_set()
+            if done:
+                self._motion = None
+        if done:
+            self.user_readback.sim_put(target)
+            self.motor_is_moving.sim_put(0)
+            self.motor_done_move.sim_put(1)
+        over.set()
+
+class SimTomoStage(MotorBundle):
+    """TomoStage without IOC, VELO/ACCL as on the beamline"""
+    preci = Component(SimMotor, "6bmpreci:m1", velocity=20.0, acceleration=0.5, egu='deg')
+    samX  = Component(SimMotor, "6bma1:m19", velocity=2.0, acceleration=0.2)
+    ksamX = Component(SimMotor, "6bma1:m11", velocity=0.5, acceleration=0.2)
+    ksamZ = Component(SimMotor, "6bma1:m12", velocity=0.5, acceleration=0.2)
+    samY  = Component(SimMotor, "6bma1:m18", velocity=1.0, acceleration=0.2)
+
+class SimBusySignal(Signal):
+    """busy record, a put completes once action (run in a thread) is done"""
+
+    def __init__(self, *args, enum_strs=('Done', 'Busy'), **kwargs):
+        super().__init__(*args, value=0, **kwargs)
+        self._enum_strs = tuple(enum_strs)
+        self.action = None
+
+    @property
+    def enum_strs(self):
+        return self._enum_strs
+
+    def set(self, value, **kwargs):
+        status = DeviceStatus(self)
+        if value in (0, self._enum_strs[0]):
+            super().put(0)
+            status.set_finished()
+            return status
+        super().put(1)
+
+        def run():
+            try:
+                if self.action is not None:
+                    self.action()
+            except Exception as err:
+                Signal.put(self, 0)
+                status.set_exception(err)
+            else:
+                Signal.put(self, 0)
+                status.set_finished()
+
+        threading.Thread(target=run, daemon=True).start()
+        return status
+
+    def put(self, value, **kwargs):
+        self.set(value)
+
+class SimEnsemblePSOFlyDevice(make_fake_device(EnsemblePSOFlyDevice)):
+    """
+    EnsemblePSOFlyDevice without IOC: taxi moves the rotation motor to the
+    run-up position before start, fly rotates it past end at slew_speed and
+    counts a trigger (time stamped at the crossing) every scan_delta from
+    start to end.  As on the controller, the fly profile does not touch the
+    VELO of the motor and the fly put completes once the motor stopped
+    after the run-down.  complete() and plan() are the ones of the real
+    device.
+    """
+    taxi = Component(SimBusySignal, enum_strs=('Done', 'Taxi'))
+    fly = Component(SimBusySignal, enum_strs=('Done', 'Fly'))
+
+    def __init__(self, *args, rotation=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rotation = rotation
+        self.taxi.action = self._taxi
+        self.fly.action = self._fly
+        for signal, value in [(self.start, 0.0), (self.end, 0.0), (self.scan_delta, 1.0), (self.slew_speed, 1.0)]:
+            signal.sim_put(value)  # float PVs
+        for signal in [self.start, self.end, self.scan_delta, self.slew_speed]:
+            signal.subscribe(self._calc, run=False)
+        self._calc()
+        rotation.user_readback.subscribe(lambda value, **kwargs: self.motor_rbv.sim_put(value))
+
+    def _calc(self, **kwargs):
+        """calcNumTriggers and deltaTime of the IOC"""
+        start, end = self.start.get(), self.end.get()
+        delta, speed = abs(self.scan_delta.get()), self.slew_speed.get()
+        self.expected_triggers.sim_put(int(round(abs(end - start)/delta)) + 1 if delta else 0)
+        self.delta_time.sim_put(delta/speed if speed else 0)
+
+    def _run_up(self):
+        """distance needed to reach slew_speed"""
+        return self.slew_speed.get()*self.rotation.acceleration.get()
+
+    def _direction(self):
+        return 1 if self.end.get() >= self.start.get() else -1
+
+    def _taxi(self):
+        # the controller moves the motor itself, no MoveStatus
+        self.actual_triggers.sim_put(0)
+        self.rotation._sim_move(self.start.get() - self._direction()*self._run_up()).wait()
+
+    def _fly(self):
+        sign = self._direction()
+        n = self.expected_triggers.get()
+        positions = self.start.get() + sign*abs(self.scan_delta.get())*np.arange(n)
+        last = [self.rotation.user_readback.get(), time.time(), 0]  # position, time, triggers
+
+        def on_readback(value, **kwargs):
+            now = time.time()
+            x0, t0, k = last
+            while k < n and sign*(value - positions[k]) >= 0:
+                # time of the crossing, between the two readbacks
+                t_k = t0 + (positions[k] - x0)/(value - x0)*(now - t0) if value != x0 else now
+                k += 1
+                self.actual_triggers.sim_put(k, timestamp=t_k)
+            last[:] = value, now, k
+
+        cid = self.rotation.user_readback.subscribe(on_readback, run=False)
+        try:
+            # the busy record stays busy until the end of the deceleration
+            self.rotation._sim_move(
+                self.end.get() + sign*self._run_up(),
+                velocity=self.slew_speed.get(),
+            ).wait()
+        finally:
+            self.rotation.user_readback.unsubscribe(cid)
+
+class SimPointGreyDetector6BM(make_fake_device(PointGreyDetector6BM)):
+    """
+    PointGreyDetector6BM without IOC.
+
+    The cam acquires num_images frames, every acquire_period (Internal) or
+    on each trigger of psofly (external, triggers during the readout of the
+    previous frame are lost).  A frame is the projection of a phantom on
+    the stage (cylinder with an inclusion, at samX/samY, off the rotation
+    axis by ksamX/ksamZ), dark when the shutter is closed.  proc1 outputs
+    the average of num_filter frames, tiff1/hdf1 write real files (HDF5
+    with the datasets of HDF5_DATASETS and the time stamps in /defaults,
+    SWMR if swmr_mode) and close after num_capture frames.
+    """
+    readout_time = 0.005   # s, dead time between frames
+    pixel_size = 0.003     # mm
+    white_level = 1000
+    dark_level = 100
+    noise = 5
+
+    def __init__(self, *args, tomostage=None, shutter=None, psofly=None, shape=(256, 320), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tomostage = tomostage
+        self.shutter = shutter
+        self.shape = shape
+        for walk in self.walk_signals(include_lazy=True):
+            walk.item.as_string = False  # a put reads back as it was put
+        for signal, value in {
+            self.cam.acquire_time:      0.05,
+            self.cam.acquire_period:    0.1,
+            self.cam.num_images:        1,
+            self.cam.image_mode:        'Multiple',
+            self.cam.trigger_mode:      'Internal',
+            self.cam.array_size.array_size_x: shape[1],
+            self.cam.array_size.array_size_y: shape[0],
+            self.proc1.enable:          1,
+            self.proc1.num_filter:      1,
+            self.proc1.nd_array_port:   'PG1',
+        }.items():
+            signal.sim_put(value)
+        # asyn ports, checked at stage
+        self.cam.port_name.sim_put('PG1')
+        for plugin, port in [(self.proc1, 'PROC1'), (self.tiff1, 'TIFF1'), (self.hdf1, 'HDF1')]:
+            plugin.port_name.sim_put(port)
+            plugin.plugin_type.sim_put(plugin._plugin_type)
+            # primed, as if one frame went through
+            plugin.array_size.height.sim_put(shape[0])
+            plugin.array_size.width.sim_put(shape[1])
+        for plugin, ext in [(self.tiff1, 'tiff'), (self.hdf1, 'hdf')]:
+            plugin.nd_array_port.sim_put('PROC1')
+            plugin.file_path.sim_put('/tmp/')
+            plugin.file_name.sim_put('sim')
+            plugin.file_template.sim_put(f"%s%s_%06d.{ext}")
+            plugin.auto_increment.sim_put(1)
+            plugin.capture.subscribe(self._on_capture, run=False)
+        self._lock = threading.RLock()  # closing a file puts capture
+        self._files = {}          # {plugin: open file}
+        self._filter = []         # proc1 frames to average
+        self._triggers = queue.Queue()
+        self._acquiring = None    # stop event of the acquisition
+        self.cam.acquire.subscribe(self._on_acquire, run=False)
+        self.proc1.reset_filter.sim_set_putter(self._reset_filter)
+        if psofly is not None:
+            psofly.actual_triggers.subscribe(self._on_trigger, run=False)
+
+    # ----- cam ----- #
+    def _on_acquire(self, value, old_value=None, **kwargs):
+        if _is_on(value) and self._acquiring is None:
+            self._acquiring = threading.Event()
+            threading.Thread(target=self._acquire, args=(self._acquiring,), daemon=True).start()
+        elif not _is_on(value) and self._acquiring is not None:
+            self._acquiring.set()
+
+    def _on_trigger(self, value, old_value=None, timestamp=None, **kwargs):
+        if value and self._acquiring is not None:
+            self._triggers.put(timestamp or time.time())
+
+    def _internal(self):
+        return self.cam.trigger_mode.get() in (0, 'Internal')
+
+    def _acquire(self, stop):
+        image_mode = self.cam.image_mode.get()
+        if image_mode in (0, 'Single'):
+            n_images = 1
+        elif image_mode in (2, 'Continuous'):
+            n_images = np.inf
+        else:
+            n_images = self.cam.num_images.get()
+        self.cam.num_images_counter.sim_put(0)
+        self._triggers = queue.Queue()
+        n, busy_until = 0, time.time()
+        try:
+            while n < n_images and not stop.is_set():
+                exposure = self.cam.acquire_time.get()
+                if self._internal():
+                    period = max(self.cam.acquire_period.get(), exposure + self.readout_time)
+                    t_start = max(busy_until, time.time())
+                    if stop.wait(max(0, t_start + period - time.time())):
+                        break
+                else:
+                    try:
+                        t_start = self._triggers.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if t_start < busy_until:
+                        continue  # still reading out, the trigger is lost
+                    if stop.wait(max(0, t_start + exposure - time.time())):
+                        break
+                busy_until = t_start + exposure + self.readout_time
+                self._frame(self._image(), t_start + exposure)
+                n += 1
+        except Exception as err:
+            print(f"🙉: simulated {self.name} stopped, {type(err).__name__}: {err}")
+        finally:
+            self._acquiring = None
+            self.cam.acquire.sim_put(0)
+
+    def _image(self):
+        """one frame of the phantom, as seen now"""
+        ny, nx = self.shape
+        rng = np.random.default_rng()
+        dark = self.dark_level + self.noise*rng.standard_normal(self.shape)
+        if self.shutter is not None and self.shutter.state != 'open':
+            return np.clip(dark, 0, 65535).astype(np.uint16)
+        pos = {name: getattr(self.tomostage, name).user_readback.get()
+               for name in ['preci', 'samX', 'samY', 'ksamX', 'ksamZ']}
+        theta = np.radians(pos['preci'])
+        x = (np.arange(nx) - nx/2)*self.pixel_size
+        y = (np.arange(ny) - ny/2)*self.pixel_size
+        center = pos['samX'] + pos['ksamX']*np.cos(theta) + pos['ksamZ']*np.sin(theta)
+        inclusion = center + 0.12*np.cos(theta + 0.5)
+
+        def chord(x0, r):
+            return 2*np.sqrt(np.clip(r**2 - (x - x0)**2, 0, None))
+
+        # mu in 1/mm, the sample is 0.6 mm high
+        attenuation = 1.5*chord(center, 0.25) + 3.0*chord(inclusion, 0.05)
+        in_sample = (np.abs(y - pos['samY']) < 0.3)[:, None]
+        white = self.white_level*np.exp(-attenuation*in_sample)
+        image = white + dark + np.sqrt(white)*rng.standard_normal(self.shape)
+        return np.clip(image, 0, 65535).astype(np.uint16)
+
+    def _reset_filter(self, value, *args, **kwargs):
+        self.proc1.reset_filter.sim_put(value)
+        self._filter.clear()
+
+    def _put_increment(self, signal):
+        signal.sim_put((signal.get() or 0) + 1)
+
+    # ----- plugins ----- #
+    def _frame(self, image, timestamp):
+        """pass one frame down the cam --> proc1 --> tiff1/hdf1 chain"""
+        self._put_increment(self.cam.num_images_counter)
+        self._put_increment(self.cam.array_counter)
+        frame_type = self.cam.frame_type.get()
+        processed = image
+        if _is_on(self.proc1.enable.get()) and self.proc1.num_filter.get() > 1:
+            self._filter.append(image)
+            processed = None
+            if len(self._filter) >= self.proc1.num_filter.get():
+                processed = np.mean(self._filter, axis=0).astype(np.uint16)
+                self._filter.clear()
+        if processed is not None:
+            self._put_increment(self.proc1.array_counter)
+        for plugin in [self.tiff1, self.hdf1]:
+            data = processed if plugin.nd_array_port.get() == 'PROC1' else image
+            if data is None or not _is_on(plugin.enable.get()):
+                continue
+            self._put_increment(plugin.array_counter)
+            with self._lock:
+                if plugin in self._files:
+                    self._write(plugin, data, frame_type, timestamp)
+
+    def _file_name(self, plugin):
+        path = plugin.file_path.get()
+        os.makedirs(path, exist_ok=True)
+        return plugin.file_template.get() % (path, plugin.file_name.get(), plugin.file_number.get())
+
+    def _on_capture(self, value, old_value=None, obj=None, **kwargs):
+        plugin = obj.parent
+        with self._lock:
+            if _is_on(value) and plugin not in self._files:
+                plugin.num_captured.sim_put(0)
+                self._files[plugin] = self._open_hdf5(plugin) if plugin is self.hdf1 else None
+            elif not _is_on(value) and plugin in self._files:
+                self._close(plugin)
+
+    def _open_hdf5(self, plugin):
+        import h5py
+        ny, nx = self.shape
+        fn = self._file_name(plugin)
+        plugin.full_file_name.sim_put(fn)
+        h5 = h5py.File(fn, 'w', libver='latest')
+        for path in HDF5_DATASETS.values():
+            h5.create_dataset(path, (0, ny, nx), maxshape=(None, ny, nx), dtype='u2', chunks=(1, ny, nx))
+        # SaveDest is DBR_STRING (configs/tomo6bma_attributes.xml)
+        h5.create_dataset('/defaults/SaveDest', (0,), maxshape=(None,), dtype='S40')
+        for key in ['NDArrayEpicsTSSec', 'NDArrayEpicsTSnSec']:
+            h5.create_dataset(f'/defaults/{key}', (0,), maxshape=(None,), dtype='i4')
+        if _is_on(plugin.swmr_mode.get()):
+            h5.swmr_mode = True
+        return h5
+
+    def _write(self, plugin, data, frame_type, timestamp):
+        if plugin is self.tiff1:
+            from PIL import Image
+            fn = self._file_name(plugin)
+            Image.fromarray(data).save(fn)
+            plugin.full_file_name.sim_put(fn)
+            if _is_on(plugin.auto_increment.get()):
+                self._put_increment(plugin.file_number)
+        else:
+            h5 = self._files[plugin]
+            sec = timestamp - EPICS_EPOCH
+            for path, value in [
+                (HDF5_DATASETS[frame_type], data),
+                ('/defaults/SaveDest', HDF5_DATASETS[frame_type].encode()),
+                ('/defaults/NDArrayEpicsTSSec', int(sec)),
+                ('/defaults/NDArrayEpicsTSnSec', int(1e9*(sec % 1))),
+            ]:
+                dset = h5[path]
+                dset.resize(dset.shape[0] + 1, axis=0)
+                dset[-1] = value
+            flush = plugin.num_frames_flush.get()
+            if h5.swmr_mode and flush and plugin.num_captured.get() % flush == flush - 1:
+                h5.flush()
+        self._put_increment(plugin.num_captured)
+        if 0 < plugin.num_capture.get() <= plugin.num_captured.get():
+            self._close(plugin)
+
+    def _close(self, plugin):
+        h5 = self._files.pop(plugin)
+        if h5 is not None:
+            h5.close()
+            if _is_on(plugin.auto_increment.get()):
+                self._put_increment(plugin.file_number)
+        plugin.capture.sim_put(0)
+
+class SimBeamline6BM():
+    """
+    6-BM-A without IOC (debug mode), wired like the real one: psofly moves
+    preci and triggers det, det sees the shutter and the stage.
+    """
+
+    def __init__(self, shape=(256, 320)):
+        self.shutter = APS_devices.SimulatedApsPssShutterWithStatus(name="A_shutter")
+        self.tomostage = SimTomoStage(name='tomostage')
+        self.psofly = SimEnsemblePSOFlyDevice(
+            "6bmpreci:eFly:",
+            name="psofly",
+            rotation=self.tomostage.preci,
+        )
+        self.det = SimPointGreyDetector6BM(
+            "1idPG2:",
+            name='det',
+            tomostage=self.tomostage,
+            shutter=self.shutter,
+            psofly=self.psofly,
+            shape=shape,
+        )
+
+    def __repr__(self):
+        return f"SimBeamline6BM(det {self.det.shape}, preci at {self.tomostage.preci.position:.3f})"
+
+_sim_beamline = None
+_sim_beamline_lock = threading.Lock()
+
+keywords_func['get_sim_beamline'] = 'Return the simulated 6-BM-A beamline (debug mode)'
+def get_sim_beamline():
+    """the simulated beamline, built once (the devices keep their state)"""
+    global _sim_beamline
+    with _sim_beamline_lock:
+        if _sim_beamline is None:
+            _sim_beamline = SimBeamline6BM()
+    return _sim_beamline
+
+_startup_leave(__file__)
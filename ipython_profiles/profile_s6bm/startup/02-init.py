@@ -1,49 +1,370 @@
-print(f'Enter {__file__}...')
+_startup_enter(__file__)
+# ----- parallel device initialization ----- #
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait as wait_futures
+
+
+class DeviceFactory():
+    """
+    A named node in the device dependency graph
+
+    func is called as func(mode, **deps) where deps maps the name of each
+    dependency to the device it produced.  The returned object is waited
+    on for at most timeout seconds (no waiting if timeout is None), then
+    setup(device, mode) is called if given, for the puts that need the
+    device connected.
+    """
+
+    def __init__(self, name, func, depends=(), timeout=10, setup=None):
+        self.name = name
+        self.func = func
+        self.depends = tuple(depends)
+        self.timeout = timeout
+        self.setup = setup
+
+    def __repr__(self):
+        return f"DeviceFactory({self.name}, depends={list(self.depends)}, timeout={self.timeout})"
+
+    def build(self, mode, **deps):
+        """create the device, wait for its connection, then set it up"""
+        device = self.func(mode, **deps)
+        if self.timeout is not None and hasattr(device, 'wait_for_connection'):
+            device.wait_for_connection(timeout=self.timeout)
+        if self.setup is not None:
+            self.setup(device, mode)
+        return device
+
+
+class DeviceInitError(Exception):
+    """some devices failed to initialize, errors is {name: exception}"""
+
+    def __init__(self, mode, errors):
+        self.mode = mode
+        self.errors = errors
+        msg = ", ".join(f"{name} ({type(err).__name__}: {err})" for name, err in errors.items())
+        super().__init__(f"🙉: cannot initialize {msg} for mode {mode}, devices are unchanged")
+
+
+def _attach_ca_context():
+    """worker threads need to share the CA context of the main thread"""
+    try:
+        epics.ca.use_initial_context()
+    except Exception:
+        pass
+
+
+class DeviceInitEngine():
+    """
+    Build all devices in a dependency graph concurrently with a thread pool.
+
+    A factory is submitted as soon as all of its dependencies are built, and
+    the connect time (construction + connection + setup) of each device is
+    recorded in self.timings, whether it succeeded or not.  The devices are returned as a dict only when every
+    factory succeeded, so that the caller can swap them in all at once.
+    """
+
+    def __init__(self, factories, max_workers=8):
+        self.factories = {f.name: f for f in factories}
+        self.max_workers = max_workers
+        self.timings = {}
+        self.errors = {}
+        self._check_graph()
+
+    def _check_graph(self):
+        """make sure every dependency exists and there is no cycle"""
+        for f in self.factories.values():
+            for dep in f.depends:
+                if dep not in self.factories:
+                    raise ValueError(f"🙉: {f.name} depends on unknown device {dep}")
+        done, todo = set(), set(self.factories)
+        while todo:
+            ready = {n for n in todo if set(self.factories[n].depends) <= done}
+            if not ready:
+                raise ValueError(f"🙉: circular device dependency among {sorted(todo)}")
+            done |= ready
+            todo -= ready
+
+    def _timed_build(self, factory, mode, deps):
+        t0 = time.perf_counter()
+        try:
+            return factory.build(mode, **deps)
+        finally:
+            self.timings[factory.name] = time.perf_counter() - t0
+
+    def run(self, mode):
+        """build all devices for given mode, return {name: device}"""
+        self.timings = {}
+        devices, errors = {}, {}
+        pending = dict(self.factories)
+        running = {}
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_attach_ca_context,
+        ) as pool:
+            while pending or running:
+                # submit every factory whose dependencies are ready
+                for name, f in list(pending.items()):
+                    if any(dep in errors for dep in f.depends):
+                        errors[name] = RuntimeError(f"dependency of {name} failed")
+                        del pending[name]
+                    elif all(dep in devices for dep in f.depends):
+                        deps = {dep: devices[dep] for dep in f.depends}
+                        running[pool.submit(self._timed_build, f, mode, deps)] = name
+                        del pending[name]
+                if not running:
+                    break
+                finished, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        devices[name] = future.result()
+                    except Exception as err:
+                        errors[name] = err
+
+        self.errors = errors
+        if errors:
+            # the first failure that is not only a failed dependency
+            cause = next(
+                (err for name, err in errors.items()
+                 if not any(dep in errors for dep in self.factories[name].depends)),
+                next(iter(errors.values())),
+            )
+            raise DeviceInitError(mode, errors) from cause
+        return devices
+
+    def lazy(self, mode):
+        """return {name: LazyDevice}, nothing is built until first use"""
+        self.timings = {}
+        self.errors = {}
+        proxies = {
+            name: LazyDevice(f, mode, {}, engine=self)
+            for name, f in self.factories.items()
+        }
+        for name, f in self.factories.items():
+            proxies[name]._deps.update({dep: proxies[dep] for dep in f.depends})
+        return proxies
+
+    def report(self):
+        """print the connect time of each device, slowest first, and the failures"""
+        print("🙊: device connect time:")
+        for name, dt in sorted(self.timings.items(), key=lambda x: -x[1]):
+            status = f"\t🙉 {type(self.errors[name]).__name__}" if name in self.errors else ""
+            print(f"\t{name}:\t{dt:.3f} s{status}")
+        for name in self.factories:
+            if name not in self.timings:
+                status = "dependency failed" if name in self.errors else "not built"
+                print(f"\t{name}:\t{status}")
+        print()
+
+
+class LazyDevice():
+    """
+    Proxy that creates and connects a device on first attribute access.
+
+    The built device is cached by the proxy, and a fresh (unbuilt) proxy is
+    created at the next mode.set(), so each mode change reconnects once.
+    """
+
+    def __init__(self, factory, mode, deps, engine=None):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_mode', mode)
+        object.__setattr__(self, '_deps', dict(deps))
+        object.__setattr__(self, '_engine', engine)
+        object.__setattr__(self, '_device', None)
+        object.__setattr__(self, '_lock', threading.RLock())
+
+    def _resolve(self):
+        """build (once) and return the actual device"""
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    deps = {name: dev._resolve() for name, dev in self._deps.items()}
+                    t0 = time.perf_counter()
+                    try:
+                        device = self._factory.build(self._mode, **deps)
+                    finally:
+                        if self._engine is not None:
+                            self._engine.timings[self._factory.name] = time.perf_counter() - t0
+                    object.__setattr__(self, '_device', device)
+        return self._device
+
+    @property
+    def connected_(self):
+        """True if the device has been built"""
+        return self._device is not None
+
+    @property
+    def __class__(self):
+        # isinstance() checks in bluesky/ophyd see the actual device once
+        # it is built, an introspection alone must not connect it
+        if self._device is None:
+            return LazyDevice
+        return type(self._device)
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __dir__(self):
+        return dir(self._resolve())
+
+    def __repr__(self):
+        if self._device is None:
+            return f"LazyDevice({self._factory.name}, mode={self._mode}, not connected yet)"
+        return repr(self._device)
+
+
+keywords_vars['device_factories'] = 'dependency graph of devices used by mode.set()'
+device_factories = [
+    DeviceFactory('aps', get_aps, timeout=None),  # many PVs, connect on use
+    DeviceFactory('A_shutter', get_shutter),
+    DeviceFactory('suspend_A_shutter',
+        lambda mode, A_shutter: SuspendFloor(A_shutter.pss_state, 1),
+        depends=['A_shutter'],
+        timeout=None,
+    ),
+    DeviceFactory('tomostage', get_motors),
+    DeviceFactory('preci', lambda mode, tomostage: tomostage.preci, depends=['tomostage']),
+    DeviceFactory('samX',  lambda mode, tomostage: tomostage.samX,  depends=['tomostage']),
+    DeviceFactory('ksamX', lambda mode, tomostage: tomostage.ksamX, depends=['tomostage']),
+    DeviceFactory('ksamZ', lambda mode, tomostage: tomostage.ksamZ, depends=['tomostage']),
+    DeviceFactory('samY',  lambda mode, tomostage: tomostage.samY,  depends=['tomostage']),
+    DeviceFactory('psofly', get_fly_motor),
+    DeviceFactory('det', get_detector, timeout=20, setup=configure_detector),
+]
+
+
+# ----- device settings cache ----- #
+class SettingsCache():
+    """
+    Cache of the last known value of device settings.
+
+    A signal is monitored from its first lookup on, so the cached value
+    follows the IOC (readback, i.e. as clamped or rounded by the IOC)
+    without further round trips.  Puts do not write to the cache.  The entry of a signal
+    is dropped when it disconnects, and the whole cache at mode.set().
+    """
+
+    def __init__(self):
+        self._values = {}  # {signal: last known value}
+        self._cids = {}    # {signal: [subscription id]}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"SettingsCache({len(self._values)} signals, hits={self.hits}, misses={self.misses})"
+
+    def get(self, signal):
+        """return the cached value of signal, read (and monitor) it on a miss"""
+        with self._lock:
+            if signal in self._values:
+                self.hits += 1
+                return self._values[signal]
+        self.misses += 1
+        value = signal.get()
+        self._watch(signal)
+        with self._lock:
+            self._values.setdefault(signal, value)
+        return value
+
+    def peek(self, signal, default=None):
+        """
+        return the cached value of signal without any I/O, default on a
+        miss (the signal is monitored from now on)
+        """
+        with self._lock:
+            if signal in self._values:
+                self.hits += 1
+                return self._values[signal]
+        self.misses += 1
+        self._watch(signal)
+        with self._lock:
+            return self._values.get(signal, default)
+
+    def invalidate(self, signal):
+        with self._lock:
+            self._values.pop(signal, None)
+
+    def clear(self):
+        """drop every entry and stop monitoring"""
+        with self._lock:
+            cids, self._cids = self._cids, {}
+            self._values = {}
+        for signal, ids in cids.items():
+            for cid in ids:
+                signal.unsubscribe(cid)
+
+    def _watch(self, signal):
+        with self._lock:
+            if signal in self._cids:
+                return
+            self._cids[signal] = []
+
+        def on_value(value, **kwargs):
+            with self._lock:
+                if signal in self._cids:
+                    self._values[signal] = value
+
+        def on_meta(connected=True, **kwargs):
+            if not connected:
+                self.invalidate(signal)
+
+        # run=True: the last value ophyd already has, if any, no I/O
+        cids = [signal.subscribe(on_value, event_type=signal.SUB_VALUE, run=True)]
+        if hasattr(signal, 'SUB_META'):
+            cids.append(signal.subscribe(on_meta, event_type=signal.SUB_META, run=False))
+        with self._lock:
+            self._cids[signal] = cids
+
+keywords_vars['settings_cache'] = 'last known device settings, skip unchanged puts'
+settings_cache = SettingsCache()
+
+
 # ----- generalized initialization ----- #
 
 class RuntimeMode():
 
     def __init__(self):
         self._mode = 'debug'
-        self.set(mode='debug')
+        self.set(mode='debug', lazy=True)
 
     def __repr__(self):
         return f"Current runtime mode is set to: {self._mode} ['debug', 'dryrun', 'production']"
 
-    def set(self, mode='debug', config=None):
+    def set(self, mode='debug', config=None, lazy=False):
         """
         (Re)-initialize all devices based on given mode
         simulated devices <-- debug
         actual devices    <-- dryrun, production
+
+        With lazy=True, each device is only created and connected on
+        its first use.
         """
         if mode.lower() not in ['debug', 'dryrun', 'production']:
             raise ValueError(f"Unknown mode: {mode}")
+
+        # re-init all tomo related devices concurrently, the global names
+        # are only swapped once every device is connected
+        self.init_engine = DeviceInitEngine(device_factories)
+        if lazy:
+            devices = self.init_engine.lazy(mode)
         else:
-            self._mode = mode
-        
-        global A_shutter
-        global suspend_A_shutter
-        global tomostage
-        global preci, samX, ksamX, ksamZ, samY 
-        global psofly
-        global det
-
-        # re-init all tomo related devices
-        A_shutter = get_shutter(mode=mode)
-        tomostage = get_motors(mode=mode) 
-        preci     = tomostage.preci              
-        samX      = tomostage.samX               
-        ksamX     = tomostage.ksamX
-        ksamZ     = tomostage.ksamZ        
-        samY      = tomostage.samY               
-        psofly    = get_fly_motor(mode=mode)
-        det       = get_detector(mode=mode)
+            devices = self.init_engine.run(mode)
+        settings_cache.clear()
+        globals().update(devices)
+        self._mode = mode
+        self._install_suspenders(mode)
 
         # some quick sanity check production mode
+        """
         import apstools.devices as APS_devices
         aps = APS_devices.ApsMachineParametersDevice(name="APS")
-        suspend_A_shutter = SuspendFloor(A_shutter.pss_state, 1)
-        """
         if mode.lower() in ['production']:
             if aps.inUserOperations and (instrument_in_use() in (1, "6-BM-A")) and (not hutch_light_on()):
                 
@@ -57,6 +378,20 @@ class RuntimeMode():
         # TODO:
         # initialize all values in the dictionary
 
+    def _install_suspenders(self, mode):
+        """replace the RE suspenders of the previous mode, once the switch succeeded"""
+        global suspend_APS_current
+        if suspend_APS_current is not None:
+            RE.remove_suspender(suspend_APS_current)
+            suspend_APS_current = None
+        if mode.lower() == 'production':
+            suspend_APS_current = SuspendFloor(aps.current, 2, resume_thresh=10)
+            RE.install_suspender(suspend_APS_current)
+
+    def report(self):
+        """show the connect time of each device from the last mode.set()"""
+        self.init_engine.report()
+
 mode = RuntimeMode()
 
 print(f"""
@@ -68,4 +403,4 @@ print(f"""
 
 # TODO: define init for other experiment devices
 
-print(f'leaving {__file__}...\n')
+_startup_leave(__file__)
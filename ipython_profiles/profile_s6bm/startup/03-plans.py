@@ -1,4 +1,4 @@
-print(f'Enter {__file__}...')
+_startup_enter(__file__)
 # ----- prefined plans for 6bma ----- #
 # NOTE:
 #  The signal staging does not work well with the CLI based experiment.
@@ -7,31 +7,488 @@ print(f'Enter {__file__}...')
 import bluesky.plans         as bp
 import bluesky.preprocessors as bpp
 import bluesky.plan_stubs    as bps
+import io
 import time
+import copy
+import contextlib
 from bluesky.simulators import summarize_plan
 
 keywords_vars['init_motors_pos'] = 'dict with cached motor position'
-init_motors_pos = {
-    'samX':  samX.position,
-    'samY':  samY.position,
-    'preci': preci.position,
-}
+init_motors_pos = {}  # filled by tomo_scan, the stage is not connected at startup
+
+# ----- batched configuration ----- #
+_UNKNOWN = object()
+_dry_run_values = None  # {signal: value} put by a dry run (PlanTimeEstimator)
+
+def _readback_equals(signal, target):
+    """
+    True if the cached readback of signal already equals target.  Nothing
+    is read from the IOC: an uncached signal is put (and cached from then on).
+    During a dry run, the values it put so far come first.
+
+    Integers are compared exactly, floats with the tolerance/rtolerance of
+    the signal (np.isclose defaults if neither is set).
+    """
+    try:
+        if hasattr(signal, 'position'):
+            current = signal.position
+        elif _dry_run_values is not None and signal in _dry_run_values:
+            current = _dry_run_values[signal]
+        else:
+            current = settings_cache.peek(signal, _UNKNOWN)
+    except Exception:
+        return False
+    if current is _UNKNOWN:
+        return False
+    enum_strs = getattr(signal, 'enum_strs', None)
+    if isinstance(target, str) and enum_strs and isinstance(current, (int, np.integer)):
+        return 0 <= current < len(enum_strs) and enum_strs[current] == target
+    if isinstance(target, (int, float)) and isinstance(current, (int, float, np.number)):
+        if isinstance(target, float) or isinstance(current, (float, np.floating)):
+            # the (ophyd) tolerance of the signal if set, e.g. for a
+            # readback rounded by the IOC
+            atol, rtol = getattr(signal, 'tolerance', None), getattr(signal, 'rtolerance', None)
+            if atol is None and rtol is None:
+                return bool(np.isclose(current, target))
+            return bool(np.isclose(current, target, rtol=rtol or 0.0, atol=atol or 0.0))
+        # counts, enum indexes, ... an off-by-one is a change
+        return int(current) == int(target)
+    return current == target
+
+keywords_func['mv_batch'] = 'Put a dict of signal->value concurrently, skip unchanged'
+def mv_batch(settings, skip_unchanged=True):
+    """
+    Put all signals in settings, {signal: value}, with a single bps.mv so
+    that all puts are issued concurrently.  Signals whose readback already
+    equals the target in settings_cache are skipped, without any read in
+    the plan, so the RunEngine and the simulators see the same messages.
+
+    NOTE: only use it for independent settings, actions that must happen
+          in order (reset filter, start capture, ...) need their own mv.
+    """
+    args = []
+    for signal, value in settings.items():
+        if skip_unchanged and _readback_equals(signal, value):
+            continue
+        args += [signal, value]
+    if args:
+        # the cache follows the readback monitors, which also see a value
+        # clamped or rounded by the IOC
+        yield from bps.mv(*args)
+
+
+# ----- motion planning for tomostage ----- #
+def _read_or(signal, default):
+    try:
+        return signal.get()
+    except Exception:
+        return default
+
+keywords_func['estimate_move_time'] = 'Estimate motor move time from VELO/ACCL'
+def estimate_move_time(motor, target, start=None, velocity=None, acceleration=None):
+    """
+    Estimate the time (sec) needed to move motor from start (default:
+    current position) to target with a trapezoidal velocity profile,
+    where the motor reaches its velocity in acceleration seconds (ACCL).
+    velocity and acceleration override the VELO/ACCL of the motor.
+    """
+    start = motor.position if start is None else start
+    distance = abs(target - start)
+    if velocity is None:
+        velocity = _read_or(motor.velocity, 0) if hasattr(motor, 'velocity') else 0
+    t_accl = acceleration
+    if t_accl is None:
+        t_accl = _read_or(motor.acceleration, 0) if hasattr(motor, 'acceleration') else 0
+    if distance == 0 or not velocity:
+        return 0.0
+    if t_accl <= 0:
+        return distance/velocity
+    if distance >= velocity*t_accl:
+        # accelerate, cruise at velocity, decelerate
+        return distance/velocity + t_accl
+    # never reach the full velocity
+    return 2*np.sqrt(distance*t_accl/velocity)
+
+keywords_func['shortest_rotation'] = 'Equivalent (mod 360) angle closest to current'
+def shortest_rotation(motor, target, current=None):
+    """
+    Return the angle equivalent to target (modulo 360) that is closest to
+    the current position (default: the one of the rotation motor) and
+    within its soft limits.
+    """
+    current = motor.position if current is None else current
+    candidates = [target + 360*(np.round((current - target)/360) + k) for k in (-1, 0, 1)]
+    low, high = getattr(motor, 'limits', (0, 0)) or (0, 0)
+    if low < high:
+        candidates = [c for c in candidates if low <= c <= high] or [target]
+    return min(candidates, key=lambda c: abs(c - current))
+
+keywords_func['mv_stage'] = 'Move tomostage axes concurrently, shortest rotation'
+def mv_stage(targets, rotation=None):
+    """
+    Move all motors in targets, {motor: position}, concurrently.  The target
+    of the rotation motor (default: preci) is replaced by the closest
+    equivalent angle.
+    """
+    rotation = preci if rotation is None else rotation
+    args = []
+    for motor, target in targets.items():
+        if motor is rotation:
+            # read in the plan, a dry run answers with its own position
+            current = yield from bps.rd(motor, default_value=None)
+            target = shortest_rotation(motor, target, current=current)
+        args += [motor, target]
+    yield from bps.mv(*args)
+
+keywords_func['estimate_stage_move'] = 'Estimate time (sec) of a concurrent mv_stage'
+def estimate_stage_move(targets, starts=None, rotation=None):
+    """
+    Estimate the time of mv_stage(targets), i.e. the slowest axis, with
+    optional start positions {motor: position} instead of the current ones.
+    """
+    rotation = preci if rotation is None else rotation
+    starts = starts or {}
+    times = [0.0]
+    for motor, target in targets.items():
+        if motor is rotation:
+            target = shortest_rotation(motor, target, current=starts.get(motor))
+        times.append(estimate_move_time(motor, target, start=starts.get(motor)))
+    return max(times)
+
+
+def _progress_printer(label, total, step=0.1):
+    """signal callback printing the progress every step (fraction of total)"""
+    state = {'next': step}
+
+    def callback(value, **kwargs):
+        if total and value/total >= state['next']:
+            print(f"🙊: {label} {value:.0f}/{total} ({value/total:.0%})")
+            state['next'] += step
+    return callback
+
+
+# ----- fly scan timing ----- #
+keywords_vars['FLY_TIMING_CACHE'] = 'JSON file with measured readout time per detector config'
+FLY_TIMING_CACHE = os.environ.get(
+    'S6BM_FLY_TIMING',
+    os.path.join(os.path.expanduser('~'), '.s6bm', 'fly_timing.json'),
+)
+
+def _load_fly_timing(fn=None):
+    fn = FLY_TIMING_CACHE if fn is None else fn
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_fly_timing(cache, fn=None):
+    fn = FLY_TIMING_CACHE if fn is None else fn
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    with open(fn, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+def fly_timing_key(det, acquire_time, plugin):
+    """detector configuration (exposure, ROI, binning, output) as cache key"""
+    cam = det.cam
+    roi = "x".join(
+        str(_read_or(sig, '?'))
+        for sig in (cam.min_x, cam.min_y, cam.size.size_x, cam.size.size_y)
+    )
+    binning = f"{_read_or(cam.bin_x, 1)}x{_read_or(cam.bin_y, 1)}"
+    return "|".join([
+        det.prefix, 
+        f"{acquire_time:.6f}", 
+        roi, 
+        binning, 
+        str(_read_or(cam.data_type, '?')),
+        plugin.name,
+    ])
+
+def _frame_period(samples):
+    """mean period (sec) between frames from (counter, timestamp) samples"""
+    if len(samples) < 2:
+        return None
+    (n0, t0), (n1, t1) = samples[0], samples[-1]
+    return (t1 - t0)/(n1 - n0) if n1 > n0 else None
+
+keywords_func['measure_readout'] = 'Plan, test burst to measure detector readout time'
+def measure_readout(det, acquire_time, plugin, n_images=50, timeout=30):
+    """
+    Acquire a short burst of n_images at the maximum frame rate (internal
+    trigger) and measure the frame period from the monitored counters of
+    the cam and of the output plugin (not capturing).  The slower of the
+    two defines the readout time, i.e. period - acquire_time.  The
+    settings it changes are restored however the burst ends.
+
+    Return a dict with readout_time, cam_period, plugin_period, dropped.
+    """
+    cam = det.cam
+    cam_samples, plugin_samples = [], []
+
+    def recorder(samples):
+        def callback(value, timestamp, **kwargs):
+            samples.append((value, timestamp))
+        return callback
+
+    settings = {
+        cam.image_mode:       "Multiple",
+        cam.trigger_mode:     "Internal",
+        cam.num_images:       n_images,
+        cam.acquire_time:     acquire_time,
+        cam.acquire_period:   acquire_time,   # as fast as the camera can go
+        plugin.enable:        1,
+        plugin.nd_array_port: 'PG1',
+    }
+    previous = {}
+    for sig in settings:
+        previous[sig] = yield from bps.rd(sig)
+    dropped = yield from bps.rd(plugin.dropped_arrays)
+
+    def burst():
+        yield from mv_batch(settings)
+        cids = [
+            (cam.num_images_counter, cam.num_images_counter.subscribe(recorder(cam_samples), run=False)),
+            (plugin.array_counter, plugin.array_counter.subscribe(recorder(plugin_samples), run=False)),
+        ]
+        try:
+            yield from bps.mv(cam.acquire, 1)
+            t_end = time.time() + timeout
+            while time.time() < t_end:
+                if cam_samples and cam_samples[-1][0] >= n_images:
+                    break
+                yield from bps.sleep(0.05)
+            yield from bps.sleep(0.2)   # let the plugin catch up
+        finally:
+            for sig, cid in cids:
+                sig.unsubscribe(cid)
+
+    def restore():
+        # stop a burst that timed out (or was interrupted) first
+        yield from mv_batch({cam.acquire: 0})
+        yield from mv_batch(previous)
+
+    yield from bpp.finalize_wrapper(burst(), restore())
+    dropped = (yield from bps.rd(plugin.dropped_arrays)) - dropped
+
+    cam_period = _frame_period(cam_samples)
+    plugin_period = _frame_period(plugin_samples)
+    if cam_period is None:
+        raise ValueError(f"🙉: no frames from {det.name} within {timeout} sec")
+    period = max(cam_period, plugin_period or 0)
+    return {
+        'readout_time':  max(period - acquire_time, 0.0),
+        'cam_period':    cam_period,
+        'plugin_period': plugin_period,
+        'dropped':       int(dropped),
+        'date':          datetime.now().isoformat(),
+    }
+
+keywords_func['fly_readout_time'] = 'Plan, cached/measured readout time for fly scans'
+def fly_readout_time(det, acquire_time, plugin, margin=0.1, recalibrate=False):
+    """
+    Return the readout time for the current detector configuration.  It is
+    measured with a test burst (measure_readout) the first time a config is
+    used and cached in FLY_TIMING_CACHE, then padded by margin (fraction of
+    the frame period) to absorb jitter.
+    """
+    key = fly_timing_key(det, acquire_time, plugin)
+    cache = _load_fly_timing()
+    if recalibrate or key not in cache:
+        print(f"🙊: measuring readout time for {key}")
+        cache[key] = yield from measure_readout(det, acquire_time, plugin)
+        if cache[key]['dropped'] > 0:
+            print(f"🙈: {plugin.name} dropped {cache[key]['dropped']} arrays during the test burst")
+        _save_fly_timing(cache)
+    readout_time = cache[key]['readout_time']
+    return readout_time + margin*(acquire_time + readout_time)
+
+keywords_func['fly_slew_speed'] = 'Fastest slew speed giving one frame per trigger'
+def fly_slew_speed(omega_step, acquire_time, readout_time, n_frames=1):
+    """
+    Fastest rotation speed (deg/s) at which the detector still delivers a
+    frame for every PSO trigger (n_frames per omega_step).  It is rounded
+    down so that the trigger period never gets shorter than a frame.
+    """
+    frame_period = acquire_time + readout_time
+    speed = abs(omega_step)/(frame_period*n_frames)
+    return np.floor(speed*1e4)/1e4
+
+
+# ----- flat/dark field reuse ----- #
+def flat_dark_key(det, config):
+    """detector settings (exposure, averaging, ROI, binning, gain) as cache key"""
+    cam = det.cam
+    return "|".join(str(v) for v in [
+        det.prefix,
+        f"{config['tomo']['acquire_time']:.6f}",
+        config['tomo']['n_frames'],
+        "x".join(str(_read_or(sig, '?')) for sig in (cam.min_x, cam.min_y, cam.size.size_x, cam.size.size_y)),
+        f"{_read_or(cam.bin_x, 1)}x{_read_or(cam.bin_y, 1)}",
+        _read_or(cam.gain, '?'),
+        _read_or(cam.data_type, '?'),
+    ])
+
+class FlatDarkCache():
+    """
+    White/dark fields of recent scans that the next scans can reuse
+
+    An entry is keyed by the detector settings (see flat_dark_key) and
+    refers to the run/file where the fields were saved, together with the
+    beam state at that time.  White fields expire after max_age seconds,
+    a relative ring current change above max_current_change or more than
+    max_shutter_cycles openings of A_shutter; dark fields do not depend on
+    the beam and expire after max_age_dark seconds.
+    """
+    max_age = 600
+    max_age_dark = 1800
+    max_current_change = 0.01
+    max_shutter_cycles = 2
+
+    def __init__(self):
+        self.entries = {}   # {(key, kind): reference}
+        self.shutter_cycles = 0
+        self._shutter = None
+        self._cid = None
+
+    def __repr__(self):
+        return f"FlatDarkCache({len(self.entries)} entries, shutter cycles={self.shutter_cycles})"
+
+    def _watch_shutter(self):
+        """count the openings of the current A_shutter"""
+        if A_shutter is self._shutter:
+            return
+        if self._cid is not None:
+            self._shutter.pss_state.unsubscribe(self._cid)
+        self._shutter, self._cid = A_shutter, None
+        open_values = getattr(A_shutter, 'pss_state_open_values', [1])
+
+        def on_state(value, old_value=None, **kwargs):
+            if value in open_values and old_value not in open_values:
+                self.shutter_cycles += 1
+
+        if hasattr(A_shutter, 'pss_state'):
+            self._cid = A_shutter.pss_state.subscribe(on_state, run=False)
+
+    def store(self, key, kind, uid, filepath, fileprefix):
+        """record that the kind ('white' or 'dark') fields of run uid are valid"""
+        self._watch_shutter()
+        self.entries[(key, kind)] = {
+            'uid':            uid,
+            'filepath':       filepath,
+            'fileprefix':     fileprefix,
+            'time':           time.time(),
+            'current':        _read_or(aps.current, None),
+            'shutter_cycles': self.shutter_cycles,
+        }
+
+    def lookup(self, key, kind):
+        """return the reference of valid kind fields for key, or None"""
+        self._watch_shutter()
+        ref = self.entries.get((key, kind))
+        if ref is None:
+            return None
+        age = time.time() - ref['time']
+        if kind == 'dark':
+            valid = age < self.max_age_dark
+        else:
+            current = _read_or(aps.current, None)
+            drift = (
+                abs(current - ref['current'])/ref['current']
+                if current is not None and ref['current'] else 0
+            )
+            valid = (
+                age < self.max_age
+                and drift <= self.max_current_change
+                and self.shutter_cycles - ref['shutter_cycles'] <= self.max_shutter_cycles
+            )
+        if not valid:
+            del self.entries[(key, kind)]
+            return None
+        return {k: ref[k] for k in ('uid', 'filepath', 'fileprefix')}
+
+    def clear(self):
+        self.entries = {}
+
+    def report(self):
+        now = time.time()
+        for (key, kind), ref in self.entries.items():
+            print(f"{kind:5s} {ref['fileprefix']}  {now - ref['time']:.0f} s ago  {key}")
+
+keywords_vars['flat_dark_cache'] = 'white/dark fields reusable by the next scans'
+flat_dark_cache = FlatDarkCache()
+
 
 keywords_func['resume_motors_position'] = 'Move motors back to init position'
 def resume_motors_position():
+    if not init_motors_pos:
+        print("🙈: no motor position cached yet, run tomo_scan first")
+        return
     samX.mv( init_motors_pos['samX' ])
     samY.mv( init_motors_pos['samY' ])
     preci.mv(init_motors_pos['preci'])
 
 
 # ----- step/fly scan plan ----- #
+def _fly_segment(label, n_triggers, expected_fps, watchdog, telemetry, plugin, restore=None):
+    """
+    taxi psofly, arm det for n_triggers hardware triggers and fly, python
+    only watches the progress.  The internal trigger and the settings in
+    restore are put back however the segment ends.
+    """
+    def segment():
+        yield from bps.mv(psofly.taxi, "Taxi")
+        # setup detector to overlap for fly scan
+        yield from mv_batch({
+            det.cam.num_images:    n_triggers,
+            det.cam.trigger_mode:  "Overlapped",
+        })
+        yield from bps.trigger(det, group='trigger')
+        cid = psofly.actual_triggers.subscribe(
+            _progress_printer(label, n_triggers),
+            run=False,
+        )
+        try:
+            yield from telemetry.record(
+                watchdog.watch(psofly.plan(), n_triggers),
+                det, psofly, plugin,
+                expected_fps=expected_fps,
+            )
+        finally:
+            psofly.actual_triggers.unsubscribe(cid)
+
+    def cleanup():
+        yield from mv_batch({det.cam.trigger_mode: "Internal", **(restore or {})})
+
+    return (yield from bpp.finalize_wrapper(segment(), cleanup()))
+
+
 keywords_func['tomo_scan'] = 'Bluesky scan plans for tomography characterization'
-def tomo_scan(config_exp):
+def tomo_scan(config_exp, prepare_next=None, md=None, keep_shutter_open=False):
     """
     Bluesky scan plans for tomography characterization.
     Read the sample experiment configuration file for more details
 
     NOTE: the input can be a dictionary or a YAML file
+
+    prepare_next: optional function returning a plan that is run once the
+                  shutter is closed after the projections/white field, to
+                  set up the next scan (see ScanQueue).  Its puts should
+                  not be waited for.
+    md:           extra metadata for the start document
+    keep_shutter_open: leave the shutter open at the end of a scan without
+                  dark field, for the next scan of the same sample (e.g. the
+                  tiles of tomo_volume_scan), prepare_next then runs with
+                  the beam on.  An open shutter is not opened again.
+
+    With reuse_flat_dark: true in the tomo section, the white (dark) field
+    phases are skipped if flat_dark_cache has valid ones for the current
+    detector settings and beam, the reference is saved in md['flat_dark'].
+
+    n_white_pre/n_white_post (default: n_white) in the tomo section set
+    the number of white fields before/after the projections, a phase is
+    skipped if it is 0 (same for n_dark).  The shutter is closed at the
+    end of the scan (or if it fails) unless keep_shutter_open.
     """
     config = load_config(config_exp) if type(config_exp) != dict else config_exp
 
@@ -45,24 +502,93 @@ def tomo_scan(config_exp):
     acquire_period = config['tomo']['acquire_period']
     n_frames = config['tomo']['n_frames']
     n_white = config['tomo']['n_white']
+    n_white_pre = config['tomo'].get('n_white_pre', n_white)
+    n_white_post = config['tomo'].get('n_white_post', n_white)
     n_dark = config['tomo']['n_dark']
+
+    # reuse the white/dark of a recent scan with the same settings
+    reuse = config['tomo'].get('reuse_flat_dark', False)
+    if reuse:
+        fd_key = flat_dark_key(det, config)
+        flat_dark = {
+            'white': flat_dark_cache.lookup(fd_key, 'white'),
+            'dark':  flat_dark_cache.lookup(fd_key, 'dark'),
+        }
+        if flat_dark['white'] is not None:
+            n_white_pre = n_white_post = 0
+        if flat_dark['dark'] is not None:
+            n_dark = 0
+        md = {**(md or {}), 'flat_dark': flat_dark}
+        print(f"🙊: reused white: {flat_dark['white'] is not None}, dark: {flat_dark['dark'] is not None}")
+
     angs = np.arange(
         config['tomo']['omega_start'], 
         config['tomo']['omega_end']+config['tomo']['omega_step']/2,
         config['tomo']['omega_step'],
     )
     n_projections = len(angs)
-    total_images  = n_white + n_projections + n_white + n_dark
+    total_images  = n_white_pre + n_projections + n_white_post + n_dark
     fp = config['output']['filepath']
     fn = config['output']['fileprefix']
+    # scan geometry for the post-run theta/timestamp writer
+    md = {
+        **(md or {}),
+        'tomo_scan': {
+            'type':          config['tomo']['type'].lower(),
+            'omega_start':   config['tomo']['omega_start'],
+            'omega_end':     config['tomo']['omega_end'],
+            'omega_step':    config['tomo']['omega_step'],
+            'n_frames':      n_frames,
+            'n_projections': n_projections,
+            'output_type':   config['output']['type'].lower(),
+            'filepath':      fp,
+            'fileprefix':    fn,
+        },
+    }
     
     # calculate slew speed for fly scan
     # https://github.com/decarlof/tomo2bm/blob/master/flir/libs/aps2bm_lib.py
     # TODO: considering blue pixels, use 2BM code as ref
-    if config['tomo']['type'].lower() == 'fly':
-        scan_time = (acquire_time+config['tomo']['readout_time'])*n_projections
-        slew_speed = np.around((angs.max() - angs.min())/scan_time, decimals=4)
-    
+    if config['tomo']['type'].lower() in ['fly', 'step_fast']:
+        if config['output']['type'] in ['tif', 'tiff']:
+            output_plugin = det.tiff1
+        else:
+            output_plugin = det.hdf1
+        # readout_time: auto --> measured once per detector config (cached)
+        readout_time = config['tomo']['readout_time']
+        if str(readout_time).lower() == 'auto':
+            readout_time = yield from fly_readout_time(det, acquire_time, output_plugin)
+            print(f"🙊: using readout time {readout_time:.4f} s")
+        # fly: one trigger per omega_step
+        # step_fast: n_frames triggers per omega_step, averaged into one
+        #            projection by proc1
+        slew_speed = fly_slew_speed(
+            config['tomo']['omega_step'],
+            acquire_time,
+            readout_time,
+            n_frames=n_frames if config['tomo']['type'].lower() == 'step_fast' else 1,
+        )
+
+        # stall detection for the fly segment
+        watchdog = FlyScanWatchdog(det, readout_time)
+        telemetry = FlyScanTelemetry(name='fly_telemetry')
+
+    # sample out/in positions for white field
+    initial_samx  = samX.position
+    initial_samy  = samY.position
+    sample_out = {
+        samX:  initial_samx + config['tomo']['sample_out_position']['samX'],
+        samY:  initial_samy + config['tomo']['sample_out_position']['samY'],
+        preci: config['tomo']['sample_out_position']['preci'],
+    }
+    sample_in = {samX: initial_samx, samY: initial_samy}
+    # out & in, before and after the projections
+    t_motion = 2*estimate_stage_move(sample_out) + 2*estimate_stage_move(
+        sample_in,
+        starts={samX: sample_out[samX], samY: sample_out[samY]},
+    )
+    print(f"🙊: expected sample in/out motion overhead: {t_motion:.1f} s")
+
     # step 1: define the scan generator
     @bpp.stage_decorator([det])
     def scan_closure():
@@ -70,153 +596,203 @@ def tomo_scan(config_exp):
         # collect white field
         # -------------------
         # 1-1 monitor shutter status, auto-puase scan if beam is lost
-        yield from bps.open_run()
-        yield from bps.mv(A_shutter, 'open')
+        uid = yield from bps.open_run(md=md)
+        if not A_shutter.isOpen:
+            yield from bps.mv(A_shutter, 'open')
         yield from bps.install_suspender(suspend_A_shutter)
 
         #1-1.5 configure output plugins     edited by Jason 07/19/2019
+        settings_output = {}
         for me in [det.tiff1, det.hdf1]:
-            yield from bps.mv(me.file_path, fp)
-            yield from bps.mv(me.file_name, fn)
-            yield from bps.mv(me.file_write_mode, 2)
-            yield from bps.mv(me.num_capture, total_images)
-            yield from bps.mv(me.file_template, ".".join([r"%s%s_%06d",config['output']['type'].lower()]))    
+            settings_output[me.file_path] = fp
+            settings_output[me.file_name] = fn
+            settings_output[me.file_write_mode] = 2
+            settings_output[me.num_capture] = total_images
+            settings_output[me.file_template] = ".".join([r"%s%s_%06d",config['output']['type'].lower()])
+        # SWMR, the file can be read while written (live_sinogram), only put
+        # when asked for, it stays on for the following HDF5 scans
+        swmr = config['output'].get('swmr', 0)
+        if swmr > 0 and config['output']['type'] in ['hdf', 'hdf1', 'hdf5']:
+            settings_output[det.hdf1.swmr_mode] = 1
+            settings_output[det.hdf1.num_frames_flush] = swmr
+        yield from mv_batch(settings_output)
 
         if config['output']['type'] in ['tif', 'tiff']:
-            yield from bps.mv(det.tiff1.enable, 1)
+            yield from mv_batch({det.tiff1.enable: 1, det.hdf1.enable: 0})
             yield from bps.mv(det.tiff1.capture, 1)
-            yield from bps.mv(det.hdf1.enable, 0)
         elif config['output']['type'] in ['hdf', 'hdf1', 'hdf5']:
-            yield from bps.mv(det.tiff1.enable, 0)
-            yield from bps.mv(det.hdf1.enable, 1)
+            yield from mv_batch({det.tiff1.enable: 0, det.hdf1.enable: 1})
             yield from bps.mv(det.hdf1.capture, 1)
         else:
-            raise ValueError(f"Unsupported output type {output_dict['type']}")
-
-        # 1-2 move sample out of the way
-        initial_samx  = samX.position
-        initial_samy  = samY.position
-        initial_preci = preci.position
-        dx = config['tomo']['sample_out_position']['samX']
-        dy = config['tomo']['sample_out_position']['samY']
-        r = config['tomo']['sample_out_position']['preci']
-        yield from bps.mv(samX,  initial_samx  + dx)
-        yield from bps.mv(samY,  initial_samy  + dy)
-        yield from bps.mv(preci, r)
-
-        # 1-2.5 set frame type for an organized HDF5 archive
-        yield from bps.mv(det.cam.frame_type, 0)
-
-        # 1-3 collect front white field images
-        yield from bps.mv(det.hdf1.nd_array_port, 'PROC1')
-        yield from bps.mv(det.tiff1.nd_array_port, 'PROC1')
-        yield from bps.mv(det.proc1.enable, 1)
-        yield from bps.mv(det.proc1.reset_filter, 1)
-        yield from bps.mv(det.proc1.num_filter, n_frames)
-        yield from bps.mv(det.cam.trigger_mode, "Internal")
-        yield from bps.mv(det.cam.image_mode, "Multiple")
-        yield from bps.mv(det.cam.num_images, n_frames*n_white)
-        yield from bps.mv(det.cam.acquire_time, acquire_time)
-        yield from bps.mv(det.cam.acquire_period, acquire_period)
-        yield from bps.trigger_and_read([det])
-     
-
-        # 1-4 move sample back
-        yield from bps.mv(samX,  initial_samx )
-        yield from bps.mv(samY,  initial_samy )
-        #yield from bps.mv(preci, initial_preci)
+            raise ValueError(f"Unsupported output type {config['output']['type']}")
+
+        # 1-2 set frame type for an organized HDF5 archive, before the
+        #     sample moves (it also marks the phase for the profilers)
+        settings_cam = {det.cam.frame_type: 0} if n_white_pre > 0 else {}
+        settings_cam.update({
+            det.hdf1.nd_array_port:   'PROC1',
+            det.tiff1.nd_array_port:  'PROC1',
+            det.proc1.enable:         1,
+            det.proc1.num_filter:     n_frames,
+            det.cam.trigger_mode:     "Internal",
+            det.cam.image_mode:       "Multiple",
+            det.cam.acquire_time:     acquire_time,
+            det.cam.acquire_period:   acquire_period,
+        })
+        if n_white_pre > 0:
+            settings_cam[det.cam.num_images] = n_frames*n_white_pre
+        yield from mv_batch(settings_cam)
+        if n_white_pre > 0:
+            # 1-3 move sample out of the way, collect front white field images
+            yield from mv_stage(sample_out)
+            yield from bps.mv(det.proc1.reset_filter, 1)
+            yield from bps.trigger_and_read([det])
+
+            # 1-4 move sample back
+            yield from mv_stage(sample_in)
 
         # -------------------
         # collect projections
         # -------------------
         # 1-5 set frame type for an organized HDF5 archive
-        yield from bps.mv(det.cam.frame_type, 1)
         # 1-6 step and fly scan are differnt
         if config['tomo']['type'].lower() == 'step':
+            yield from mv_batch({
+                det.cam.frame_type:  1,
+                det.cam.num_images:  n_frames,
+            })
             yield from bps.mv(det.proc1.reset_filter, 1)
-            yield from bps.mv(det.cam.num_images, n_frames)
             # 1-6 collect projections
             for ang in angs:
                 yield from bps.checkpoint()
                 yield from bps.mv(preci, ang)
                 yield from bps.trigger_and_read([det])
         elif config['tomo']['type'].lower() == 'fly':
-            yield from bps.mv(det.proc1.num_filter, 1)
-            yield from bps.mv(det.hdf1.nd_array_port, 'PG1')
-            yield from bps.mv(det.tiff1.nd_array_port, 'PG1')
-            yield from bps.mv(
-                psofly.start,           config['tomo']['omega_start'],
-                psofly.end,             config['tomo']['omega_end'],
-                psofly.scan_delta,      abs(config['tomo']['omega_step']),
-                psofly.slew_speed,      slew_speed,
-            )
-            # taxi
-            yield from bps.mv(psofly.taxi, "Taxi")
-            # setup detector to overlap for fly scan
-            yield from bps.mv(
-                det.cam.num_images, n_projections,
-                det.cam.trigger_mode, "Overlapped",
-            )
-            # start the fly scan
-            print("before trigger")
-            yield from bps.trigger(det, group='trigger')
-            print("waiting for trigger")
-            # yield from bps.wait(group='trigger')
-            print("before plan()")
+            pso_start, pso_delta = _pso_setpoints(md['tomo_scan'])
+            yield from mv_batch({
+                det.cam.frame_type:      1,
+                det.proc1.num_filter:    1,
+                det.hdf1.nd_array_port:  'PG1',
+                det.tiff1.nd_array_port: 'PG1',
+                psofly.start:            pso_start,
+                psofly.end:              _pso_end(md['tomo_scan']),
+                psofly.scan_delta:       pso_delta,
+                psofly.slew_speed:       slew_speed,
+            })
+            try:
+                yield from _fly_segment(
+                    "fly", n_projections,
+                    slew_speed/abs(config['tomo']['omega_step']),
+                    watchdog, telemetry, output_plugin,
+                    restore={
+                        det.hdf1.nd_array_port:   'PROC1',
+                        det.tiff1.nd_array_port:  'PROC1',
+                    },
+                )
+            except NotEnoughTriggers as err:
+                reason=(f"{err.expected:.0f} were expected but {err.actual:.0f} were received.")
+                yield from bps.close_run('fail', reason=reason)
+                return  # short-circuit
+        elif config['tomo']['type'].lower() == 'step_fast':
+            # the controller moves preci and triggers the detector every
+            # omega_step/n_frames, proc1 outputs one average every n_frames
+            # (the range is extended for the n_frames of the last angle)
+            pso_start, pso_delta = _pso_setpoints(md['tomo_scan'])
+            proc1_prev = {
+                det.proc1.filter_callbacks:   (yield from bps.rd(det.proc1.filter_callbacks)),
+                det.proc1.auto_reset_filter:  (yield from bps.rd(det.proc1.auto_reset_filter)),
+            }
+            yield from mv_batch({
+                det.cam.frame_type:           1,
+                det.proc1.num_filter:         n_frames,
+                det.proc1.filter_callbacks:   "Array N only",
+                det.proc1.auto_reset_filter:  1,
+                psofly.start:                 pso_start,
+                psofly.end:                   _pso_end(md['tomo_scan']),
+                psofly.scan_delta:            pso_delta,
+                psofly.slew_speed:            slew_speed,
+            })
+            yield from bps.mv(det.proc1.reset_filter, 1)
             try:
-                yield from psofly.plan()
+                yield from _fly_segment(
+                    "step_fast", n_projections*n_frames,
+                    slew_speed*n_frames/abs(config['tomo']['omega_step']),
+                    watchdog, telemetry, output_plugin,
+                    restore=proc1_prev,
+                )
             except NotEnoughTriggers as err:
                 reason=(f"{err.expected:.0f} were expected but {err.actual:.0f} were received.")
                 yield from bps.close_run('fail', reason=reason)
                 return  # short-circuit
-              
-            # fly scan finished. switch image port and trigger_mode back
-            yield from bps.mv(det.cam.trigger_mode, "Internal")
-            yield from bps.mv(det.hdf1.nd_array_port, 'PROC1')
-            yield from bps.mv(det.tiff1.nd_array_port, 'PROC1')     
         else:
             raise ValueError(f"Unknown scan type: {config['tomo']['type']}")
 
         # ------------------
         # collect back white
         # ------------------
-        # 1-7 move the sample out of the way
-        # NOTE:
-        # this will return ALL motors to starting positions, we need a
-        # smart way to calculate a shorter trajectory to move sample
-        # out of way
-        yield from bps.mv(preci, r)
-        yield from bps.mv(samX,  initial_samx  + dx)
-        yield from bps.mv(samY,  initial_samy  + dy)
-        
-        # 1-7.5 set frame type for an organized HDF5 archive
-        yield from bps.mv(det.cam.frame_type, 2)
-
-        # 1-8 take the back white
-        yield from bps.mv(det.proc1.num_filter, n_frames)
-        yield from bps.mv(det.cam.num_images, n_frames*n_white)
-        yield from bps.trigger_and_read([det])
-
-        # 1-9 move sample back
-        yield from bps.mv(samX,  initial_samx )
-        yield from bps.mv(samY,  initial_samy )
+        if n_white_post > 0:
+            # 1-7 set frame type for an organized HDF5 archive, before the
+            #     sample moves
+            yield from mv_batch({
+                det.cam.frame_type:    2,
+                det.proc1.num_filter:  n_frames,
+                det.cam.num_images:    n_frames*n_white_post,
+            })
+
+            # 1-7.5 move the sample out of the way
+            # NOTE:
+            # all axes move concurrently and preci takes the shortest
+            # (modulo 360) path to the white field angle
+            yield from mv_stage(sample_out)
+
+            # 1-8 take the back white
+            yield from bps.trigger_and_read([det])
+
+            # 1-9 move sample back
+            yield from mv_stage(sample_in)
 
         # -----------------
         # collect back dark
         # -----------------
-        # 1-10 close the shutter
+        # 1-10 set frame type for an organized HDF5 archive, before the
+        #      shutter closes
         yield from bps.remove_suspender(suspend_A_shutter)
-        yield from bps.mv(A_shutter, "close")
+        if n_dark > 0:
+            yield from mv_batch({
+                det.cam.frame_type:    3,
+                det.proc1.num_filter:  n_frames,
+                det.cam.num_images:    n_frames*n_dark,
+            })
 
-        # 1-10.5 set frame type for an organized HDF5 archive
-        yield from bps.mv(det.cam.frame_type, 3)
+        # 1-10.5 close the shutter, also without dark field (reused or
+        #        n_dark: 0) before the next scan is prepared
+        if n_dark > 0 or not keep_shutter_open:
+            yield from bps.mv(A_shutter, "close")
+        if prepare_next is not None:
+            yield from prepare_next()
 
         # 1-11 collect the back dark
-        yield from bps.mv(det.cam.num_images, n_frames*n_dark)
-        yield from bps.trigger_and_read([det])
+        if n_dark > 0:
+            yield from bps.trigger_and_read([det])
         yield from bps.close_run('success')
+        done.append(uid)
+
+        # nothing to remember if the plan was not run (e.g. summarize_plan)
+        if reuse and uid is not None:
+            if n_white_pre > 0 or n_white_post > 0:
+                flat_dark_cache.store(fd_key, 'white', uid, fp, fn)
+            if n_dark > 0:
+                flat_dark_cache.store(fd_key, 'dark', uid, fp, fn)
+
+    # the shutter is closed however the scan ends (abort, failed fly scan),
+    # only a successful scan can leave it open
+    done = []
+    def close_shutter():
+        yield from bps.remove_suspender(suspend_A_shutter)
+        if not A_shutter.isClosed and not (keep_shutter_open and done):
+            yield from bps.mv(A_shutter, "close")
 
-    return (yield from scan_closure())
+    return (yield from bpp.finalize_wrapper(scan_closure(), close_shutter()))
 
 
 keywords_func['repeat_exp'] = 'repeat given experiment n times'
@@ -229,7 +805,811 @@ def repeat_exp(plan_func, n=1):
         yield from plan_func
 
 
-print(f'leaving {__file__}...\n')
+# ----- theta and time stamps in the HDF5 file ----- #
+def tomo_theta(scan, n):
+    """
+    Rotation angle of the n projections of a tomo_scan, scan is the
+    md['tomo_scan'] of the run, with pso_start/pso_delta (the trigger
+    positions set on the controller) for fly and step_fast.
+    """
+    if scan['type'] == 'step':
+        angs = np.arange(
+            scan['omega_start'], 
+            scan['omega_end'] + scan['omega_step']/2, 
+            scan['omega_step'],
+        )
+        return angs[:n]
+    sign = 1 if scan['omega_end'] >= scan['omega_start'] else -1
+    delta = sign*abs(scan['pso_delta'])
+    if scan['type'] == 'fly':
+        return scan['pso_start'] + delta*np.arange(n)
+    # step_fast: the mean position of the n_frames averaged triggers
+    n_frames = scan['n_frames']
+    return scan['pso_start'] + delta*(n_frames*np.arange(n) + (n_frames - 1)/2)
+
+def _pso_setpoints(scan):
+    """(pso_start, pso_delta) that tomo_scan puts to psofly for scan"""
+    n_triggers = scan['n_frames'] if scan['type'] == 'step_fast' else 1
+    return scan['omega_start'], abs(scan['omega_step'])/n_triggers
+
+def _pso_end(scan):
+    """
+    endPos that tomo_scan puts to psofly for scan.  The controller sends
+    round(|end - start|/delta) + 1 triggers, so step_fast goes on for
+    n_frames - 1 triggers past omega_end to give each of the n_projections
+    its n_frames.
+    """
+    start, delta = _pso_setpoints(scan)
+    sign = 1 if scan['omega_end'] >= scan['omega_start'] else -1
+    n_extra = scan['n_frames'] - 1 if scan['type'] == 'step_fast' else 0
+    return scan['omega_end'] + sign*n_extra*delta
+
+def frame_timestamps(h5, frame_type=1):
+    """
+    Unix time stamps of the frames of one frame type (1: /exchange/data)
+    from the NDArray attributes the HDF5 plugin saves in /defaults, or
+    None if they are not in the file.  SaveDest is the FrameType string
+    (DBR_STRING, the dataset path in HDF5_DATASETS) or its index.
+    """
+    attrs = h5.get('defaults')
+    if attrs is None or 'SaveDest' not in attrs:
+        return None
+    if 'NDArrayEpicsTSSec' in attrs and 'NDArrayEpicsTSnSec' in attrs:
+        ts = attrs['NDArrayEpicsTSSec'][()] + 1e-9*attrs['NDArrayEpicsTSnSec'][()]
+    elif 'NDArrayTimeStamp' in attrs:
+        ts = attrs['NDArrayTimeStamp'][()]
+    else:
+        return None
+    dest = attrs['SaveDest'][()].ravel()
+    if dest.dtype.kind in 'SUO':
+        dest = np.array([d.decode() if isinstance(d, bytes) else str(d) for d in dest])
+        match = np.char.strip(dest) == HDF5_DATASETS[frame_type]
+    else:
+        match = dest == frame_type
+    return ts.ravel()[match] + EPICS_EPOCH
+
+class HDF5ThetaWriter():
+    """
+    RunEngine callback adding /exchange/theta and /exchange/timestamp to
+    the HDF5 file of a tomo_scan (see configs/tomo6bma_layout.xml).
+
+    At the stop document of a successful HDF5 tomo_scan, the file name
+    (and the trigger positions of psofly) are read and the file is fixed
+    up in a background thread: it waits until det.hdf1 has closed the file
+    and writes both datasets at once.
+    """
+
+    def __init__(self, close_timeout=60):
+        self.close_timeout = close_timeout
+        self.futures = []
+        self.errors = []
+        self._start = None
+        self._executor = ThreadPoolExecutor(max_workers=1, initializer=_attach_ca_context)
+
+    def __call__(self, name, doc):
+        if name == 'start':
+            self._start = doc if 'tomo_scan' in doc else None
+        elif name == 'stop' and self._start is not None:
+            scan = dict(self._start['tomo_scan'])
+            self._start = None
+            if scan['output_type'] not in ['hdf', 'hdf1', 'hdf5'] or doc['exit_status'] != 'success':
+                return
+            if scan['type'] != 'step':
+                pso_start, pso_delta = _pso_setpoints(scan)
+                scan['pso_start'] = _read_or(psofly.start, pso_start)
+                scan['pso_delta'] = _read_or(psofly.scan_delta, pso_delta)
+            fn = _read_or(det.hdf1.full_file_name, '')
+            self.futures.append(self._executor.submit(self._write, fn, scan))
+
+    def _open(self, fn):
+        """open fn for writing once the HDF5 plugin released it"""
+        import h5py
+        t_end = time.time() + self.close_timeout
+        while True:
+            try:
+                return h5py.File(fn, 'a')
+            except OSError:
+                if time.time() > t_end:
+                    raise
+                time.sleep(0.5)
+
+    def _write(self, fn, scan):
+        try:
+            with self._open(fn) as h5:
+                n = h5['/exchange/data'].shape[0]
+                datasets = {
+                    'theta':     (tomo_theta(scan, n), 'degrees', 'computed rotation stage angle'),
+                    'timestamp': (frame_timestamps(h5), 's', 'frame time stamp (unix time)'),
+                }
+                for key, (data, units, description) in datasets.items():
+                    if data is None or len(data) == 0:
+                        print(f"🙈: no {key} for {fn}")
+                        continue
+                    if len(data) != n:
+                        print(f"🙈: {len(data)} {key} values for {n} projections in {fn}")
+                    path = f'/exchange/{key}'
+                    if path in h5:
+                        del h5[path]
+                    dset = h5.create_dataset(path, data=np.asarray(data, dtype=np.float64))
+                    dset.attrs['units'] = units
+                    dset.attrs['description'] = description
+            return fn
+        except Exception as err:
+            self.errors.append((fn, err))
+            print(f"🙉: cannot add theta to {fn}, {type(err).__name__}: {err}")
+
+    def wait(self, timeout=None):
+        """wait for all pending files"""
+        wait_futures(self.futures, timeout=timeout)
+        self.futures = [f for f in self.futures if not f.done()]
+
+keywords_vars['theta_writer'] = 'adds theta/timestamp to the HDF5 file after each tomo_scan'
+theta_writer = HDF5ThetaWriter()
+session_callbacks.append(theta_writer)  # for RE = getRunEngine() later on
+RE.subscribe(theta_writer)
+
+
+# ----- volume (stitched) tomography ----- #
+def _write_tile_index(index):
+    """write the tile index next to the data, or to cwd if not reachable"""
+    fn = f"{index['volume']}_tiles.yml"
+    path = index['filepath'] if os.path.isdir(index['filepath']) else os.getcwd()
+    if path != index['filepath']:
+        print(f"🙈: {index['filepath']} not reachable, tile index written to {path}")
+    with open(os.path.join(path, fn), 'w') as f:
+        yaml.safe_dump(index, f, sort_keys=False)
+
+keywords_func['tomo_volume_scan'] = 'Stitched tomography over stage x samY tiles (TomoVolScan6)'
+def tomo_volume_scan(config_exp, stage_step, n_stage, samY_step=0.0, n_samY=1,
+                     stage_motor=None, share_flat_dark=True):
+    """
+    Tomography over n_stage x n_samY tiles, i.e. TomoVolScan6 in
+    epics_macros/tomo_6bm.mac, each tile is a tomo_scan saved with the
+    fileprefix {fileprefix}_y{layer:02d}_x{column:02d}.
+
+    The stitching motor (default: ksamX) is centered on its current
+    position, samY goes up by samY_step for each layer.  Both are moved
+    back to their original position at the end.
+
+    share_flat_dark: one white/dark set for the whole volume, shared
+                     through flat_dark_cache (reuse_flat_dark): the first
+                     tile collects the pre-white, the last one the dark.
+                     A tile collects its own pre-white once the cached one
+                     expired (ring current, age), the last one also its
+                     post-white then.
+
+    The shutter stays open from the first tile to the last one (which
+    closes it), unless each tile collects its own dark field.  The next
+    tile is moved to while the current one is closed out.  The tile index
+    (positions, files, white/dark of each tile) is written to
+    {filepath}/{fileprefix}_tiles.yml and to md['tile'] of each run.
+    """
+    config = load_config(config_exp) if type(config_exp) != dict else config_exp
+    stage_motor = ksamX if stage_motor is None else stage_motor
+    n_white = config['tomo']['n_white']
+    n_dark = config['tomo']['n_dark']
+    fn = config['output']['fileprefix']
+    group = 'volume_next_tile'
+
+    start_stage = stage_motor.position
+    start_samY = samY.position
+    tiles, targets = [], []
+    for layer in range(n_samY):
+        for column in range(n_stage):
+            stage_pos = start_stage + (column - (n_stage-1)/2)*stage_step
+            samY_pos = start_samY + layer*samY_step
+            targets.append({stage_motor: stage_pos, samY: samY_pos})
+            tiles.append({
+                'index':      len(tiles),
+                'layer':      layer,
+                'column':     column,
+                'fileprefix': f"{fn}_y{layer:02d}_x{column:02d}",
+                'positions':  {stage_motor.name: float(stage_pos), samY.name: float(samY_pos)},
+            })
+    index = {
+        'volume':      fn,
+        'filepath':    config['output']['filepath'],
+        'stage_motor': stage_motor.name,
+        'stage_step':  stage_step,
+        'n_stage':     n_stage,
+        'samY_step':   samY_step,
+        'n_samY':      n_samY,
+        'tiles':       tiles,
+    }
+    shared = share_flat_dark and len(tiles) > 1
+
+    def scan_tiles():
+        for i, tile in enumerate(tiles):
+            last = i == len(tiles) - 1
+            yield from bps.wait(group=group)
+            yield from bps.mv(*[v for item in targets[i].items() for v in item])
+
+            # white/dark of this tile, the cached ones (as tomo_scan looks them
+            # up), its own or those the last tile collects
+            tomo = dict(config['tomo'])
+            if shared:
+                tomo['reuse_flat_dark'] = True
+                tomo['n_white_post'] = tomo.get('n_white_post', n_white) if last else 0
+                tomo['n_dark'] = n_dark if last else 0
+            tile_config = {**config, 'tomo': tomo, 'output': {**config['output'], 'fileprefix': tile['fileprefix']}}
+            cached = {'white': None, 'dark': None}
+            if tomo.get('reuse_flat_dark', False):
+                fd_key = flat_dark_key(det, tile_config)
+                cached = {kind: flat_dark_cache.lookup(fd_key, kind) for kind in cached}
+            own = {
+                'white': tomo.get('n_white_pre', n_white) + tomo.get('n_white_post', n_white) > 0,
+                'dark':  tomo['n_dark'] > 0,
+            }
+            for kind, ref in cached.items():
+                if ref is not None:
+                    tile[kind] = ref['fileprefix']
+                else:
+                    tile[kind] = tile['fileprefix'] if own[kind] else tiles[-1]['fileprefix']
+            _write_tile_index(index)
+
+            def prepare_next(nxt=None if last else targets[i+1]):
+                for motor, position in nxt.items():
+                    yield from bps.abs_set(motor, position, group=group)
+
+            yield from tomo_scan(
+                tile_config,
+                prepare_next=None if last else prepare_next,
+                md={'tile': {'volume': fn, **tile}},
+                keep_shutter_open=not last,
+            )
+
+        yield from bps.wait(group=group)
+        yield from bps.mv(stage_motor, start_stage, samY, start_samY)
+
+    # the shutter is closed however the volume ends, also between tiles
+    def close_shutter():
+        if not A_shutter.isClosed:
+            yield from bps.mv(A_shutter, "close")
+
+    return (yield from bpp.finalize_wrapper(scan_tiles(), close_shutter()))
+
+
+# ----- multi-sample scan queue ----- #
+keywords_vars['SCAN_QUEUE_FILE'] = 'YAML file of the persistent scan queue'
+SCAN_QUEUE_FILE = os.environ.get(
+    'S6BM_SCAN_QUEUE',
+    os.path.join(os.path.expanduser('~'), '.s6bm', 'scan_queue.yml'),
+)
+
+def _merge_config(config, overrides):
+    """return a copy of config with the (nested) overrides applied"""
+    merged = copy.deepcopy(config)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+class ScanQueue():
+    """
+    Persistent queue of tomo_scan entries, e.g. for overnight runs
+
+    >> queue = ScanQueue()
+    >> queue.add('tomo_6bma.yml', position={'samX': 1.2, 'samY': 0.5},
+    ..           overrides={'output': {'fileprefix': 'sample_1'}})
+    >> RE(queue.plan())
+
+    Each entry is a config (YAML file or dict) with its own overrides and
+    an optional sample position {motor name: absolute position}.  The
+    state of every entry is saved to SCAN_QUEUE_FILE after each change, so
+    RE(queue.plan()) continues with the first unfinished entry after an
+    abort or a restart of the session.
+
+    To save beamtime, the next sample moves into position as soon as the
+    shutter of the current scan is closed (during its dark field), and the
+    HDF5 file name is pre-staged if both scans write HDF5 (the current file
+    is already open, the name is only used for the next one).
+    """
+    group = 'scan_queue_next'
+
+    def __init__(self, filename=None):
+        self.filename = SCAN_QUEUE_FILE if filename is None else filename
+        self.entries = []
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.entries = yaml.safe_load(f) or []
+
+    def __repr__(self):
+        states = [entry['state'] for entry in self.entries]
+        summary = ", ".join(f"{state}: {states.count(state)}" for state in sorted(set(states)))
+        return f"ScanQueue({self.filename}, {summary or 'empty'})"
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            yaml.safe_dump(self.entries, f, sort_keys=False)
+        os.replace(tmp, self.filename)
+
+    def add(self, config, name=None, position=None, overrides=None):
+        """append an entry, config is a YAML file (read at run time) or dict"""
+        if isinstance(config, str):
+            config = os.path.abspath(config)
+        else:
+            config = copy.deepcopy(config)
+        self.entries.append({
+            'name':      name or f"entry_{len(self.entries)}",
+            'config':    config,
+            'overrides': overrides or {},
+            'position':  position or {},
+            'state':     'pending',
+        })
+        self.save()
+        return self.entries[-1]
+
+    def reset(self, state='failed'):
+        """mark all entries in state (e.g. failed, done) as pending again"""
+        for entry in self.entries:
+            if entry['state'] == state:
+                entry['state'] = 'pending'
+        self.save()
+
+    def clear(self, state='done'):
+        """drop all entries in state"""
+        self.entries = [entry for entry in self.entries if entry['state'] != state]
+        self.save()
+
+    def report(self):
+        for i, entry in enumerate(self.entries):
+            print(f"{i:3d} {entry['state']:8s} {entry['name']}  {entry.get('uid', '')}")
+
+    def config(self, entry):
+        config = entry['config']
+        config = load_config(config) if isinstance(config, str) else config
+        return _merge_config(config, entry['overrides'])
+
+    def _next(self, after=None):
+        """first unfinished entry (interrupted ones included) after after"""
+        start = 0 if after is None else self.entries.index(after) + 1
+        for entry in self.entries[start:]:
+            if entry['state'] in ('pending', 'running'):
+                return entry
+        return None
+
+    def _prepare(self, current, entry):
+        """plan, start moving/pre-staging for entry without waiting"""
+        def prepare():
+            for motor, position in entry['position'].items():
+                yield from bps.abs_set(globals()[motor], position, group=self.group)
+            config = self.config(entry)
+            hdf = ['hdf', 'hdf1', 'hdf5']
+            if current['output']['type'] in hdf and config['output']['type'] in hdf:
+                yield from bps.abs_set(det.hdf1.file_path, config['output']['filepath'], group=self.group)
+                yield from bps.abs_set(det.hdf1.file_name, config['output']['fileprefix'], group=self.group)
+        return prepare
+
+    def plan(self):
+        """run all unfinished entries (entries added meanwhile included)"""
+        entry = self._next()
+        while entry is not None:
+            config = self.config(entry)
+            nxt = self._next(after=entry)
+            # the overlapped setup for this entry must be done
+            yield from bps.wait(group=self.group)
+            if entry['position']:
+                # no motion left if it was prepared during the last dark
+                yield from mv_stage({globals()[k]: v for k, v in entry['position'].items()})
+
+            def on_doc(name, doc, entry=entry):
+                if name == 'start':
+                    entry['uid'] = doc['uid']
+                elif name == 'stop':
+                    # an aborted entry is run again on resume
+                    entry['state'] = {
+                        'success': 'done', 
+                        'abort':   'pending',
+                    }.get(doc['exit_status'], 'failed')
+                    entry['finished'] = datetime.now().isoformat()
+                    self.save()
+
+            entry['state'] = 'running'
+            entry['started'] = datetime.now().isoformat()
+            self.save()
+            print(f"🙊: scan queue, {entry['name']}")
+            yield from bpp.subs_wrapper(
+                tomo_scan(
+                    config, 
+                    prepare_next=self._prepare(config, nxt) if nxt is not None else None,
+                ),
+                {'start': [on_doc], 'stop': [on_doc]},
+            )
+            entry = self._next(after=entry)
+        yield from bps.wait(group=self.group)
+
+
+# ----- plan time estimation ----- #
+keywords_vars['PLAN_TIMING'] = 'timing model (sec) used by the plan time estimator'
+PLAN_TIMING = {
+    'put_latency':      0.005,  # CA put with put-completion
+    'event':            0.002,  # read + save of one event
+    'shutter':          3.0,    # open/close of A_shutter
+    'trigger_overhead': 0.1,    # start acquisition, flush proc1/plugins
+    'readout_time':     0.05,   # used for readout_time: auto
+    # (velocity, acceleration time) of the tomostage motors, for the
+    # quick estimate and the motors without VELO/ACCL
+    'motors': {
+        'preci':   (20.0, 0.5),
+        'samX':    (2.0,  0.2),
+        'samY':    (1.0,  0.2),
+        'default': (1.0,  0.2),
+    },
+}
+
+keywords_vars['TOMO_PHASES'] = 'tomo_scan phases, indexed by det.cam.frame_type'
+TOMO_PHASES = ['white_pre', 'projections', 'white_post', 'dark']
+
+def _rotation_distance(start, target):
+    """distance (deg) of the shortest (modulo 360) rotation, as in mv_stage"""
+    return abs((target - start + 180) % 360 - 180)
+
+class PlanTimeEstimator():
+    """
+    Dry run of a plan: the messages are consumed one by one (nothing is
+    sent to the devices) and a simulated clock is advanced with the timing
+    model.  Motors move from their tracked positions with estimate_move_time
+    (VELO/ACCL of the device), the concurrent sets of a group end with the
+    slowest one (as estimate_stage_move), a trigger takes
+    num_images*(exposure+readout) of the tracked cam settings, taxi/complete
+    of the flyer move the rotation to the run-up/run-down positions of its
+    tracked start/end at slew_speed, every other put costs put_latency.
+    read/locate are answered with the tracked values.
+
+    Time is attributed to the phase selected by the last value put to
+    phase_signal (e.g. det.cam.frame_type), 'setup' before that.
+    """
+
+    def __init__(self, timing=None, phase_signal=None, phase_names=None,
+                 flyer=None, rotation=None, shutter=None, readout_time=None):
+        self.timing = copy.deepcopy(PLAN_TIMING)
+        self.timing.update(timing or {})
+        self.phase_signal = phase_signal
+        self.phase_names = phase_names or []
+        self.flyer = flyer
+        self.rotation = rotation
+        self.shutter = shutter
+        self.readout_time = self.timing['readout_time'] if readout_time is None else readout_time
+        self.values = {}  # {signal: value put}
+
+    def _value(self, signal, default=None):
+        if signal in self.values:
+            return self.values[signal]
+        return _read_or(signal, default)
+
+    def _position(self, motor):
+        if motor not in self.positions:
+            self.positions[motor] = motor.position
+        return self.positions[motor]
+
+    def _motion(self, motor):
+        """(velocity, acceleration time) of motor, from the model if it does not report them"""
+        velocity = _read_or(motor.velocity, 0) if hasattr(motor, 'velocity') else 0
+        t_accl = _read_or(motor.acceleration, 0) if hasattr(motor, 'acceleration') else 0
+        if not velocity:
+            motors = self.timing['motors']
+            velocity, t_accl = motors.get(getattr(motor, 'attr_name', motor.name), motors['default'])
+        return velocity, t_accl
+
+    def _move_time(self, motor, target, velocity=None):
+        """move motor (at velocity instead of VELO if given) from its tracked position"""
+        default_velocity, t_accl = self._motion(motor)
+        t = estimate_move_time(
+            motor, target,
+            start=self._position(motor),
+            velocity=default_velocity if velocity is None else velocity,
+            acceleration=t_accl,
+        )
+        self.positions[motor] = target
+        return t
+
+    def _fly_range(self):
+        """(direction, run-up) of the flyer for its tracked settings"""
+        flyer = self.flyer
+        start, end = self._value(flyer.start, 0), self._value(flyer.end, 0)
+        slew_speed = self._value(flyer.slew_speed, 0)
+        return (1 if end >= start else -1), slew_speed*self._motion(self.rotation)[1]
+
+    def _set_time(self, obj, value):
+        if obj is self.shutter:
+            return self.timing['shutter']
+        if self.flyer is not None and obj is self.flyer.taxi:
+            sign, run_up = self._fly_range()
+            taxi = self._value(self.flyer.start, 0) - sign*run_up
+            return self.timing['put_latency'] + self._move_time(self.rotation, taxi)
+        if hasattr(obj, 'position') and not isinstance(obj, Signal):
+            return self._move_time(obj, value)
+        self.values[obj] = value
+        if obj is self.phase_signal:
+            idx = int(value)
+            self.phase = self.phase_names[idx] if idx < len(self.phase_names) else str(value)
+        return self.timing['put_latency']
+
+    def _trigger_time(self, det):
+        cam = getattr(det, 'cam', None)
+        if cam is None:
+            return self.timing['trigger_overhead']
+        if self._value(cam.trigger_mode, 'Internal') not in ('Internal', 0):
+            return 0.0   # the frames come with the fly segment
+        n_images = self._value(cam.num_images, 1) or 1
+        exposure = self._value(cam.acquire_time, 0) or 0
+        period = max(self._value(cam.acquire_period, 0) or 0, exposure + self.readout_time)
+        return self.timing['trigger_overhead'] + n_images*period
+
+    def _complete_time(self, flyer):
+        if flyer is not self.flyer or not self._value(flyer.slew_speed, 0):
+            return self.timing['put_latency']
+        sign, run_up = self._fly_range()
+        return self._move_time(
+            self.rotation,
+            self._value(flyer.end, 0) + sign*run_up,
+            velocity=self._value(flyer.slew_speed, 0),
+        )
+
+    def _reply(self, msg):
+        """answer of the devices to read/locate, tracked values"""
+        obj = msg.obj
+        if hasattr(obj, 'position') and not isinstance(obj, Signal):
+            value = self._position(obj)
+        elif isinstance(obj, Signal):
+            value = self._value(obj)
+        else:
+            return None
+        if msg.command == 'locate':
+            return {'setpoint': value, 'readback': value}
+        return {obj.name: {'value': value, 'timestamp': self.t}}
+
+    def _advance(self, t):
+        if t > self.t:
+            self.phases[self.phase] = self.phases.get(self.phase, 0.0) + t - self.t
+            self.t = t
+
+    def _schedule(self, group, duration):
+        end = self.t + duration
+        if group is None:
+            self._advance(end)
+        else:
+            self.groups[group] = max(self.groups.get(group, end), end)
+
+    def run(self, plan):
+        """consume plan and return {'total', 'phases', 'n_messages'}"""
+        self.t = 0.0
+        self.phase = 'setup'
+        self.phases = {}
+        self.groups = {}
+        self.values.clear()
+        self.positions = {}
+        n_messages = 0
+        ret = None
+        while True:
+            try:
+                msg = plan.send(ret)
+            except StopIteration:
+                break
+            n_messages += 1
+            ret = None
+            group = msg.kwargs.get('group')
+            if msg.command == 'set':
+                self._schedule(group, self._set_time(msg.obj, msg.args[0]))
+            elif msg.command == 'trigger':
+                self._schedule(group, self._trigger_time(msg.obj))
+            elif msg.command == 'complete':
+                self._schedule(group, self._complete_time(msg.obj))
+            elif msg.command == 'kickoff':
+                self._schedule(group, self.timing['put_latency'])
+            elif msg.command == 'wait':
+                self._advance(self.groups.pop(group, self.t))
+            elif msg.command == 'sleep':
+                self._advance(self.t + msg.args[0])
+            elif msg.command == 'save':
+                self._advance(self.t + self.timing['event'])
+            elif msg.command in ('read', 'locate'):
+                ret = self._reply(msg)
+        # whatever is still pending at the end of the plan
+        self._advance(max(self.groups.values(), default=self.t))
+        return {
+            'total':      float(self.t),
+            'phases':     {k: float(v) for k, v in self.phases.items()},
+            'n_messages': n_messages,
+        }
+
+def _sim_devices():
+    """the devices of tomo_scan on the simulated beamline, {name: device}"""
+    sim = get_sim_beamline()
+    stage = sim.tomostage
+    return {
+        'tomostage': stage,
+        'preci':     stage.preci,
+        'samX':      stage.samX,
+        'samY':      stage.samY,
+        'ksamX':     stage.ksamX,
+        'ksamZ':     stage.ksamZ,
+        'psofly':    sim.psofly,
+        'det':       sim.det,
+        'A_shutter': sim.shutter,
+    }
+
+keywords_func['estimate_tomo_scan'] = 'Predict tomo_scan wall time per phase (dry run)'
+def estimate_tomo_scan(config_exp, timing=None, verbose=False):
+    """
+    Predict the wall time of tomo_scan(config_exp) split by phase
+    (setup, white_pre, projections, white_post, dark) with a dry run of its
+    messages (PlanTimeEstimator) against the simulated beamline, which
+    stands in for the devices of the current mode meanwhile.  Nothing is
+    moved or put, readout_time: auto uses the readout time of PLAN_TIMING
+    (updated with timing) and reuse_flat_dark is ignored (all white/dark
+    fields are counted).  See quick_estimate_tomo_scan for the fast path.
+
+    Return {'total', 'phases', 'n_messages'} in seconds.
+    """
+    config = load_config(config_exp) if type(config_exp) != dict else copy.deepcopy(config_exp)
+    config['tomo']['reuse_flat_dark'] = False
+    if str(config['tomo']['readout_time']).lower() == 'auto':
+        config['tomo']['readout_time'] = (timing or {}).get('readout_time', PLAN_TIMING['readout_time'])
+    devices = _sim_devices()
+    estimator = PlanTimeEstimator(
+        timing,
+        phase_signal=devices['det'].cam.frame_type,
+        phase_names=TOMO_PHASES,
+        flyer=devices['psofly'],
+        rotation=devices['preci'],
+        shutter=devices['A_shutter'],
+        readout_time=config['tomo']['readout_time'],
+    )
+    # mv_batch skips the puts against the values of the dry run
+    devices['_dry_run_values'] = estimator.values
+    ns = globals()
+    saved = {name: ns[name] for name in devices}
+    saved_pos = dict(init_motors_pos)
+    ns.update(devices)
+    try:
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            return estimator.run(tomo_scan(config))
+    finally:
+        ns.update(saved)
+        init_motors_pos.clear()
+        init_motors_pos.update(saved_pos)
+
+keywords_func['quick_estimate_tomo_scan'] = 'Fast analytical tomo_scan time per phase'
+def quick_estimate_tomo_scan(config_exp, timing=None, preci_start=0.0):
+    """
+    Fast path of estimate_tomo_scan (well under a millisecond, e.g. for
+    thousands of configs): the phases of tomo_scan are modelled from the
+    config and PLAN_TIMING (updated with timing) alone, the motors move
+    at the speeds of the model and preci starts at preci_start.  It is
+    tested against estimate_tomo_scan, keep both in line with tomo_scan.
+
+    Return {'total', 'phases'} in seconds.
+    """
+    config = load_config(config_exp) if type(config_exp) != dict else config_exp
+    model = copy.deepcopy(PLAN_TIMING)
+    model.update(timing or {})
+    tomo = config['tomo']
+    scan_type = tomo['type'].lower()
+    put = model['put_latency']
+
+    def move(axis, distance, velocity=None):
+        default_velocity, t_accl = model['motors'].get(axis, model['motors']['default'])
+        return estimate_move_time(
+            None, distance,
+            start=0,
+            velocity=default_velocity if velocity is None else velocity,
+            acceleration=t_accl,
+        )
+
+    readout_time = tomo['readout_time']
+    if str(readout_time).lower() == 'auto':
+        readout_time = model['readout_time']
+    frame_period = max(tomo['acquire_period'], tomo['acquire_time'] + readout_time)
+
+    def acquire(n_images):
+        return model['trigger_overhead'] + n_images*frame_period + model['event']
+
+    n_frames = tomo['n_frames']
+    n_white_pre = tomo.get('n_white_pre', tomo['n_white'])
+    n_white_post = tomo.get('n_white_post', tomo['n_white'])
+    n_dark = tomo['n_dark']
+    out = tomo['sample_out_position']
+    angs = np.arange(
+        tomo['omega_start'],
+        tomo['omega_end'] + tomo['omega_step']/2,
+        tomo['omega_step'],
+    )
+    preci_pos = preci_start
+    phases = {'setup': 0.0}
+    phase = 'setup'
+
+    def spend(t, next_phase=None):
+        """add t to the current phase, which becomes next_phase (frame_type put)"""
+        nonlocal phase
+        if next_phase is not None:
+            phase = next_phase
+        phases[phase] = phases.get(phase, 0.0) + t
+
+    def sample_out():
+        nonlocal preci_pos
+        spend(max(
+            move('samX', abs(out['samX'])),
+            move('samY', abs(out['samY'])),
+            move('preci', _rotation_distance(preci_pos, out['preci'])),
+        ))
+        preci_pos = out['preci']
+
+    def white(name, n_white):
+        spend(put, name)  # the frame type is put before the sample moves
+        sample_out()
+        spend(put + acquire(n_frames*n_white))
+        spend(max(move('samX', abs(out['samX'])), move('samY', abs(out['samY']))))
+
+    # open the shutter, configure the output plugins
+    spend(model['shutter'] + 3*put)
+    if n_white_pre > 0:
+        white('white_pre', n_white_pre)
+    else:
+        spend(put)  # configure the cam
+
+    if scan_type == 'step':
+        t = 2*put + move('preci', abs(angs[0] - preci_pos))
+        t += (len(angs) - 1)*move('preci', abs(tomo['omega_step']))
+        t += len(angs)*(put + acquire(n_frames))
+        preci_pos = angs[-1]
+    elif scan_type in ['fly', 'step_fast']:
+        n_triggers = n_frames if scan_type == 'step_fast' else 1
+        slew_speed = fly_slew_speed(tomo['omega_step'], tomo['acquire_time'], readout_time, n_triggers)
+        t_accl = model['motors']['preci'][1]
+        run_up = slew_speed*t_accl
+        sign = 1 if tomo['omega_end'] >= tomo['omega_start'] else -1
+        scan = {**tomo, 'type': scan_type}
+        pso_start, pso_end = _pso_setpoints(scan)[0], _pso_end(scan)
+        # taxi to the run-up position, then fly past the end at slew_speed
+        taxi = pso_start - sign*run_up
+        t = 4*put + move('preci', abs(taxi - preci_pos)) + model['trigger_overhead']
+        t += move('preci', abs(pso_end - pso_start) + 2*run_up, velocity=slew_speed)
+        preci_pos = pso_end + sign*run_up
+    else:
+        raise ValueError(f"Unknown scan type: {tomo['type']}")
+    spend(t, 'projections')
+
+    if n_white_post > 0:
+        white('white_post', n_white_post)
+    # the frame type is put before the shutter closes, in any case
+    if n_dark > 0:
+        spend(put, 'dark')
+    spend(model['shutter'])
+    if n_dark > 0:
+        spend(acquire(n_frames*n_dark))
+    return {
+        'total':  float(sum(phases.values())),
+        'phases': {k: float(v) for k, v in phases.items()},
+    }
+
+keywords_func['report_plan_time'] = 'Print the predicted tomo_scan time of configs'
+def report_plan_time(*configs, quick=False, **kwargs):
+    """
+    Print the predicted time of each config (dict or YAML file) and the
+    total, e.g. to plan the queue of a beamtime.  kwargs are passed to
+    estimate_tomo_scan (quick_estimate_tomo_scan with quick=True).  Return
+    the list of estimates.
+    """
+    estimate = quick_estimate_tomo_scan if quick else estimate_tomo_scan
+    estimates = []
+    for config in configs:
+        est = estimate(config, **kwargs)
+        estimates.append(est)
+        label = config if isinstance(config, str) else config.get('output', {}).get('fileprefix', 'config')
+        phases = ", ".join(f"{k}: {v:.1f}" for k, v in est['phases'].items())
+        print(f"🙊: {label}: {est['total']/60:.1f} min ({phases} s)")
+    total = sum(est['total'] for est in estimates)
+    print(f"🙊: total {total/3600:.2f} h for {len(estimates)} scan(s)")
+    return estimates
+
+
+_startup_leave(__file__)
 
 
 def repeat(n): 
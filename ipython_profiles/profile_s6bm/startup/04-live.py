@@ -0,0 +1,396 @@
+_startup_enter(__file__)
+# ----- live analysis during tomo_scan ----- #
+# NOTE:
+#  The frames are read back from the HDF5 file while it is written, which
+#  needs SWMR (output: swmr > 0 in the scan config) and the file path to be
+#  visible from this machine.
+
+# -------------------------- #
+# streaming sinogram preview #
+# -------------------------- #
+class SinogramPreview():
+    """
+    Streaming flat/dark normalization with a downsampled sinogram preview.
+
+    Frames are added by frame type (0: white pre, 1: projection, 2: white
+    post, 3: dark), only the selected rows (sorted) are kept, binned by
+    col_bin.
+    Running means of the white and dark rows are updated with every frame
+    and the raw projection rows are kept (at most max_projections, every
+    other one is dropped when full), so the sinogram is normalized on
+    demand with the latest white/dark:
+
+        sinogram = -log((projection - dark)/(white - dark))
+
+    In tomo_scan the darks come last, dark (scalar or row) is used until
+    then, e.g. the black level of the detector.
+    """
+
+    def __init__(self, rows=None, col_bin=4, max_projections=1024, dark=0.0):
+        self.rows = sorted(rows) if rows else None
+        self.col_bin = col_bin
+        self.max_projections = max_projections
+        self.dark_guess = dark
+        self.reset()
+
+    def __repr__(self):
+        return (f"SinogramPreview(rows={self.rows}, {len(self.theta)} projections, "
+                f"{self.n_white} white, {self.n_dark} dark)")
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.white = None
+        self.dark = None
+        self.n_white = 0
+        self.n_dark = 0
+        self.projections = []   # binned rows, (n_rows, n_cols) each
+        self.theta = []
+        self.decimation = 1     # keep every decimation-th projection
+        self._n_seen = 0
+
+    def _bin(self, frames):
+        """(n, ny, nx) --> (n, n_rows, nx//col_bin) as float"""
+        frames = np.asarray(frames, dtype=np.float64)
+        if self.rows is None:
+            ny = frames.shape[1]
+            self.rows = [ny//4, ny//2, 3*ny//4]
+        rows = frames if frames.shape[1] == len(self.rows) else frames[:, self.rows, :]
+        nx = rows.shape[-1]//self.col_bin*self.col_bin
+        return rows[..., :nx].reshape(*rows.shape[:-1], -1, self.col_bin).mean(axis=-1)
+
+    def _running_mean(self, mean, n, frames):
+        """update the running mean of n frames with a stack of new frames"""
+        total = frames.sum(axis=0)
+        if mean is None:
+            return total/len(frames), len(frames)
+        n_new = n + len(frames)
+        return mean + (total - len(frames)*mean)/n_new, n_new
+
+    def add(self, frames, frame_type, theta=None):
+        """add a stack of frames (n, ny, nx) or binned rows of one frame type"""
+        binned = self._bin(frames)
+        with self._lock:
+            if frame_type in (0, 2):
+                self.white, self.n_white = self._running_mean(self.white, self.n_white, binned)
+            elif frame_type == 3:
+                self.dark, self.n_dark = self._running_mean(self.dark, self.n_dark, binned)
+            elif frame_type == 1:
+                theta = np.arange(self._n_seen, self._n_seen + len(binned)) if theta is None else theta
+                for proj, ang in zip(binned, theta):
+                    if self._n_seen % self.decimation == 0:
+                        self.projections.append(proj)
+                        self.theta.append(ang)
+                    self._n_seen += 1
+                if len(self.projections) > self.max_projections:
+                    # bounded memory: halve the angular sampling
+                    self.projections = self.projections[::2]
+                    self.theta = self.theta[::2]
+                    self.decimation *= 2
+
+    def sinogram(self, row=0):
+        """normalized sinogram (n_projections, n_cols) of the row-th selected row"""
+        with self._lock:
+            if not self.projections:
+                return None
+            proj = np.array([p[row] for p in self.projections])
+            white = self.white[row] if self.white is not None else proj.max(axis=0)
+            dark = self.dark[row] if self.dark is not None else self.dark_guess
+        norm = (proj - dark)/np.clip(white - dark, 1e-6, None)
+        return -np.log(np.clip(norm, 1e-6, None))
+
+    def plot(self, fig=None):
+        """show the sinograms of all selected rows"""
+        fig = plt.figure('sinogram preview') if fig is None else fig
+        fig.clf()
+        for i, row in enumerate(self.rows or []):
+            sino = self.sinogram(i)
+            if sino is None:
+                continue
+            ax = fig.add_subplot(1, len(self.rows), i+1)
+            ax.imshow(sino, aspect='auto', cmap='gray')
+            ax.set_title(f"row {row}")
+            ax.set_xlabel(f"x (bin {self.col_bin})")
+            ax.set_ylabel("projection")
+        fig.canvas.draw_idle()
+        return fig
+
+
+def follow_hdf5(fn, consumer, stop_event, poll=0.5, idle_timeout=30):
+    """
+    Read the frames of a growing SWMR HDF5 file (tomo_scan layout) and add
+    them to consumer (consumer.add(frames, frame_type)) until stop_event
+    is set and nothing new came in for one poll, or nothing new came in
+    for idle_timeout seconds.  Only the rows of consumer.rows are read.
+    """
+    import h5py
+    t_end = time.time() + idle_timeout
+    while True:
+        try:
+            h5 = h5py.File(fn, 'r', libver='latest', swmr=True)
+            break
+        except OSError:
+            if stop_event.is_set() or time.time() > t_end:
+                print(f"🙉: cannot follow {fn}, is SWMR on (output: swmr)?")
+                return
+            time.sleep(poll)
+
+    n_read = {frame_type: 0 for frame_type in HDF5_DATASETS}
+    with h5:
+        t_last = time.time()
+        while True:
+            new = 0
+            for frame_type, path in HDF5_DATASETS.items():
+                if path not in h5:
+                    continue
+                dset = h5[path]
+                dset.refresh()
+                n = dset.shape[0]
+                if n <= n_read[frame_type]:
+                    continue
+                if consumer.rows is None:
+                    consumer.rows = [dset.shape[1]//4, dset.shape[1]//2, 3*dset.shape[1]//4]
+                frames = dset[n_read[frame_type]:n, consumer.rows, :]
+                consumer.add(frames, frame_type)
+                new += n - n_read[frame_type]
+                n_read[frame_type] = n
+            if new:
+                t_last = time.time()
+            elif stop_event.is_set() or time.time() - t_last > idle_timeout:
+                return
+            time.sleep(poll)
+
+
+# ------------------ #
+# center of rotation #
+# ------------------ #
+class RotationCenterEstimator():
+    """
+    Incremental center of rotation from opposite projections.
+
+    Up to max_pairs projections of the first half turn are kept as
+    references, every projection 180 deg (within tolerance, default half
+    the angular step) from a reference makes a pair.  For each pair the
+    mirrored opposite projection is cross-correlated (FFT, all selected
+    rows at once) with the reference, the shift gives the rotation axis
+    in the image:
+
+        center = (nx - 1 - shift)/2
+
+    The sample offset from the axis at angle theta is half the difference
+    of the attenuation centroids of the pair, fitting
+
+        offset(theta) = dx*cos(theta) + dz*sin(theta)
+
+    over the pairs suggests the ksamX/ksamZ correction (-dx, -dz), assuming
+    ksamX is along the image x at 0 deg and ksamZ at 90 deg.  The results
+    are published in the center signal (pixels) and in suggestion (mm with
+    pixel_size in mm, pixels otherwise).
+    """
+
+    def __init__(self, rows=None, max_pairs=8, pixel_size=None, tolerance=None, dark=0.0):
+        self.rows = sorted(rows) if rows else None
+        self.max_pairs = max_pairs
+        self.pixel_size = pixel_size
+        self.tolerance = tolerance
+        self.dark_guess = dark
+        self.center = Signal(name='rotation_center', value=np.nan)
+        self.reset()
+
+    def __repr__(self):
+        return (f"RotationCenterEstimator(center={self.center.get():.2f}, "
+                f"{len(self.pairs)} pairs, suggestion={self.suggestion})")
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.white = None
+        self.n_white = 0
+        self.references = []    # [theta, attenuation rows, matched]
+        self.pairs = []         # (theta, center, offset) in pixels
+        self.suggestion = {}
+        self._theta_last = None
+        self._step = None
+        self.center.put(np.nan)
+
+    def _select(self, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        if self.rows is None:
+            ny = frames.shape[1]
+            self.rows = [ny//4, ny//2, 3*ny//4]
+        return frames if frames.shape[1] == len(self.rows) else frames[:, self.rows, :]
+
+    def _attenuation(self, proj):
+        white = self.white if self.white is not None else proj.max(axis=-1, keepdims=True)
+        norm = (proj - self.dark_guess)/np.clip(white - self.dark_guess, 1e-6, None)
+        return -np.log(np.clip(norm, 1e-6, None))
+
+    def add(self, frames, frame_type, theta=None):
+        """add a stack of frames (n, ny, nx) or selected rows of one frame type"""
+        frames = self._select(frames)
+        with self._lock:
+            if frame_type == 0:
+                total = frames.sum(axis=0)
+                if self.white is None:
+                    self.white, self.n_white = total/len(frames), len(frames)
+                else:
+                    self.n_white += len(frames)
+                    self.white += (total - len(frames)*self.white)/self.n_white
+            elif frame_type == 1:
+                if theta is None:
+                    return  # pairs need the angles
+                for proj, ang in zip(frames, theta):
+                    self._add_projection(proj, float(ang))
+
+    def _add_projection(self, proj, theta):
+        if self._theta_last is not None and theta != self._theta_last:
+            self._step = abs(theta - self._theta_last)
+        self._theta_last = theta
+        tolerance = self.tolerance or (0.51*self._step if self._step else 0.5)
+
+        for ref in self.references:
+            if not ref[2] and abs(abs(theta - ref[0]) - 180) <= tolerance:
+                ref[2] = True
+                self._add_pair(ref[0], ref[1], self._attenuation(proj))
+                return
+        # references are spread over the first half turn
+        first = self.references[0][0] if self.references else theta
+        spacing = 180/self.max_pairs
+        if len(self.references) < self.max_pairs and abs(theta - first) < 180 - tolerance and (
+            not self.references or abs(theta - self.references[-1][0]) >= spacing - tolerance
+        ):
+            self.references.append([theta, self._attenuation(proj), False])
+
+    def _add_pair(self, theta, att0, att180):
+        """cross-correlate att0 with mirrored att180, all rows at once"""
+        nx = att0.shape[-1]
+        a0 = att0 - att0.mean(axis=-1, keepdims=True)
+        a1 = att180[:, ::-1] - att180.mean(axis=-1, keepdims=True)
+        cc = np.fft.irfft(
+            np.fft.rfft(a1, 2*nx)*np.conj(np.fft.rfft(a0, 2*nx)), 2*nx,
+        ).sum(axis=0)
+        k = int(np.argmax(cc))
+        # sub-pixel, parabola through the peak
+        y0, y1, y2 = cc[k-1], cc[k], cc[(k+1) % len(cc)]
+        denom = y0 - 2*y1 + y2
+        shift = (k if k < nx else k - 2*nx) + (0.5*(y0 - y2)/denom if denom else 0.0)
+        center = (nx - 1 - shift)/2
+
+        # sample offset from the axis, attenuation centroids
+        x = np.arange(nx)
+        c0 = (att0.sum(axis=0)*x).sum()/max(att0.sum(), 1e-12)
+        c180 = (att180.sum(axis=0)*x).sum()/max(att180.sum(), 1e-12)
+        self.pairs.append((theta, float(center), float(c0 - c180)/2))
+        self._update()
+
+    def _update(self):
+        theta, center, offset = (np.array(v) for v in zip(*self.pairs))
+        self.center.put(float(np.median(center)))
+
+        scale = self.pixel_size or 1.0
+        rad = np.radians(theta)
+        A = np.stack([np.cos(rad), np.sin(rad)], axis=1)
+        (dx, dz), _, rank, _ = np.linalg.lstsq(A, offset, rcond=None)
+        if rank == 2:
+            self.suggestion = {'ksamX': float(-dx*scale), 'ksamZ': float(-dz*scale)}
+        elif abs(A[0, 0]) > 0.7:
+            # one direction only, near 0/180 deg
+            self.suggestion = {'ksamX': float(-offset[0]/A[0, 0]*scale)}
+        elif abs(A[0, 1]) > 0.7:
+            self.suggestion = {'ksamZ': float(-offset[0]/A[0, 1]*scale)}
+
+    def finish(self):
+        """summary at the end of the scan"""
+        if not self.pairs:
+            print("🙈: no opposite projections, no center of rotation")
+            return
+        unit = 'mm' if self.pixel_size else 'pixel'
+        center = self.center.get()
+        nx = self.references[0][1].shape[-1]
+        print(f"🙊: center of rotation {center:.2f} ({center - (nx - 1)/2:+.2f} from the image center, {len(self.pairs)} pairs)")
+        for motor, value in self.suggestion.items():
+            print(f"🙊: suggest moving {motor} by {value:+.4f} {unit}")
+
+keywords_vars['rotation_center'] = 'live center of rotation estimate, rotation_center.center (signal)'
+rotation_center = RotationCenterEstimator()
+
+
+class LiveSinogram():
+    """
+    RunEngine callback following the HDF5 file of each tomo_scan with a
+    SinogramPreview and the center of rotation estimator (any consumer with
+    add(frames, frame_type, theta), rows and reset(), optionally finish()
+    called at the end of the scan).
+
+    >> live_sinogram.enable()
+    >> RE(tomo_scan('tomo_6bma.yml'))  # with output: swmr > 0
+    >> live_sinogram.preview.plot()     # at any time during the scan
+    """
+
+    def __init__(self, rows=None, col_bin=4, max_projections=1024, dark=0.0):
+        self.preview = SinogramPreview(rows, col_bin, max_projections, dark)
+        self.consumers = [self.preview, rotation_center]
+        self.scan = None
+        self._n_proj = 0
+        self.token = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def enable(self):
+        if self.token is None:
+            self.token = RE.subscribe(self)
+
+    def disable(self):
+        if self.token is not None:
+            RE.unsubscribe(self.token)
+            self.token = None
+
+    def add(self, frames, frame_type):
+        theta = None
+        if frame_type == 1 and self.scan is not None:
+            # commanded angles, the PSO positions are only known after the scan
+            pso_start, pso_delta = _pso_setpoints(self.scan)
+            scan = {'pso_start': pso_start, 'pso_delta': pso_delta, **self.scan}
+            theta = tomo_theta(scan, self._n_proj + len(frames))[self._n_proj:]
+            self._n_proj += len(frames)
+        for consumer in self.consumers:
+            consumer.add(frames, frame_type, theta)
+
+    @property
+    def rows(self):
+        return self.preview.rows
+
+    @rows.setter
+    def rows(self, rows):
+        for consumer in self.consumers:
+            consumer.rows = sorted(rows)
+
+    def __call__(self, name, doc):
+        if name == 'start' and doc.get('tomo_scan', {}).get('output_type') in ['hdf', 'hdf1', 'hdf5']:
+            for consumer in self.consumers:
+                consumer.reset()
+            self.scan = doc['tomo_scan']
+            self._n_proj = 0
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+            self._thread.start()
+        elif name == 'stop':
+            self._stop.set()
+
+    def _run(self, stop_event):
+        _attach_ca_context()
+        if not hasattr(det, 'hdf1'):
+            return  # simulated detector, nothing written
+        # the file name is known once the HDF5 plugin starts capturing
+        t_end = time.time() + 60
+        while not _read_or(det.hdf1.capture, 0):
+            if stop_event.is_set() or time.time() > t_end:
+                return
+            time.sleep(0.2)
+        follow_hdf5(_read_or(det.hdf1.full_file_name, ''), self, stop_event)
+        for consumer in self.consumers:
+            if hasattr(consumer, 'finish'):
+                consumer.finish()
+
+keywords_vars['live_sinogram'] = 'live sinogram preview of tomo_scan, see live_sinogram.enable()'
+live_sinogram = LiveSinogram()
+
+_startup_leave(__file__)
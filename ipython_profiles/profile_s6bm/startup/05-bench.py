@@ -0,0 +1,609 @@
+_startup_enter(__file__)
+# ----- plan benchmarks ----- #
+# NOTE:
+#  Run against the current mode, i.e. the simulated beamline in debug mode
+#  or the soft IOC (softioc/ioc_6bma.py) in dryrun.  Timings only compare
+#  with a baseline taken on the same host in the same mode.
+import io
+import json
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+from collections import defaultdict
+
+keywords_vars['BENCH_DIR'] = 'where benchmark results and baselines are saved'
+BENCH_DIR = os.path.join(os.path.expanduser('~'), '.s6bm', 'benchmarks')
+
+_repo_root = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), *[os.pardir]*3))
+
+keywords_vars['BENCH_SCANS'] = 'tomo_scan benchmark cases, overrides of configs/tomo_6bma.yml'
+BENCH_SCANS = {
+    f'tomo_{kind}_{output}': {
+        'tomo': {
+            'type':            kind,
+            'n_white':         2,
+            'n_dark':          2,
+            'omega_start':     0.0,
+            'omega_end':       10.0,
+            'omega_step':      1.0 if kind == 'step' else 0.5,
+            'readout_time':    0.05,
+            'reuse_flat_dark': False,
+        },
+        'output': {'type': output, 'fileprefix': f'bench_{kind}_{output}', 'swmr': 0},
+    }
+    for kind, outputs in [('step', ('tiff', 'hdf')), ('fly', ('tiff', 'hdf')), ('step_fast', ('hdf',))]
+    for output in outputs
+}
+
+keywords_vars['BENCH_TOLERANCE'] = 'allowed relative increase per benchmark metric'
+BENCH_TOLERANCE = {
+    'wall_time':   0.10,
+    'phase_time':  0.20,
+    'peak_memory': 0.20,
+    'messages':    0.0,   # deterministic, any change is reported
+    'documents':   0.0,
+    'default':     0.20,  # mode.set devices, startup files
+}
+
+
+class PlanMessageCounter():
+    """
+    Plan preprocessor counting the messages by phase and command.
+
+    The phase is selected by the last value put to phase_signal (e.g.
+    det.cam.frame_type), 'setup' before that.  A put skipped by mv_batch
+    (unchanged value) does not change the phase, which is only the case
+    when a scan starts with the frame type the previous one ended with.
+    The wall time between phase changes is kept in phase_time.
+    """
+
+    def __init__(self, phase_signal=None, phase_names=None):
+        self.phase_signal = phase_signal
+        self.phase_names = phase_names or []
+        self.reset()
+
+    def reset(self):
+        self.phase = 'setup'
+        self.messages = defaultdict(lambda: defaultdict(int))
+        self.phase_time = defaultdict(float)
+        self._t = None
+
+    def _switch(self, phase):
+        t = time.perf_counter()
+        self.phase_time[self.phase] += t - self._t
+        self.phase, self._t = phase, t
+
+    def _count(self, msg):
+        if self._t is None:
+            self._t = time.perf_counter()
+        if msg.command == 'set' and msg.obj is not None and msg.obj is self.phase_signal:
+            idx = int(msg.args[0])
+            self._switch(self.phase_names[idx] if idx < len(self.phase_names) else str(msg.args[0]))
+        self.messages[self.phase][msg.command] += 1
+        return msg
+
+    def __call__(self, plan):
+        return bpp.msg_mutator(plan, self._count)
+
+    def finish(self):
+        if self._t is not None:
+            self._switch(self.phase)
+        return {
+            'messages':   {k: dict(v) for k, v in self.messages.items()},
+            'phase_time': dict(self.phase_time),
+        }
+
+
+class _MemoryPeak():
+    """peak of the python allocations (bytes) above the level at enter"""
+
+    def __enter__(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+        self.peak = 0
+        return self
+
+    def __exit__(self, *exc):
+        self.peak = max(tracemalloc.get_traced_memory()[1] - self._base, 0)
+        if self._started:
+            tracemalloc.stop()
+
+
+def bench_plan(plan_factory, RE=None, phase_signal=None, phase_names=None, memory=False):
+    """
+    Run plan_factory() on RE (default: the session RE) and return its wall
+    time, message counts (per phase) and documents emitted.  With memory,
+    the plan is run a second time under tracemalloc for the peak memory,
+    so that the tracing does not slow down the timed run, on a RunEngine
+    without subscriptions (nothing is saved to the database).
+    """
+    RE = RE or globals()['RE']
+    counter = PlanMessageCounter(phase_signal, phase_names)
+    documents = defaultdict(int)
+
+    def count_doc(name, doc):
+        documents[name] += 1
+
+    token = RE.subscribe(count_doc)
+    try:
+        t0 = time.perf_counter()
+        RE(counter(plan_factory()))
+        wall_time = time.perf_counter() - t0
+    finally:
+        RE.unsubscribe(token)
+    result = {'wall_time': wall_time, **counter.finish(), 'documents': dict(documents)}
+    if memory:
+        with _MemoryPeak() as mem:
+            RunEngine({})(plan_factory())
+        result['peak_memory'] = mem.peak
+    return result
+
+
+def _bench_tomo_scan(overrides, config, RE=None, memory=False):
+    cfg = load_config(config)
+    for section, values in overrides.items():
+        cfg.setdefault(section, {}).update(values)
+    outdir = tempfile.mkdtemp(prefix='s6bm_bench_')
+    cfg['output']['filepath'] = outdir + os.sep
+    try:
+        estimate = estimate_tomo_scan(cfg)['total']
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = bench_plan(
+                lambda: tomo_scan(cfg), RE, det.cam.frame_type, TOMO_PHASES,
+                memory=memory,
+            )
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+    result['estimate'] = estimate
+    return result
+
+
+def _bench_mode_set(mode_name):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        mode.set(mode_name)
+        wall_time = time.perf_counter() - t0
+    return {'wall_time': wall_time, 'devices': dict(mode.init_engine.timings)}
+
+
+def _bench_startup(bench_mode, timeout=300):
+    """
+    launch the profile in a new process and switch it to bench_mode (the
+    profile always starts in debug mode with lazy devices), time both and
+    the startup files
+    """
+    shell = IPython.get_ipython()
+    profile_dir = shell.profile_dir.location
+    code = (
+        "import json; t0 = time.perf_counter(); mode.set(%r); t_mode = time.perf_counter() - t0; "
+        "print('S6BM_BENCH', json.dumps({'mode_set': t_mode, "
+        "'files': {os.path.basename(k): v for k, v in _startup_files.items()}}))"
+    ) % bench_mode
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-m', 'IPython', '--no-banner', '--colors=NoColor',
+         f'--ipython-dir={os.path.dirname(profile_dir)}',
+         f"--profile={os.path.basename(profile_dir).replace('profile_', '', 1)}",
+         '-c', code],
+        capture_output=True, text=True, timeout=timeout, stdin=subprocess.DEVNULL,
+    )
+    wall_time = time.perf_counter() - t0
+    lines = [l for l in proc.stdout.splitlines() if l.startswith('S6BM_BENCH ')]
+    if not lines:
+        raise RuntimeError(f"profile startup failed (exit code {proc.returncode}):\n{proc.stderr[-2000:]}")
+    out = json.loads(lines[-1].split(' ', 1)[1])
+    return {
+        'wall_time':    wall_time,
+        'profile_time': sum(out['files'].values()),
+        'mode_set':     out['mode_set'],
+        'files':        out['files'],
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=_repo_root,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+keywords_func['run_benchmarks'] = 'Benchmark tomo_scan, mode.set() and startup, compare to baseline'
+def run_benchmarks(cases=None, bench_mode=None, config=None, RE=None,
+                   startup=True, memory=False, save=True, baseline=None, tolerance=None):
+    """
+    Run the tomo_scan cases (default: BENCH_SCANS, step/fly x tiff/hdf and
+    step_fast), mode.set(bench_mode) and the profile startup followed by
+    mode.set(bench_mode) in a new process, and record the wall time,
+    message counts per phase and documents of each.
+
+    bench_mode: mode to benchmark (default: the current one), i.e. debug
+                for the simulated beamline, dryrun with the soft IOC.
+                production is refused, the scans would drive the beamline
+    memory:     also measure the peak memory (python allocations) in a
+                second run of every scan, not saved to the database
+    config:     scan config the cases override (default: configs/tomo_6bma.yml)
+    save:       write the results to BENCH_DIR
+    baseline:   results (dict or JSON file) to compare with, default: the
+                baseline of bench_mode in BENCH_DIR if any
+
+    Return the results, see save_benchmark_baseline() to make them the
+    baseline.
+    """
+    bench_mode = bench_mode or mode._mode
+    if bench_mode.lower() not in ['debug', 'dryrun']:
+        raise ValueError(f"🙉: cannot benchmark in {bench_mode} mode, use debug or dryrun")
+    config = config or os.path.join(_repo_root, 'configs', 'tomo_6bma.yml')
+    cases = BENCH_SCANS if cases is None else cases
+    results = {
+        'date':     datetime.isoformat(datetime.now(), " "),
+        'host':     HOSTNAME,
+        'mode':     bench_mode,
+        'commit':   _git_commit(),
+        'versions': {'bluesky': bluesky.__version__, 'ophyd': ophyd.__version__},
+        'cases':    {},
+    }
+    print(f"🙊: benchmarking in {bench_mode} mode...")
+    results['cases']['mode_set'] = _bench_mode_set(bench_mode)
+    for name, overrides in cases.items():
+        results['cases'][name] = _bench_tomo_scan(overrides, config, RE, memory=memory)
+        print(f"🙊: {name} took {results['cases'][name]['wall_time']:.1f} s")
+    if startup:
+        results['cases']['startup'] = _bench_startup(bench_mode)
+    report_benchmarks(results)
+
+    if save:
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        fn = os.path.join(BENCH_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{bench_mode}.json")
+        with open(fn, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"🙊: results saved to {fn}")
+    if baseline is None:
+        baseline = _baseline_file(bench_mode)
+        baseline = baseline if os.path.exists(baseline) else None
+    if baseline is not None:
+        compare_benchmarks(results, baseline, tolerance)
+    return results
+
+
+def report_benchmarks(results):
+    """print the wall time, peak memory, messages and documents per case"""
+    print(f"🙊: benchmarks of {results['date']} ({results['mode']}, {results['host']}, {results['commit']})")
+    for name, case in results['cases'].items():
+        line = f"\t{name}:\t{case['wall_time']:.2f} s"
+        if 'estimate' in case:
+            line += f" (estimate {case['estimate']:.1f} s)"
+        if 'peak_memory' in case:
+            line += f", peak {case['peak_memory']/2**20:.1f} MiB"
+        if 'messages' in case:
+            n_msg = sum(sum(v.values()) for v in case['messages'].values())
+            line += f", {n_msg} messages, {sum(case['documents'].values())} documents"
+        print(line)
+    print()
+
+
+def _baseline_file(bench_mode):
+    return os.path.join(BENCH_DIR, f'baseline_{bench_mode}.json')
+
+
+keywords_func['save_benchmark_baseline'] = 'Make benchmark results the baseline of their mode'
+def save_benchmark_baseline(results, filename=None):
+    """save results (dict or JSON file) as the baseline of their mode"""
+    if not isinstance(results, dict):
+        with open(results) as f:
+            results = json.load(f)
+    filename = filename or _baseline_file(results['mode'])
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"🙊: baseline of {results['mode']} saved to {filename}")
+
+
+def _flatten(tree, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1}, numbers only"""
+    flat = {}
+    for key, val in tree.items():
+        if isinstance(val, dict):
+            flat.update(_flatten(val, f'{prefix}{key}.'))
+        elif isinstance(val, (int, float)) and not isinstance(val, bool):
+            flat[f'{prefix}{key}'] = val
+    return flat
+
+
+keywords_func['compare_benchmarks'] = 'Compare benchmark results with a baseline'
+def compare_benchmarks(results, baseline, tolerance=None, verbose=False):
+    """
+    Compare the metrics of results with baseline (dicts or JSON files).
+    A metric regresses when it grows by more than its relative tolerance,
+    BENCH_TOLERANCE[metric] updated with tolerance (float: all metrics).
+
+    Return the list of (case, metric, baseline value, value) regressions.
+    """
+    loaded = []
+    for res in (results, baseline):
+        if not isinstance(res, dict):
+            with open(res) as f:
+                res = json.load(f)
+        loaded.append(res)
+    results, baseline = loaded
+    tol = dict(BENCH_TOLERANCE)
+    if isinstance(tolerance, dict):
+        tol.update(tolerance)
+    elif tolerance is not None:
+        tol = {key: float(tolerance) for key in tol}
+    if results['mode'] != baseline['mode'] or results['host'] != baseline['host']:
+        print(f"🙈: comparing {results['mode']}@{results['host']} with "
+              f"{baseline['mode']}@{baseline['host']}, timings may not compare")
+
+    regressions = []
+    print(f"🙊: compared with the baseline of {baseline['date']} ({baseline['commit']})")
+    for name, case in results['cases'].items():
+        if name not in baseline['cases']:
+            print(f"\t{name}:\tnot in the baseline")
+            continue
+        ref = _flatten(baseline['cases'][name])
+        for key, val in _flatten(case).items():
+            if key not in ref or key == 'estimate':
+                continue
+            base = ref[key]
+            limit = tol.get(key.split('.')[0], tol['default'])
+            change = (val - base)/base if base else float(val > 0)
+            if change > limit:
+                regressions.append((name, key, base, val))
+                print(f"\t🙉 {name}:\t{key} {base:.4g} -> {val:.4g} ({change:+.1%}, tolerance {limit:.0%})")
+            elif verbose or (abs(change) > limit and limit == 0):
+                print(f"\t{name}:\t{key} {base:.4g} -> {val:.4g} ({change:+.1%})")
+    if regressions:
+        print(f"🙉: {len(regressions)} metric(s) over the tolerance")
+    else:
+        print(f"🙊: no regression")
+    print()
+    return regressions
+
+
+# ----- RE message profiler ----- #
+class MessageProfiler():
+    """
+    Time the messages processed by a RunEngine, by phase, command and object.
+
+    Once enabled, the msg_hook of RE records when each message starts, and
+    a message lasts until the next one starts (e.g. a 'wait' lasts until
+    its group is done, the time is booked to the objects set/triggered in
+    that group).  The statuses the RE waits for (waiting_hook) are timed
+    from their set/trigger/kickoff/complete message until done as well,
+    i.e. put to put-completion per PV.
+
+    The phase is selected by the last value put to phase_signal (default:
+    det.cam.frame_type of the current det, looked up at each open_run) and
+    named after phase_names (default: TOMO_PHASES), 'setup' before that.
+    tomo_scan puts the frame type of a phase before moving the sample or
+    the shutter for it.  The wall time of a phase not spent in a timed
+    message is '(plan)'.
+
+        >> re_profiler.enable()
+        >> RE(tomo_scan('tomo_6bma.yml'))
+        >> re_profiler.report()
+        >> re_profiler.folded('tomo.folded')  # for flamegraph.pl/speedscope
+    """
+
+    COMMANDS = ('set', 'trigger', 'wait', 'read', 'checkpoint')
+
+    def __init__(self, commands=None, phase_signal=None, phase_names=None):
+        self.commands = tuple(commands or self.COMMANDS)
+        self.phase_signal = phase_signal
+        self.phase_names = phase_names
+        self.RE = None
+        self._hooks = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        state = 'enabled' if self.RE is not None else 'disabled'
+        return (f"MessageProfiler({state}, {self.n_messages} messages, "
+                f"{self.n_runs} run(s), {sum(self.wall_time.values()):.1f} s)")
+
+    def reset(self):
+        """drop the recorded timings"""
+        with self._lock:
+            self.stats = {}      # {(phase, command, object): [n, total, max]}
+            self.statuses = {}   # {(phase, action, object): [n, total, max]}
+            self.wall_time = defaultdict(float)  # {phase: s}
+            self.n_runs = 0
+            self.n_messages = 0
+            self._groups = defaultdict(list)
+            self._issued = {}    # {name: (t, phase, action)} until waited for
+            self._current = None # (phase, command, name, t) of the running message
+            self._signal = None
+            self._phase = 'setup'
+            self._t = None
+
+    def enable(self, RE=None):
+        """set the msg_hook and waiting_hook of RE (default: the session RE)"""
+        RE = RE or globals()['RE']
+        if self.RE is RE:
+            return
+        self.disable()
+        self.RE = RE
+        self._hooks = (RE.msg_hook, RE.waiting_hook)
+        RE.msg_hook = self._on_msg
+        RE.waiting_hook = self._on_wait
+
+    def disable(self):
+        """restore the hooks"""
+        if self.RE is not None:
+            self._end_message(time.perf_counter())
+            self._close_phase()
+            self.RE.msg_hook, self.RE.waiting_hook = self._hooks
+        self.RE = None
+        self._hooks = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def _resolve_signal(self):
+        if self.phase_signal is not None:
+            return self.phase_signal
+        try:
+            return globals()['det'].cam.frame_type
+        except (KeyError, AttributeError):
+            return None
+
+    def _add(self, table, key, dt):
+        entry = table.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += dt
+        entry[2] = max(entry[2], dt)
+
+    def _close_phase(self):
+        if self._t is not None:
+            t = time.perf_counter()
+            self.wall_time[self._phase] += t - self._t
+            self._t = t
+
+    def _switch(self, value):
+        names = TOMO_PHASES if self.phase_names is None else self.phase_names
+        idx = int(value)
+        self._close_phase()
+        self._phase = names[idx] if idx < len(names) else str(value)
+
+    def _object(self, msg):
+        if msg.command == 'wait':
+            group = msg.args[0] if msg.args else msg.kwargs.get('group')
+            names = self._groups.pop(group, [])
+            return '+'.join(sorted(set(names))) or '-'
+        return getattr(msg.obj, 'name', None) or '-'
+
+    def _end_message(self, t):
+        """book the running message, which lasted until t"""
+        if self._current is not None:
+            phase, command, name, t0 = self._current
+            with self._lock:
+                self._add(self.stats, (phase, command, name), t - t0)
+                self.n_messages += 1
+            self._current = None
+
+    def _on_msg(self, msg):
+        """msg_hook, called by the RE before it processes msg"""
+        t = time.perf_counter()
+        self._end_message(t)
+        command = msg.command
+        if command == 'open_run':
+            self._signal = self._resolve_signal()
+            self._phase = 'setup'
+            self._t = t
+            self.n_runs += 1
+        elif command == 'set' and msg.obj is not None and msg.obj is self._signal:
+            self._switch(msg.args[0])
+        name = self._object(msg)
+        if command in ('set', 'trigger', 'kickoff', 'complete'):
+            group = msg.kwargs.get('group')
+            if group is not None:
+                self._groups[group].append(name)
+            self._issued[name] = (t, self._phase, command)
+        if command in self.commands:
+            self._current = (self._phase, command, name, t)
+        elif command == 'close_run':
+            self._close_phase()
+            self._t = None
+            self._issued = {}
+        if self._hooks[0] is not None:
+            self._hooks[0](msg)
+
+    def _on_wait(self, statuses):
+        """waiting_hook, called with the statuses of a wait (None once done)"""
+        for status in statuses or ():
+            # by name, msg.obj may be a LazyDevice of the device in the status
+            obj = getattr(status, 'obj', None) or getattr(status, 'device', None)
+            name = getattr(obj, 'name', None)
+            issued = self._issued.pop(name, None)
+            if issued is not None:
+                self._watch_status(status, *issued, name)
+        if self._hooks[1] is not None:
+            self._hooks[1](statuses)
+
+    def _watch_status(self, status, t0, phase, action, name):
+        def done(status):
+            with self._lock:
+                self._add(self.statuses, (phase, action, name), time.perf_counter() - t0)
+
+        if hasattr(status, 'add_callback'):
+            status.add_callback(done)
+
+    def _tree(self):
+        """{phase: {command: {object: total}}}, with '(plan)' per phase"""
+        tree = defaultdict(lambda: defaultdict(dict))
+        with self._lock:
+            for (phase, command, name), (n, total, tmax) in self.stats.items():
+                tree[phase][command][name] = total
+        for phase, wall in self.wall_time.items():
+            timed = sum(sum(v.values()) for v in tree[phase].values())
+            if wall > timed:
+                tree[phase]['(plan)'] = {'-': wall - timed}
+        return tree
+
+    def report(self, min_fraction=0.01, n_statuses=10, width=30):
+        """
+        print the time as a tree (phase > command > object) with bars
+        relative to the total, skipping entries under min_fraction, and
+        the n_statuses slowest set/trigger completions
+        """
+        tree = self._tree()
+        total = sum(sum(sum(v.values()) for v in cmds.values()) for cmds in tree.values())
+        print(f"🙊: {self.n_messages} messages in {self.n_runs} run(s), {total:.2f} s")
+        if not total:
+            return
+
+        def line(depth, label, value):
+            bar = '█'*int(round(width*value/total))
+            print(f"{'  '*depth}{label:<{36 - 2*depth}} {value:9.3f} s {value/total:6.1%} {bar}")
+
+        for phase, cmds in sorted(tree.items(), key=lambda x: -sum(sum(v.values()) for v in x[1].values())):
+            line(1, phase, sum(sum(v.values()) for v in cmds.values()))
+            for command, names in sorted(cmds.items(), key=lambda x: -sum(x[1].values())):
+                value = sum(names.values())
+                if value < min_fraction*total:
+                    continue
+                line(2, command, value)
+                if command == '(plan)':
+                    continue
+                for name, v in sorted(names.items(), key=lambda x: -x[1]):
+                    if v >= min_fraction*total:
+                        line(3, name, v)
+        if self.statuses and n_statuses:
+            print(f"🙊: slowest completions (put/trigger to done):")
+            with self._lock:
+                slowest = sorted(self.statuses.items(), key=lambda x: -x[1][1])[:n_statuses]
+            for (phase, action, name), (n, tsum, tmax) in slowest:
+                print(f"\t{phase}:\t{action} {name}:\t{n} x, {tsum:.3f} s (mean {tsum/n:.3f}, max {tmax:.3f})")
+        print()
+
+    def folded(self, filename=None):
+        """
+        folded stacks (phase;command;object microseconds), the input of
+        flamegraph.pl or speedscope, written to filename if given
+        """
+        lines = []
+        for phase, cmds in self._tree().items():
+            for command, names in cmds.items():
+                for name, value in names.items():
+                    frames = [phase, command] if name == '-' else [phase, command, name]
+                    lines.append(f"{';'.join(frames)} {int(value*1e6)}")
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+        return lines
+
+keywords_vars['re_profiler'] = 'message profiler of RE (opt-in), see re_profiler.enable()'
+re_profiler = MessageProfiler()
+
+_startup_leave(__file__)
@@ -1,4 +1,4 @@
-print(f'Enter {__file__}...')
+_startup_enter(__file__)
 # document functions defined in the profile
 
 def list_predefined_vars():
@@ -24,4 +24,8 @@ print(f"""
     before running the experiment with
     >> RE(tomo_scan(config_file)).
     {'🔥'*60}
-""")
\ No newline at end of file
+""")
+_startup_leave(__file__)
+_import_timer.uninstall()
+if sum(_startup_files.values()) > STARTUP_BUDGET:
+    print(f"🙈: startup is over the {STARTUP_BUDGET} s budget, check startup_report()")
@@ -0,0 +1,718 @@
+#!/usr/bin/env python
+"""
+Local soft IOC standing in for the 6-BM-A PVs of configs/PVs_6bma.yml
+
+Every PV listed in the YAML file is served (caproto) together with the
+behaviour of the record behind it:
+
+    <P>:mN[.FIELD]      motor record, trapezoidal moves from VELO/ACCL,
+                        the put to VAL completes once DMOV is back to 1
+    <P>:eFly:taxi/fly   busy records of the PSO controller, the put only
+                        completes once the taxi/fly motion is over, fly
+                        counts numTrigsSent and triggers the detector
+    <P>:cam1:, ...      (trailing colon) every PV below the prefix, typed
+                        after areaDetector.  Acquire runs the cam (internal
+                        or PSO triggers) and the counters of the plugin
+                        chain, no image data and no files are written
+    shutter             Open/Close, the PSS state follows after a delay
+
+Any other put completes after put_delay.  The timings are set in the
+softioc section of the YAML file.
+
+usage:
+    python softioc/ioc_6bma.py [--pvs configs/PVs_6bma.yml] [--put-delay 0.002]
+    EPICS_CA_ADDR_LIST=127.0.0.1 EPICS_CA_AUTO_ADDR_LIST=NO ipython --profile=s6bm
+    >> mode.set('dryrun')
+"""
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import re
+import time
+
+import numpy as np
+import yaml
+from caproto import ChannelChar, ChannelDouble, ChannelEnum, ChannelInteger, ChannelString
+from caproto.asyncio.server import run
+
+logger = logging.getLogger('ioc_6bma')
+
+DEFAULT_PVS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'configs', 'PVs_6bma.yml')
+
+
+# ----- PV list ----- #
+def load_pv_list(yamlfile):
+    """
+    return {pvname: annotation} of a PVs_6bma.yml style file and its
+    softioc settings, the annotation is the comment after the name
+    """
+    with open(yamlfile, 'r') as f:
+        text = f.read()
+    config = yaml.safe_load(text)
+    comments = dict(re.findall(r'^\s*-\s*"([^"]+)"[ \t]*(#[^\n]*)?$', text, re.M))
+    pvs = {}
+    for entry in config.values():
+        if isinstance(entry, dict) and 'pvs' in entry:
+            for name in entry['pvs'] or []:
+                pvs[name] = comments.get(name, '')
+    return pvs, config.get('softioc') or {}
+
+_CHOICE_PATTERNS = [
+    (r'(\d+)\s*[|:]\s*"?([^"]+?)"?', 1, 2),  # 0|"Low", 0:encoder
+    (r'"([^"]+)"\s*\|\s*(\d+)', 2, 1),       # "Yes"|1
+    (r'"([^"]+)"', None, 1),                 # "OFF", in order
+]
+
+def parse_choices(annotation):
+    """enum strings from the [...] choice list of an annotation, None if not an enum"""
+    found = re.search(r'\[([^\]]*)\]', annotation)
+    if found is None:
+        return None
+    body = found.group(1)
+    tokens = [t.strip() for t in (body.split(',') if ',' in body else re.split(r'\s{2,}', body))]
+    choices = {}
+    for index, token in enumerate(tokens):
+        for pattern, value, label in _CHOICE_PATTERNS:
+            match = re.fullmatch(pattern, token)
+            if match:
+                choices[index if value is None else int(match.group(value))] = match.group(label)
+                break
+        else:
+            return None
+    return tuple(choices.get(i, '') for i in range(max(choices) + 1))
+
+
+# ----- PV types ----- #
+# areaDetector parameters (without _RBV), the rest are numbers
+AD_LONG_STRINGS = {
+    'FilePath', 'FileName', 'FileTemplate', 'FullFileName', 'LastFileName',
+    'NDAttributesFile', 'XMLFileName', 'XMLErrorMsg',
+}
+AD_STRINGS = {
+    'PortName', 'NDArrayPort', 'PluginType', 'Manufacturer', 'Model', 'SerialNumber',
+    'FirmwareVersion', 'SDKVersion', 'DriverVersion', 'ADCoreVersion', 'StatusMessage',
+    'StringFromServer', 'StringToServer', 'WriteMessage', 'DESC', 'EGU',
+}
+AD_ENUMS = {
+    'Acquire':         ('Done', 'Acquire'),
+    'ImageMode':       ('Single', 'Multiple', 'Continuous'),
+    'TriggerMode':     ('Internal', 'Ext. Standard', 'Bulb', 'Skip frames', 'Multi exposure',
+                        'Multi exposure count', 'Low smear', 'Overlapped', 'Mode 15'),
+    'DetectorState':   ('Idle', 'Acquire', 'Readout', 'Correct', 'Saving', 'Aborting',
+                        'Error', 'Waiting', 'Initializing', 'Disconnected', 'Aborted'),
+    'DataType':        ('Int8', 'UInt8', 'Int16', 'UInt16', 'Int32', 'UInt32', 'Int64', 'UInt64',
+                        'Float32', 'Float64'),
+    'DataTypeOut':     ('Int8', 'UInt8', 'Int16', 'UInt16', 'Int32', 'UInt32', 'Int64', 'UInt64',
+                        'Float32', 'Float64', 'Automatic'),
+    'ColorMode':       ('Mono', 'Bayer', 'RGB1', 'RGB2', 'RGB3', 'YUV444', 'YUV422', 'YUV421'),
+    'FrameType':       ('Normal', 'Background', 'FlatField', 'DblCorrelation'),
+    'ShutterMode':     ('None', 'EPICS PV', 'Detector output'),
+    'Capture':         ('Done', 'Capture'),
+    'FileWriteMode':   ('Single', 'Capture', 'Stream'),
+    'FilterType':      ('RecursiveAve', 'Average', 'Sum', 'Difference', 'RecursiveAveDiff',
+                        'CopyToFilter'),
+    'FilterCallbacks': ('Every array', 'Array N only'),
+    'ReadFile':        ('Done', 'Read'),
+    'WriteFile':       ('Done', 'Write'),
+    'WriteStatus':     ('Write OK', 'Write error'),
+    'SWMRMode':        ('Off', 'On'),
+}
+AD_NO_YES = {
+    'AutoSave', 'AutoIncrement', 'DeleteDriverFile', 'FilePathExists', 'LazyOpen',
+    'BlockingCallbacks', 'ReverseX', 'ReverseY', 'StoreAttr', 'StorePerform',
+}
+AD_INTEGERS = {'FileNumber', 'MinX', 'MinY', 'BinX', 'BinY', 'DroppedArrays', 'QueueFree', 'UniqueId'}
+# mbbo fields with the enum strings of the record
+ENUM_FIELDS = (
+    'ZRST', 'ONST', 'TWST', 'THST', 'FRST', 'FVST', 'SXST', 'SVST',
+    'EIST', 'NIST', 'TEST', 'ELST', 'TVST', 'TTST', 'FTST', 'FFST',
+)
+
+def _param(name):
+    """areaDetector parameter (or record field) of a PV name, without _RBV"""
+    record, _, field = name.rpartition(':')[2].partition('.')
+    param = field or record
+    return param[:-4] if param.endswith('_RBV') else param
+
+def ad_enum(param):
+    """menu of an areaDetector parameter, None if it is not an enum"""
+    if param in AD_ENUMS:
+        return AD_ENUMS[param]
+    if param.startswith('Enable') or param in ('ArrayCallbacks', 'AutoResetFilter', 'AutoOffsetScale'):
+        return ('Disable', 'Enable')
+    if param in AD_NO_YES:
+        return ('No', 'Yes')
+    if param.endswith('OnOff'):
+        return ('Off', 'On')
+    if param.endswith('AutoMode'):
+        return ('Manual', 'Auto')
+    return None
+
+def _is_integer(param):
+    return param.startswith('Num') or param.endswith('Counter') or 'Size' in param or param in AD_INTEGERS
+
+
+class _SoftPV():
+    """hooks of a served PV, a CA put completes once they are done"""
+    on_put = None     # coroutine function, the behaviour of the record
+    put_delay = 0.0   # sec, processing time of the put
+    readback = None   # the _RBV PV following this one
+
+    async def write_from_dbr(self, *args, **kwargs):
+        await super().write_from_dbr(*args, **kwargs)
+        if self.put_delay:
+            await asyncio.sleep(self.put_delay)
+        if self.readback is not None:
+            await self.readback.write(self.value)
+        if self.on_put is not None:
+            await self.on_put()
+
+class SoftDouble(_SoftPV, ChannelDouble): pass
+class SoftInteger(_SoftPV, ChannelInteger): pass
+class SoftEnum(_SoftPV, ChannelEnum): pass
+class SoftString(_SoftPV, ChannelString): pass
+class SoftChar(_SoftPV, ChannelChar): pass
+
+
+# ----- PV database ----- #
+class SoftIOC(dict):
+    """
+    PV database of the soft IOC
+
+    The PVs below one of the served prefixes are created on their first
+    search, typed after their name (areaDetector conventions, then the
+    choices of the YAML file); X and X_RBV are always created together
+    and a put to X is copied to X_RBV.  These names are logged and kept in
+    created, so that a misspelled PV does not go unnoticed.
+    """
+
+    def __init__(self, put_delay=0.0):
+        super().__init__()
+        self.put_delay = put_delay
+        self.prefixes = ()   # serve every PV below these
+        self.choices = {}    # {pvname: enum strings}
+        self.created = []    # PVs created on search
+
+    def __missing__(self, name):
+        if name.endswith('.VAL'):
+            return self[name[:-4]]
+        if not name.startswith(self.prefixes):
+            raise KeyError(name)
+        pv = self.pv(name)
+        self.created.append(name)
+        logger.info("created %s (%s) on search", name, type(pv).__name__)
+        return pv
+
+    def serve(self, prefix):
+        if prefix not in self.prefixes:
+            self.prefixes += (prefix,)
+
+    def pv(self, name, value=None, choices=None):
+        """return the PV name, created (with its _RBV pair) if missing"""
+        if dict.__contains__(self, name):
+            return dict.__getitem__(self, name)
+        if choices is not None:
+            self.choices[name] = tuple(choices)
+        if '.' in name:
+            self[name] = self._new(name, value)
+            return self[name]
+        base = name[:-4] if name.endswith('_RBV') else name
+        self.choices.setdefault(base + '_RBV', self.choices.get(base))
+        setpoint, readback = self._new(base, value), self._new(base + '_RBV', value)
+        setpoint.readback = readback
+        self[base], self[base + '_RBV'] = setpoint, readback
+        return self[name]
+
+    def _new(self, name, value):
+        param = _param(name)
+        choices = ad_enum(param) or self.choices.get(name)
+        if param in AD_LONG_STRINGS:
+            pv = SoftChar(value=value or '', max_length=256)
+        elif param in AD_STRINGS or param in ENUM_FIELDS:
+            pv = SoftString(value=value or '')
+        elif choices:
+            if not isinstance(value, str):
+                value = choices[int(value or 0)]
+            pv = SoftEnum(value=value, enum_strings=choices)
+        elif _is_integer(param) or (isinstance(value, int) and not isinstance(value, bool)):
+            pv = SoftInteger(value=int(value or 0))
+        elif isinstance(value, str):
+            pv = SoftString(value=value)
+        else:
+            pv = SoftDouble(value=float(value or 0), precision=4)
+        pv.put_delay = self.put_delay
+        record, _, field = name.partition('.')
+        if field in ENUM_FIELDS:
+            pv.on_put = functools.partial(self._enum_string, record, ENUM_FIELDS.index(field), pv)
+        return pv
+
+    async def _enum_string(self, record, index, pv):
+        """a put to FIELD.xxST renames the choice of the record"""
+        enum = self[record]
+        if not isinstance(enum, ChannelEnum):
+            return
+        current = self.value(record)
+        strings = list(enum.enum_strings) + [''] * (index + 1 - len(enum.enum_strings))
+        strings[index] = pv.value
+        await enum.write_metadata(enum_strings=strings)
+        await enum.write(strings[current])
+
+    def value(self, name):
+        """value of name, the index for an enum"""
+        pv = self.pv(name)
+        if isinstance(pv, ChannelEnum):
+            return pv.enum_strings.index(pv.value) if pv.value in pv.enum_strings else 0
+        return pv.value
+
+    async def post(self, name, value, **kwargs):
+        """update name (and its _RBV) from the IOC, no put hook"""
+        pv = self.pv(name)
+        await pv.write(value, **kwargs)
+        if pv.readback is not None:
+            await pv.readback.write(value, **kwargs)
+
+
+# ----- records ----- #
+class MotorRecord():
+    """motor record prefix, trapezoidal moves with VELO (egu/s) and ACCL (s)"""
+    tick = 0.02  # sec between readback updates
+
+    def __init__(self, ioc, prefix, velocity=1.0, acceleration=0.2, egu='mm'):
+        self.ioc = ioc
+        self.prefix = prefix
+        self.listeners = []  # coroutine functions called with each readback
+        self._task = None
+        self._done = asyncio.Event()
+        self._done.set()
+        fields = {
+            'RBV': 0.0, 'DVAL': 0.0, 'DRBV': 0.0, 'OFF': 0.0, 'VELO': float(velocity),
+            'VBAS': 0.0, 'VMAX': 0.0, 'ACCL': float(acceleration), 'EGU': egu,
+            'MOVN': 0, 'DMOV': 1, 'HLS': 0, 'LLS': 0, 'HLM': 0.0, 'LLM': 0.0,
+            'DHLM': 0.0, 'DLLM': 0.0, 'TDIR': 0, 'STOP': 0, 'HOMF': 0, 'HOMR': 0,
+            'MSTA': 0, 'LVIO': 0, 'MRES': 1e-5, 'RDBD': 1e-4, 'PREC': 4, 'DESC': '',
+        }
+        menus = {
+            'DIR': ('Pos', 'Neg'), 'FOFF': ('Variable', 'Frozen'), 'SET': ('Use', 'Set'),
+            'CNEN': ('Disable', 'Enable'), 'SPMG': ('Stop', 'Pause', 'Move', 'Go'),
+        }
+        for field, value in fields.items():
+            ioc.pv(f'{prefix}.{field}', value)
+        for field, choices in menus.items():
+            ioc.pv(f'{prefix}.{field}', len(choices) - 1 if field == 'SPMG' else 0, choices=choices)
+        self.val = ioc[prefix] = ioc[f'{prefix}.VAL'] = SoftDouble(value=0.0, precision=4)
+        self.val.put_delay = ioc.put_delay
+        self.val.on_put = lambda: self.move(self.val.value)
+        self.rbv = ioc[f'{prefix}.RBV']
+        self.velo = ioc[f'{prefix}.VELO']
+        self.accl = ioc[f'{prefix}.ACCL']
+        ioc[f'{prefix}.STOP'].on_put = self._stop
+        ioc.serve(prefix + '.')
+
+    async def move(self, target, velocity=None):
+        """move to target and return once done, a new move retargets"""
+        if self._task is not None:
+            self._task.cancel()
+        self._done.clear()
+        await self.val.write(target)
+        self._task = asyncio.ensure_future(self._run(target, velocity or self.velo.value))
+        await self._done.wait()
+
+    async def _stop(self):
+        if not self.ioc.value(f'{self.prefix}.STOP'):
+            return
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.val.write(self.rbv.value)
+        await self._finish()
+        await self.ioc.post(f'{self.prefix}.STOP', 0)
+
+    async def _finish(self):
+        await self.ioc.post(f'{self.prefix}.MOVN', 0)
+        await self.ioc.post(f'{self.prefix}.DMOV', 1)
+        self._done.set()
+
+    async def _readback(self, value):
+        await self.rbv.write(value)
+        await self.ioc.post(f'{self.prefix}.DRBV', value)
+        for listener in self.listeners:
+            await listener(value)
+
+    async def _run(self, target, velocity):
+        x0 = self.rbv.value
+        distance = abs(target - x0)
+        sign = 1 if target >= x0 else -1
+        t_accl = max(self.accl.value, 1e-3)
+        await self.ioc.post(f'{self.prefix}.TDIR', int(sign > 0))
+        await self.ioc.post(f'{self.prefix}.DMOV', 0)
+        await self.ioc.post(f'{self.prefix}.MOVN', 1)
+        if velocity > 0 and distance > 0:
+            accel = velocity/t_accl
+            if distance < velocity*t_accl:
+                # never reach the full velocity
+                t_accl = np.sqrt(distance/accel)
+                velocity = accel*t_accl
+            t_total = 2*t_accl + (distance - velocity*t_accl)/velocity
+
+            def travel(t):
+                if t < t_accl:
+                    return 0.5*accel*t**2
+                if t < t_total - t_accl:
+                    return 0.5*velocity*t_accl + velocity*(t - t_accl)
+                return distance - 0.5*accel*(t_total - t)**2
+
+            t0 = time.monotonic()
+            while True:
+                await asyncio.sleep(self.tick)
+                t = time.monotonic() - t0
+                if t >= t_total:
+                    break
+                await self._readback(x0 + sign*travel(t))
+        await self._readback(target)
+        self._task = None
+        await self._finish()
+
+
+class PSOFly():
+    """
+    Ensemble PSO fly controller (eFly) prefix on the rotation motor
+
+    taxi moves the motor to the run-up position before startPos, fly
+    moves it past endPos at slewSpeed and sends a trigger (numTrigsSent
+    and the detectors) every scanDelta from startPos to endPos.
+    """
+    tick = 0.005  # sec, polling of the motor readback
+
+    def __init__(self, ioc, prefix, motor, detectors=()):
+        self.ioc = ioc
+        self.prefix = prefix
+        self.motor = motor
+        self.detectors = list(detectors)
+        pv = lambda suffix, value, choices=None: ioc.pv(prefix + suffix, value, choices=choices)
+        self.start = pv('startPos', 0.0)
+        self.end = pv('endPos', 0.0)
+        self.delta = pv('scanDelta', 1.0)
+        self.speed = pv('slewSpeed', 1.0)
+        self.expected = pv('calcNumTriggers', 1)
+        self.sent = pv('numTrigsSent', 0)
+        self.delta_time = pv('deltaTime', 1.0)
+        self.motor_rbv = pv('motorRBV', motor.rbv.value)
+        self.taxi = pv('taxi', 0, choices=('Done', 'Taxi'))
+        self.fly = pv('fly', 0, choices=('Done', 'Fly'))
+        for signal in (self.start, self.end, self.delta, self.speed):
+            signal.on_put = self._calc
+        self.taxi.on_put = self._taxi
+        self.fly.on_put = self._fly
+        motor.listeners.append(self.motor_rbv.write)
+        ioc.serve(prefix)
+
+    async def _calc(self):
+        """calcNumTriggers and deltaTime"""
+        delta, speed = abs(self.delta.value), self.speed.value
+        n = int(round(abs(self.end.value - self.start.value)/delta)) + 1 if delta else 0
+        await self.expected.write(n)
+        await self.delta_time.write(delta/speed if speed else 0)
+
+    def _run_up(self):
+        """distance needed to reach slewSpeed"""
+        return self.speed.value*self.motor.accl.value
+
+    def _direction(self):
+        return 1 if self.end.value >= self.start.value else -1
+
+    async def _taxi(self):
+        if not self.ioc.value(self.prefix + 'taxi'):
+            return
+        try:
+            await self.sent.write(0)
+            await self.motor.move(self.start.value - self._direction()*self._run_up())
+        finally:
+            await self.ioc.post(self.prefix + 'taxi', 0)
+
+    async def _fly(self):
+        if not self.ioc.value(self.prefix + 'fly'):
+            return
+        sign = self._direction()
+        triggers = asyncio.ensure_future(self._triggers(sign, int(self.expected.value)))
+        try:
+            await self.motor.move(self.end.value + sign*self._run_up(), velocity=self.speed.value)
+            await asyncio.wait_for(triggers, timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            triggers.cancel()
+            await self.ioc.post(self.prefix + 'fly', 0)
+
+    async def _triggers(self, sign, n):
+        """a trigger every scanDelta once the motor passed startPos (constant speed)"""
+        start, speed = self.start.value, abs(self.speed.value)
+        while sign*(self.motor.rbv.value - start) < 0:
+            await asyncio.sleep(self.tick)
+        t0 = time.time() - abs(self.motor.rbv.value - start)/speed
+        dt = abs(self.delta.value)/speed
+        for k in range(n):
+            delay = t0 + k*dt - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.sent.write(k + 1, timestamp=t0 + k*dt)
+            for detector in self.detectors:
+                detector.external_trigger()
+
+
+class PointGreyAD():
+    """
+    areaDetector prefix, cam1 (port PG1) and its plugins
+
+    A put to cam1:Acquire runs the frames, at AcquirePeriod (Internal) or
+    on the PSO triggers (any other TriggerMode, a trigger during the
+    exposure/readout is lost), and completes when the acquisition is
+    over.  Each frame goes through the enabled plugins (NDArrayPort):
+    Proc1 averages NumFilter frames, TIFF1/HDF1 count NumCaptured and
+    stop capturing at NumCapture.
+    """
+    plugins = {
+        'Proc1:':  ('PROC1', 'NDPluginProcess'),
+        'TIFF1:':  ('TIFF1', 'NDFileTIFF'),
+        'HDF1:':   ('HDF1', 'NDFileHDF5'),
+        'image1:': ('IMAGE1', 'NDPluginStdArrays'),
+        'Trans1:': ('TRANS1', 'NDPluginTransform'),
+    }
+
+    def __init__(self, ioc, prefix, shape=(1200, 1920), readout_time=0.005, port='PG1'):
+        self.ioc = ioc
+        self.prefix = prefix
+        self.cam = prefix + 'cam1:'
+        self.port = port
+        self.readout_time = readout_time
+        self.lost_triggers = 0
+        self._task = None
+        self._armed = None  # future set by the next external trigger
+        ny, nx = shape
+        for param, value in [
+            ('PortName_RBV', port), ('Manufacturer_RBV', 'Point Grey Research'),
+            ('Model_RBV', 'Grasshopper3 GS3-U3-23S6M'), ('MaxSizeX_RBV', nx), ('MaxSizeY_RBV', ny),
+            ('SizeX', nx), ('SizeY', ny), ('ArraySizeX_RBV', nx), ('ArraySizeY_RBV', ny),
+            ('BinX', 1), ('BinY', 1), ('DataType', 'UInt8'), ('AcquireTime', 0.1),
+            ('AcquirePeriod', 0.1), ('NumImages', 1), ('ArrayCallbacks', 'Enable'),
+            ('Acquire', 0), ('DetectorState_RBV', 'Idle'),
+        ]:
+            ioc.pv(self.cam + param, value)
+        ioc.pv(self.cam + 'Acquire').on_put = self._acquire
+        for suffix, (plugin_port, plugin_type) in self.plugins.items():
+            plugin = prefix + suffix
+            for param, value in [
+                ('PortName_RBV', plugin_port), ('PluginType_RBV', plugin_type),
+                ('NDArrayPort', port if suffix in ('Proc1:', 'image1:', 'Trans1:') else 'PROC1'),
+                ('ArraySize0_RBV', nx), ('ArraySize1_RBV', ny), ('EnableCallbacks', 0),
+            ]:
+                ioc.pv(plugin + param, value)
+            if plugin_type.startswith('NDFile'):
+                extension = 'h5' if plugin_type == 'NDFileHDF5' else 'tif'
+                for param, value in [
+                    ('FileTemplate', f'%s%s_%06d.{extension}'), ('FilePathExists_RBV', 'Yes'),
+                    ('AutoIncrement', 'Yes'), ('AutoSave', 'Yes'), ('FileWriteMode', 'Stream'),
+                    ('NumCapture', 1), ('Capture', 0),
+                ]:
+                    ioc.pv(plugin + param, value)
+                ioc.pv(plugin + 'Capture').on_put = functools.partial(self._capture, plugin)
+        proc = prefix + 'Proc1:'
+        for param, value in [
+            ('EnableFilter', 'Enable'), ('FilterType', 'Average'), ('NumFilter', 1),
+            ('FilterCallbacks', 'Array N only'), ('AutoResetFilter', 'Enable'),
+        ]:
+            ioc.pv(proc + param, value)
+        ioc.pv(proc + 'ResetFilter').on_put = lambda: ioc.post(proc + 'NumFiltered_RBV', 0)
+        ioc.serve(prefix)
+
+    def external_trigger(self):
+        """a trigger pulse on the GPIO input, lost unless the cam waits for one"""
+        if self._armed is not None and not self._armed.done():
+            self._armed.set_result(time.time())
+        else:
+            self.lost_triggers += 1
+
+    async def _acquire(self):
+        """Acquire=1 runs the frames, the put completes when they are done"""
+        if not self.ioc.value(self.cam + 'Acquire'):
+            if self._task is not None:
+                self._task.cancel()
+            return
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._frames())
+        try:
+            await asyncio.shield(self._task)
+        except asyncio.CancelledError:
+            pass
+
+    async def _frames(self):
+        ioc, cam = self.ioc, self.cam
+        image_mode = ioc.value(cam + 'ImageMode')
+        n_images = [1, ioc.value(cam + 'NumImages'), np.inf][image_mode]
+        external = ioc.value(cam + 'TriggerMode') != 0
+        exposure = ioc.value(cam + 'AcquireTime')
+        period = max(ioc.value(cam + 'AcquirePeriod'), exposure + self.readout_time)
+        loop = asyncio.get_running_loop()
+        await ioc.post(cam + 'NumImagesCounter_RBV', 0)
+        await ioc.post(cam + 'DetectorState_RBV', 'Waiting' if external else 'Acquire')
+        t0 = time.time()
+        counter = 0
+        try:
+            while counter < n_images:
+                if external:
+                    self._armed = loop.create_future()
+                    await self._armed
+                    self._armed = None
+                    await asyncio.sleep(exposure + self.readout_time)
+                else:
+                    delay = t0 + counter*period + exposure + self.readout_time - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                counter += 1
+                await self._frame(counter)
+        finally:
+            self._armed = None
+            self._task = None
+            await ioc.post(cam + 'DetectorState_RBV', 'Idle')
+            await ioc.post(cam + 'Acquire', 0)
+
+    async def _frame(self, counter):
+        ioc, cam = self.ioc, self.cam
+        now = time.time()
+        await ioc.post(cam + 'NumImagesCounter_RBV', counter, timestamp=now)
+        await ioc.post(cam + 'ArrayCounter', ioc.value(cam + 'ArrayCounter_RBV') + 1, timestamp=now)
+        await self._push(self.port, now)
+
+    async def _push(self, port, now):
+        """pass one array to the enabled plugins reading from port"""
+        ioc = self.ioc
+        for suffix, (plugin_port, plugin_type) in self.plugins.items():
+            plugin = self.prefix + suffix
+            if not ioc.value(plugin + 'EnableCallbacks') or ioc.value(plugin + 'NDArrayPort') != port:
+                continue
+            await ioc.post(plugin + 'ArrayCounter', ioc.value(plugin + 'ArrayCounter_RBV') + 1, timestamp=now)
+            if plugin_type == 'NDPluginProcess' and ioc.value(plugin + 'EnableFilter'):
+                filtered = ioc.value(plugin + 'NumFiltered_RBV') + 1
+                await ioc.post(plugin + 'NumFiltered_RBV', filtered)
+                if ioc.value(plugin + 'FilterCallbacks'):
+                    if filtered < ioc.value(plugin + 'NumFilter'):
+                        continue
+                    if ioc.value(plugin + 'AutoResetFilter'):
+                        await ioc.post(plugin + 'NumFiltered_RBV', 0)
+            if plugin_type.startswith('NDFile') and ioc.value(plugin + 'Capture'):
+                captured = ioc.value(plugin + 'NumCaptured_RBV') + 1
+                await ioc.post(plugin + 'NumCaptured_RBV', captured)
+                if captured >= ioc.value(plugin + 'NumCapture') > 0:
+                    await self._close(plugin)
+            await self._push(plugin_port, now)
+
+    async def _capture(self, plugin):
+        """Capture=1 opens the (virtual) file, Capture=0 closes it"""
+        ioc = self.ioc
+        if not ioc.value(plugin + 'Capture'):
+            return await self._close(plugin)
+        try:
+            name = ioc.value(plugin + 'FileTemplate') % (
+                ioc.value(plugin + 'FilePath'),
+                ioc.value(plugin + 'FileName'),
+                ioc.value(plugin + 'FileNumber'),
+            )
+        except (TypeError, ValueError):
+            name = ''
+        await ioc.post(plugin + 'NumCaptured_RBV', 0)
+        await ioc.post(plugin + 'FullFileName_RBV', name)
+
+    async def _close(self, plugin):
+        ioc = self.ioc
+        await ioc.post(plugin + 'Capture', 0)
+        if ioc.value(plugin + 'AutoIncrement'):
+            await ioc.post(plugin + 'FileNumber', ioc.value(plugin + 'FileNumber') + 1)
+
+
+class PSSShutter():
+    """APS PSS shutter prefix, the state PV follows Open/Close after delay"""
+
+    def __init__(self, ioc, prefix, state, delay=1.5):
+        self.ioc = ioc
+        self.state = state
+        self.delay = delay
+        ioc.pv(state, 'OFF', choices=('OFF', 'ON'))
+        for suffix, value in [('Open', 'ON'), ('Close', 'OFF')]:
+            ioc.pv(prefix + suffix, 0).on_put = functools.partial(self._put, prefix + suffix, value)
+
+    async def _put(self, name, value):
+        if self.ioc.value(name):
+            asyncio.ensure_future(self._move(value))
+
+    async def _move(self, value):
+        await asyncio.sleep(self.delay)
+        await self.ioc.post(self.state, value)
+
+
+# ----- generator ----- #
+MOTOR_PV = re.compile(r'(.+:m\d+)(\.\w+)?')
+
+def build_ioc(pvs, settings, put_delay=None):
+    """SoftIOC serving pvs ({pvname: annotation}) with the records in settings"""
+    if put_delay is None:
+        put_delay = settings.get('put_delay', 0.0)
+    ioc = SoftIOC(put_delay=put_delay)
+    motors = {
+        prefix: MotorRecord(ioc, prefix, **(options or {}))
+        for prefix, options in (settings.get('motors') or {}).items()
+    }
+    detectors = {
+        prefix: PointGreyAD(ioc, prefix, **(options or {}))
+        for prefix, options in (settings.get('detector') or {}).items()
+    }
+    for prefix, options in (settings.get('psofly') or {}).items():
+        PSOFly(
+            ioc, prefix, motors[options['motor']],
+            [detectors[name] for name in options.get('detectors', [])],
+        )
+    for prefix, options in (settings.get('shutter') or {}).items():
+        PSSShutter(ioc, prefix, **options)
+    # the remaining PVs of the list
+    for name, annotation in pvs.items():
+        if '?' in name:
+            continue
+        motor = MOTOR_PV.fullmatch(name)
+        if motor:
+            if motor.group(1) not in motors:
+                motors[motor.group(1)] = MotorRecord(ioc, motor.group(1))
+        elif name.endswith(':'):
+            ioc.serve(name)
+        else:
+            name = name[:-4] if name.endswith('.VAL') else name
+            ioc.pv(name, choices=parse_choices(annotation))
+    return ioc
+
+def main():
+    parser = argparse.ArgumentParser(description='Soft IOC for the PVs of configs/PVs_6bma.yml')
+    parser.add_argument('--pvs', default=DEFAULT_PVS, help='PV list (YAML), default: %(default)s')
+    parser.add_argument('--put-delay', type=float, default=None, help='sec, overrides softioc put_delay')
+    parser.add_argument('--interfaces', nargs='+', default=['127.0.0.1'], help='default: %(default)s')
+    parser.add_argument('--list', action='store_true', help='print the generated PVs and exit')
+    parser.add_argument('--quiet', action='store_true', help='do not log the PVs created on search')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(name)s: %(message)s')
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+
+    pvs, settings = load_pv_list(args.pvs)
+    ioc = build_ioc(pvs, settings, put_delay=args.put_delay)
+    if args.list:
+        for name in sorted(ioc):
+            pv = ioc[name]
+            choices = f" {list(pv.enum_strings)}" if isinstance(pv, ChannelEnum) else ''
+            print(f"{name:45s} {type(pv).__name__:12s} {pv.value!r}{choices}")
+        print(f"+ any PV below {', '.join(ioc.prefixes)}")
+        return
+    print(f"🙊: serving {len(ioc)} PVs (and any PV below {len(ioc.prefixes)} prefixes) on {', '.join(args.interfaces)}")
+    print(f"    put delay {ioc.put_delay} s, stop with Ctrl-C")
+    run(ioc, interfaces=args.interfaces)
+
+
+if __name__ == '__main__':
+    main()
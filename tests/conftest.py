@@ -0,0 +1,67 @@
+"""
+The startup scripts of the profile share the IPython namespace and build
+the devices when they run, so they are not imported here.  load_startup
+picks top-level definitions (functions, classes, assignments) out of a
+script and executes them alone in a namespace holding their globals.
+What needs the whole profile (e.g. tomo_scan) runs in a new IPython
+process, see run_profile.
+"""
+import ast
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+STARTUP = ROOT / 'ipython_profiles' / 'profile_s6bm' / 'startup'
+
+
+def _defined_names(node):
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, ast.Assign):
+        return {t.id for t in node.targets if isinstance(t, ast.Name)}
+    return set()
+
+
+def load_startup_defs(script, names, namespace=None):
+    """execute the definitions of names in script (in file order) into namespace"""
+    fn = STARTUP / script
+    tree = ast.parse(fn.read_text(), filename=str(fn))
+    nodes = [node for node in tree.body if _defined_names(node) & set(names)]
+    missing = set(names) - set().union(*map(_defined_names, nodes))
+    if missing:
+        raise LookupError(f"{sorted(missing)} not defined in {script}")
+    ns = {'np': np, 'keywords_func': {}, 'keywords_vars': {}}
+    ns.update(namespace or {})
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), str(fn), 'exec'), ns)
+    return ns
+
+
+@pytest.fixture
+def load_startup():
+    return load_startup_defs
+
+
+def run_profile_code(code, timeout=300):
+    """
+    run code in IPython with the s6bm profile (debug mode, simulated
+    beamline), return the object it prints as 'S6BM_TEST <json>'
+    """
+    pytest.importorskip('IPython')
+    proc = subprocess.run(
+        [sys.executable, '-m', 'IPython', '--no-banner', '--colors=NoColor',
+         f"--ipython-dir={ROOT / 'ipython_profiles'}", '--profile=s6bm', '-c', code],
+        cwd=ROOT, capture_output=True, text=True, timeout=timeout, stdin=subprocess.DEVNULL,
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('S6BM_TEST ')]
+    assert lines, proc.stdout[-2000:] + proc.stderr[-2000:]
+    return json.loads(lines[-1].split(' ', 1)[1])
+
+
+@pytest.fixture
+def run_profile():
+    return run_profile_code
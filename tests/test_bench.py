@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def ns(load_startup):
+    return load_startup('05-bench.py', ['BENCH_TOLERANCE', '_flatten', 'compare_benchmarks'], {'json': json})
+
+
+def results(date='now', **cases):
+    return {'date': date, 'mode': 'debug', 'host': 'bench', 'commit': 'abc', 'cases': cases}
+
+
+def test_flatten_keeps_numbers_only(ns):
+    tree = {'wall_time': 1.0, 'files': {'a.py': 0.5}, 'name': 'x', 'ok': True}
+    assert ns['_flatten'](tree) == {'wall_time': 1.0, 'files.a.py': 0.5}
+
+
+def test_no_regression_within_the_tolerance(ns):
+    base = results(scan={'wall_time': 10.0, 'messages': {'setup': {'set': 5}}})
+    new = results(scan={'wall_time': 10.9, 'messages': {'setup': {'set': 5}}})
+    assert ns['compare_benchmarks'](new, base) == []
+
+
+def test_regressions_per_metric(ns):
+    base = results(scan={'wall_time': 10.0, 'peak_memory': 100, 'messages': {'setup': {'set': 5}}})
+    new = results(scan={'wall_time': 11.5, 'peak_memory': 110, 'messages': {'setup': {'set': 6}}})
+    assert ns['compare_benchmarks'](new, base) == [
+        ('scan', 'wall_time', 10.0, 11.5),
+        ('scan', 'messages.setup.set', 5, 6),
+    ]
+    # a float tolerance applies to every metric
+    assert ns['compare_benchmarks'](new, base, tolerance=0.25) == []
+
+
+def test_estimate_and_new_cases_are_not_compared(ns, tmp_path):
+    base = results(scan={'wall_time': 10.0, 'estimate': 1.0})
+    new = results(scan={'wall_time': 10.0, 'estimate': 5.0}, other={'wall_time': 1.0})
+    fn = tmp_path / 'baseline.json'
+    fn.write_text(json.dumps(base))
+    assert ns['compare_benchmarks'](new, str(fn)) == []
+
+
+def test_growth_from_zero_is_a_regression(ns):
+    base = results(scan={'documents': {'event': 0}})
+    new = results(scan={'documents': {'event': 2}})
+    assert ns['compare_benchmarks'](new, base) == [('scan', 'documents.event', 0, 2)]
@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def ns(load_startup):
+    names = {
+        'time': time,
+        'threading': threading,
+        'ThreadPoolExecutor': ThreadPoolExecutor,
+        'FIRST_COMPLETED': FIRST_COMPLETED,
+        'wait_futures': wait_futures,
+        'epics': SimpleNamespace(ca=SimpleNamespace(use_initial_context=lambda: None)),
+    }
+    return load_startup(
+        '02-init.py',
+        ['DeviceFactory', 'DeviceInitError', '_attach_ca_context', 'DeviceInitEngine', 'LazyDevice'],
+        names,
+    )
+
+
+class Device():
+    def __init__(self, calls, fail=False):
+        self.calls = calls
+        self.fail = fail
+
+    def wait_for_connection(self, timeout):
+        self.calls.append(('connect', timeout))
+        if self.fail:
+            raise TimeoutError("not connected")
+
+
+def test_setup_runs_once_connected(ns):
+    calls = []
+    factory = ns['DeviceFactory'](
+        'det', lambda mode: Device(calls), timeout=20,
+        setup=lambda device, mode: calls.append(('setup', mode)),
+    )
+    factory.build('dryrun')
+    assert calls == [('connect', 20), ('setup', 'dryrun')]
+
+
+def test_no_setup_if_not_connected(ns):
+    calls = []
+    factory = ns['DeviceFactory'](
+        'det', lambda mode: Device(calls, fail=True), timeout=20,
+        setup=lambda device, mode: calls.append(('setup', mode)),
+    )
+    with pytest.raises(TimeoutError):
+        factory.build('dryrun')
+    assert calls == [('connect', 20)]
+
+
+def test_failed_switch_reports_every_device(ns, capsys):
+    calls = []
+    engine = ns['DeviceInitEngine']([
+        ns['DeviceFactory']('motors', lambda mode: Device(calls)),
+        ns['DeviceFactory']('det', lambda mode: Device(calls, fail=True)),
+        ns['DeviceFactory']('preci', lambda mode, det: det, depends=['det']),
+    ])
+    with pytest.raises(ns['DeviceInitError']):
+        engine.run('dryrun')
+    assert set(engine.timings) == {'motors', 'det'}
+    engine.report()
+    out = capsys.readouterr().out
+    assert 'motors' in out
+    assert 'TimeoutError' in out
+    assert 'preci:\tdependency failed' in out
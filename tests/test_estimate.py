@@ -0,0 +1,50 @@
+"""
+The analytical quick_estimate_tomo_scan is the fast path of the dry run
+estimate_tomo_scan, they must agree.  tomo_scan needs the whole profile,
+it is run in a new IPython process (debug mode, simulated beamline).
+"""
+import json
+
+import pytest
+
+from conftest import run_profile_code
+
+CASES = {
+    'step_tiff':      {'tomo': {'type': 'step', 'n_frames': 2}, 'output': {'type': 'tiff'}},
+    'fly_hdf':        {'tomo': {'type': 'fly', 'n_frames': 1}, 'output': {'type': 'hdf'}},
+    'step_fast_hdf':  {'tomo': {'type': 'step_fast', 'n_frames': 4}, 'output': {'type': 'hdf'}},
+    'fly_reverse':    {'tomo': {'type': 'fly', 'omega_start': 20.0, 'omega_end': 0.0, 'omega_step': -1.0}},
+    'no_white_pre':   {'tomo': {'type': 'step_fast', 'n_white_pre': 0}},
+    'no_dark':        {'tomo': {'type': 'fly', 'n_dark': 0}},
+    'auto_readout':   {'tomo': {'type': 'fly', 'readout_time': 'auto', 'n_white': 0}},
+}
+
+CODE = """
+import json
+results = {}
+for name, overrides in json.loads(%r).items():
+    config = _merge_config(load_config('configs/tomo_6bma.yml'), overrides)
+    results[name] = {
+        'walk':  estimate_tomo_scan(config),
+        'quick': quick_estimate_tomo_scan(config, preci_start=get_sim_beamline().tomostage.preci.position),
+    }
+print('S6BM_TEST', json.dumps(results))
+"""
+
+
+@pytest.fixture(scope='module')
+def estimates():
+    # a short scan, the cases override the range
+    base = {'omega_start': 0.0, 'omega_end': 20.0, 'omega_step': 1.0}
+    cases = {name: {**case, 'tomo': {**base, **case['tomo']}} for name, case in CASES.items()}
+    return run_profile_code(CODE % json.dumps(cases))
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_quick_estimate_agrees_with_the_dry_run(estimates, case):
+    walk, quick = estimates[case]['walk'], estimates[case]['quick']
+    assert walk['n_messages'] > 0
+    assert set(quick['phases']) == set(walk['phases'])
+    for phase, t in walk['phases'].items():
+        assert quick['phases'][phase] == pytest.approx(t, rel=0.02, abs=0.2), phase
+    assert quick['total'] == pytest.approx(walk['total'], rel=0.02)
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+from ophyd import Signal
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def ns(load_startup):
+    beam = {
+        'time': Clock(),
+        'aps': SimpleNamespace(current=Signal(name='current', value=100.0)),
+        'A_shutter': SimpleNamespace(pss_state=Signal(name='pss_state', value=0), pss_state_open_values=[1]),
+    }
+    return load_startup('03-plans.py', ['_read_or', 'FlatDarkCache'], beam)
+
+
+@pytest.fixture
+def cache(ns):
+    cache = ns['FlatDarkCache']()
+    cache.store('key', 'white', 'uid-w', '/data', 's1')
+    cache.store('key', 'dark', 'uid-d', '/data', 's1')
+    return cache
+
+
+def test_lookup_returns_the_reference(cache):
+    assert cache.lookup('key', 'white') == {'uid': 'uid-w', 'filepath': '/data', 'fileprefix': 's1'}
+    assert cache.lookup('key', 'dark')['uid'] == 'uid-d'
+    assert cache.lookup('other', 'white') is None
+
+
+def test_white_expires_before_dark(ns, cache):
+    ns['time'].now += cache.max_age + 1
+    assert cache.lookup('key', 'white') is None
+    assert cache.lookup('key', 'dark') is not None
+    ns['time'].now += cache.max_age_dark
+    assert cache.lookup('key', 'dark') is None
+    assert cache.entries == {}
+
+
+@pytest.mark.parametrize('current, valid', [(100.5, True), (98.0, False)])
+def test_white_expires_with_the_ring_current(ns, cache, current, valid):
+    ns['aps'].current.put(current)
+    assert (cache.lookup('key', 'white') is not None) == valid
+    assert cache.lookup('key', 'dark') is not None
+
+
+def test_white_expires_with_the_shutter_cycles(ns, cache):
+    pss_state = ns['A_shutter'].pss_state
+    for _ in range(cache.max_shutter_cycles):
+        pss_state.put(1)
+        pss_state.put(0)
+    assert cache.shutter_cycles == cache.max_shutter_cycles
+    assert cache.lookup('key', 'white') is not None
+    pss_state.put(1)
+    assert cache.lookup('key', 'white') is None
+    assert cache.lookup('key', 'dark') is not None
+
+
+def test_unreadable_current_does_not_expire_white(ns, cache):
+    ns['aps'].current = SimpleNamespace(get=lambda: 1/0)
+    assert cache.lookup('key', 'white') is not None
@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+import time
+
+import bluesky.plan_stubs as bps
+import bluesky.preprocessors as bpp
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky.utils import FailedStatus
+from ophyd import (ADComponent, AreaDetector, Component, Device, DeviceStatus, EpicsMotor, EpicsSignal,
+                   EpicsSignalRO, EpicsSignalWithRBV, HDF5Plugin, MotorBundle, PointGreyDetectorCam,
+                   ProcessPlugin, Signal, SingleTrigger, TIFFPlugin)
+from ophyd.sim import make_fake_device
+from ophyd.utils.epics_pvs import AlarmSeverity
+
+SIM = [
+    'TaxiFlyScanDevice', 'NotEnoughTriggers', 'EnsemblePSOFlyDevice',
+    'SimMotor', 'SimTomoStage', 'SimBusySignal', 'SimEnsemblePSOFlyDevice', 'FlyScanTelemetry',
+    'HDF5_DATASETS', 'EPICS_EPOCH', 'PointGreyDetectorCam6BM', 'HDF5Plugin6BM', 'PointGreyDetector6BM',
+    '_is_on', 'SimPointGreyDetector6BM',
+]
+
+
+@pytest.fixture
+def ns(load_startup):
+    return load_startup('01-devices.py', SIM, {
+        'os': os, 'queue': queue, 'threading': threading, 'time': time,
+        'bps': bps, 'bpp': bpp, 'FailedStatus': FailedStatus,
+        'AreaDetector': AreaDetector, 'SingleTrigger': SingleTrigger, 'ADComponent': ADComponent,
+        'EpicsSignalWithRBV': EpicsSignalWithRBV, 'PointGreyDetectorCam': PointGreyDetectorCam,
+        'ProcessPlugin': ProcessPlugin, 'TIFFPlugin': TIFFPlugin, 'HDF5Plugin': HDF5Plugin,
+        'Component': Component, 'Device': Device, 'DeviceStatus': DeviceStatus, 'Signal': Signal,
+        'EpicsMotor': EpicsMotor, 'EpicsSignal': EpicsSignal, 'EpicsSignalRO': EpicsSignalRO,
+        'MotorBundle': MotorBundle, 'make_fake_device': make_fake_device, 'AlarmSeverity': AlarmSeverity,
+    })
+
+
+@pytest.fixture
+def psofly(ns):
+    preci = ns['SimMotor']('6bmpreci:m1', name='preci', velocity=20.0, acceleration=0.5, egu='deg')
+    psofly = ns['SimEnsemblePSOFlyDevice']('6bmpreci:eFly:', name='psofly', rotation=preci)
+    psofly.grace_period = 1
+    return psofly
+
+
+def fly(psofly, start, end, delta, slew_speed):
+    for signal, value in [(psofly.start, start), (psofly.end, end),
+                          (psofly.scan_delta, delta), (psofly.slew_speed, slew_speed)]:
+        signal.put(value)
+    RE = RunEngine({})
+
+    def plan():
+        yield from bps.mv(psofly.taxi, 'Taxi')
+        yield from psofly.plan()
+
+    RE(plan())
+
+
+def test_plan_returns_once_the_motion_is_over(psofly):
+    preci = psofly.rotation
+    fly(psofly, 0.0, 4.0, 1.0, 10.0)
+    assert psofly.actual_triggers.get() == 5
+    # the run-down past end is over before the next move can be sent
+    assert preci.motor_done_move.get() == 1
+    assert preci.user_readback.get() == pytest.approx(4.0 + 10.0*0.5)
+    assert psofly._fly_status.done
+
+
+def test_sim_fly_keeps_the_motor_velocity(psofly):
+    preci = psofly.rotation
+    fly(psofly, 0.0, 2.0, 0.5, 5.0)
+    assert psofly.actual_triggers.get() == 5
+    assert preci.velocity.get() == 20.0
+    # the next move runs at VELO, not at the slew speed
+    t0 = time.monotonic()
+    preci.set(0.0).wait(timeout=10)
+    assert time.monotonic() - t0 < 1.2  # 0.725 s at VELO, 1.4 s at the slew speed
+
+
+@pytest.fixture
+def setpoints(load_startup):
+    return load_startup('03-plans.py', ['_pso_setpoints', '_pso_end'])
+
+
+@pytest.mark.parametrize('kind, omega_start, omega_end, omega_step, n_frames', [
+    ('fly', 0.0, 4.0, 1.0, 1),
+    ('step_fast', 0.0, 4.0, 1.0, 4),
+    ('step_fast', 0.0, 4.0, 1.0, 1),
+    ('step_fast', 10.0, -10.0, -0.5, 3),
+])
+def test_triggers_match_the_images(psofly, setpoints, kind, omega_start, omega_end, omega_step, n_frames):
+    # num_images of the detector in tomo_scan
+    n_projections = len(np.arange(omega_start, omega_end + omega_step/2, omega_step))
+    n_images = n_projections*n_frames if kind == 'step_fast' else n_projections
+    scan = {'type': kind, 'omega_start': omega_start, 'omega_end': omega_end,
+            'omega_step': omega_step, 'n_frames': n_frames}
+    start, delta = setpoints['_pso_setpoints'](scan)
+    psofly.start.put(start)
+    psofly.end.put(setpoints['_pso_end'](scan))
+    psofly.scan_delta.put(delta)
+    assert psofly.expected_triggers.get() == n_images
+
+
+def test_step_fast_sends_n_frames_per_projection(psofly, setpoints):
+    scan = {'type': 'step_fast', 'omega_start': 0.0, 'omega_end': 4.0, 'omega_step': 1.0, 'n_frames': 4}
+    start, delta = setpoints['_pso_setpoints'](scan)
+    fly(psofly, start, setpoints['_pso_end'](scan), delta, 10.0)
+    assert psofly.actual_triggers.get() == 5*4
+
+
+def test_telemetry_counts_every_frame_of_a_clean_fly(ns, tmp_path):
+    stage = ns['SimTomoStage'](name='tomostage')
+    psofly = ns['SimEnsemblePSOFlyDevice']('6bmpreci:eFly:', name='psofly', rotation=stage.preci)
+    det = ns['SimPointGreyDetector6BM']('1idPG2:', name='det', tomostage=stage, psofly=psofly, shape=(8, 8))
+    det.stage_sigs = {}
+    telemetry = ns['FlyScanTelemetry'](name='fly_telemetry')
+    for signal, value in [(psofly.start, 0.0), (psofly.end, 4.0), (psofly.scan_delta, 1.0), (psofly.slew_speed, 10.0)]:
+        signal.put(value)
+
+    @bpp.run_decorator()
+    @bpp.stage_decorator([det])
+    def plan():
+        yield from bps.mv(psofly.taxi, 'Taxi')
+        yield from bps.mv(det.cam.num_images, 5, det.cam.trigger_mode, 'Overlapped')
+        yield from bps.trigger(det, group='trigger')
+        yield from telemetry.record(psofly.plan(), det, psofly, det.hdf1, expected_fps=10.0)
+        yield from bps.wait(group='trigger')
+
+    RunEngine({})(plan())
+    summary = telemetry.summary
+    assert summary['triggers'] == 5
+    assert summary['frames'] == 5 and summary['dropped'] == 0
+    # the frame rate, without the run-up and run-down
+    assert summary['effective_fps'] == pytest.approx(10.0, rel=0.2)
@@ -0,0 +1,69 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+import matplotlib
+import pytest
+
+
+@pytest.fixture
+def ns(load_startup):
+    return load_startup(
+        '00-prep.py', ['DecimatedSeries', '_scalar_keys', 'LiveView'],
+        {'atexit': atexit, 'threading': threading, 'queue': queue, 'datetime': datetime, 'matplotlib': matplotlib, 'plt': None},
+    )
+
+
+def test_decimated_series_keeps_every_point_below_max(ns):
+    s = ns['DecimatedSeries'](max_points=10)
+    for i in range(10):
+        s.append(i, 2 * i)
+    assert len(s) == 10 and s.stride == 1
+    assert s.x == list(range(10)) and s.y == [2 * i for i in range(10)]
+
+
+def test_decimated_series_doubles_the_stride(ns):
+    s = ns['DecimatedSeries'](max_points=10)
+    for i in range(100):
+        s.append(i, i)
+    assert len(s) <= 10
+    assert s.stride == 16
+    # evenly spaced from the first point
+    assert s.x == list(range(0, 100, s.stride))[:len(s)]
+    assert s.x[-1] > 100 - 2 * s.stride
+
+
+def run_docs(n_events):
+    descriptor = {
+        'uid': 'd1', 'name': 'primary',
+        'data_keys': {
+            'I0': {'dtype': 'number', 'shape': []},
+            'img': {'dtype': 'array', 'shape': [2, 2], 'external': 'FILESTORE:'},
+        },
+    }
+    yield 'start', {'uid': 'r1', 'time': 0.0, 'scan_id': 1, 'plan_name': 'count'}
+    yield 'descriptor', descriptor
+    for i in range(1, n_events + 1):
+        yield 'event', {'descriptor': 'd1', 'seq_num': i, 'time': float(i), 'data': {'I0': 0.5 * i, 'img': 'x'}}
+    yield 'stop', {'time': float(n_events), 'exit_status': 'success'}
+
+
+def test_live_view_keeps_the_scalars_and_does_not_block(ns, capsys):
+    view = ns['LiveView'](fps=20, table=False, plots=False)
+    try:
+        t0 = time.perf_counter()
+        for name, doc in run_docs(50):
+            view(name, doc)
+        assert time.perf_counter() - t0 < 0.1  # the stop is not waited for
+        deadline = time.monotonic() + 2
+        while view._rendered < view._queued:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        view.close()
+    x, y = view.snapshot()['I0']
+    assert x == list(range(1, 51)) and y == [0.5 * i for i in x]
+    assert 'img' not in view.snapshot()
+    assert 'success' in capsys.readouterr().out
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import pytest
+from ophyd import Signal
+
+
+@pytest.fixture
+def estimate_move_time(load_startup):
+    return load_startup('03-plans.py', ['_read_or', 'estimate_move_time'])['estimate_move_time']
+
+
+def motor(position=0.0, velocity=2.0, acceleration=0.5):
+    return SimpleNamespace(
+        position=position,
+        velocity=Signal(name='velocity', value=velocity),
+        acceleration=Signal(name='acceleration', value=acceleration),
+    )
+
+
+def test_trapezoidal_profile(estimate_move_time):
+    # 10 mm at 2 mm/s, 0.5 s to reach it
+    assert estimate_move_time(motor(), 10.0) == pytest.approx(10/2 + 0.5)
+    assert estimate_move_time(motor(position=10.0), 0.0) == pytest.approx(5.5)
+
+
+def test_short_move_never_reaches_the_velocity(estimate_move_time):
+    # triangular profile below velocity*acceleration = 1 mm
+    assert estimate_move_time(motor(), 0.25) == pytest.approx(2*(0.25*0.5/2)**0.5)
+    # both profiles agree at the boundary
+    assert estimate_move_time(motor(), 1.0) == pytest.approx(1.0/2 + 0.5)
+
+
+def test_overrides_and_defaults(estimate_move_time):
+    m = motor()
+    assert estimate_move_time(m, 10.0, start=6.0, velocity=4.0, acceleration=0) == pytest.approx(1.0)
+    assert estimate_move_time(m, 0.0) == 0.0
+    assert estimate_move_time(motor(velocity=0.0), 5.0) == 0.0
+    # no VELO/ACCL (e.g. a soft positioner)
+    assert estimate_move_time(SimpleNamespace(position=0.0), 5.0) == 0.0
+    assert estimate_move_time(SimpleNamespace(position=0.0), 5.0, velocity=5.0) == pytest.approx(1.0)
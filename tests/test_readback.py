@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+from ophyd import Signal
+
+
+@pytest.fixture
+def ns(load_startup):
+    cache = load_startup('02-init.py', ['SettingsCache'], {'threading': threading})
+    return load_startup(
+        '03-plans.py', ['_UNKNOWN', '_dry_run_values', '_readback_equals'],
+        {'settings_cache': cache['SettingsCache']()},
+    )
+
+
+@pytest.fixture
+def signal(ns):
+    def cached_signal(value, **kwargs):
+        sig = Signal(name='sig', value=value, **kwargs)
+        ns['settings_cache'].get(sig)  # an uncached signal is never equal
+        return sig
+    return cached_signal
+
+
+def test_counts_are_compared_exactly(ns, signal):
+    equals = ns['_readback_equals']
+    assert equals(signal(200000), 200000)
+    assert not equals(signal(200000), 200001)
+    assert not equals(signal(1), 0)
+
+
+def test_floats_are_close(ns, signal):
+    equals = ns['_readback_equals']
+    assert equals(signal(0.1 + 0.2), 0.3)
+    assert equals(signal(2), 2.0)
+    assert not equals(signal(0.05), 0.0501)
+
+
+def test_floats_use_the_signal_tolerance(ns, signal):
+    equals = ns['_readback_equals']
+    # e.g. an exposure rounded by the IOC
+    assert equals(signal(0.0501, tolerance=1e-3), 0.05)
+    assert not equals(signal(0.052, tolerance=1e-3), 0.05)
+    assert equals(signal(101.0, rtolerance=0.02), 100.0)
+
+
+def test_enum_index_equals_its_string(ns, signal):
+    sig = signal(1)
+    sig.enum_strs = ('Internal', 'Overlapped')
+    assert ns['_readback_equals'](sig, 'Overlapped')
+    assert not ns['_readback_equals'](sig, 'Internal')
@@ -0,0 +1,29 @@
+import copy
+
+import pytest
+
+
+@pytest.fixture
+def merge_config(load_startup):
+    return load_startup('03-plans.py', ['_merge_config'], {'copy': copy})['_merge_config']
+
+
+def test_overrides_are_merged_recursively(merge_config):
+    config = {'tomo': {'type': 'fly', 'n_tomo': 361}, 'output': {'type': 'hdf', 'fileprefix': 'tomo'}}
+    merged = merge_config(config, {'output': {'fileprefix': 's1'}, 'tomo': {'type': 'step'}})
+    assert merged == {'tomo': {'type': 'step', 'n_tomo': 361}, 'output': {'type': 'hdf', 'fileprefix': 's1'}}
+
+
+def test_non_dict_override_replaces_the_section(merge_config):
+    assert merge_config({'a': {'b': 1}}, {'a': 2, 'c': {'d': 3}}) == {'a': 2, 'c': {'d': 3}}
+
+
+def test_config_and_overrides_are_not_shared(merge_config):
+    config = {'tomo': {'angles': [0, 180]}}
+    overrides = {'output': {'tags': ['a']}}
+    merged = merge_config(config, overrides)
+    merged['tomo']['angles'].append(360)
+    merged['output']['tags'].append('b')
+    assert config == {'tomo': {'angles': [0, 180]}}
+    assert overrides == {'output': {'tags': ['a']}}
+    assert merge_config(config, None) == config
@@ -0,0 +1,46 @@
+import importlib.util
+import logging
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('caproto')
+
+_spec = importlib.util.spec_from_file_location(
+    'ioc_6bma', Path(__file__).resolve().parents[1] / 'softioc' / 'ioc_6bma.py')
+ioc_6bma = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ioc_6bma)
+
+
+@pytest.mark.parametrize('annotation, choices', [
+    ('#~r ["OFF", "ON"]', ('OFF', 'ON')),
+    ('#~w [0|"Low",1|"High"]', ('Low', 'High')),
+    ('#~w ["Enable"|1, "Disable"|0]', ('Disable', 'Enable')),
+    ('#~w [0:None,1:EPICS_PV,2:Detector output]', ('None', 'EPICS_PV', 'Detector output')),
+    ('#~w [2|"B"]', ('', '', 'B')),
+])
+def test_parse_choices(annotation, choices):
+    assert ioc_6bma.parse_choices(annotation) == choices
+
+
+@pytest.mark.parametrize('annotation', [
+    '#~w [1]',                # a value, not a choice
+    '#~w [0~0.5]',            # a range
+    '#~w ["Acquire", 0, 1]',  # mixed
+    '#~r  //no list',
+])
+def test_parse_choices_not_an_enum(annotation):
+    assert ioc_6bma.parse_choices(annotation) is None
+
+
+def test_pvs_below_a_prefix_are_created_and_logged(caplog):
+    ioc = ioc_6bma.SoftIOC()
+    ioc.serve('1idPG2:cam1:')
+    with caplog.at_level(logging.INFO, logger='ioc_6bma'):
+        pv = ioc['1idPG2:cam1:TriggerMode_RBV']
+    assert pv is ioc['1idPG2:cam1:TriggerMode'].readback
+    assert 'Overlapped' in pv.enum_strings
+    assert ioc.created == ['1idPG2:cam1:TriggerMode_RBV']
+    assert '1idPG2:cam1:TriggerMode_RBV' in caplog.text
+    with pytest.raises(KeyError):
+        ioc['1idPG2:Proc1:EnableFilter']
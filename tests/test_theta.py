@@ -0,0 +1,80 @@
+import h5py
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def ns(load_startup):
+    devices = load_startup('01-devices.py', ['HDF5_DATASETS', 'EPICS_EPOCH'])
+    return load_startup('03-plans.py', ['tomo_theta', '_pso_setpoints', 'frame_timestamps'], devices)
+
+
+def scan(kind, **kwargs):
+    return {
+        'type': kind, 'omega_start': 0.0, 'omega_end': 4.0, 'omega_step': 1.0,
+        'n_frames': 1, 'pso_start': 0.0, 'pso_delta': 1.0, **kwargs,
+    }
+
+
+def test_tomo_theta_step(ns):
+    np.testing.assert_allclose(ns['tomo_theta'](scan('step'), 5), [0, 1, 2, 3, 4])
+    np.testing.assert_allclose(ns['tomo_theta'](scan('step'), 3), [0, 1, 2])
+
+
+def test_tomo_theta_fly_follows_the_direction(ns):
+    np.testing.assert_allclose(ns['tomo_theta'](scan('fly', pso_start=0.1), 3), [0.1, 1.1, 2.1])
+    reverse = scan('fly', omega_start=4.0, omega_end=0.0, pso_start=4.0, pso_delta=1.0)
+    np.testing.assert_allclose(ns['tomo_theta'](reverse, 3), [4, 3, 2])
+
+
+def test_tomo_theta_step_fast_averages_the_triggers(ns):
+    # 4 triggers per projection, every 0.25 deg
+    theta = ns['tomo_theta'](scan('step_fast', n_frames=4, pso_delta=0.25), 3)
+    np.testing.assert_allclose(theta, [0.375, 1.375, 2.375])
+
+
+@pytest.mark.parametrize('kind, n_frames', [('fly', 1), ('step_fast', 1), ('step_fast', 4)])
+def test_commanded_theta_matches_the_step_angles(ns, kind, n_frames):
+    # the live preview uses the PSO setpoints before the scan is over
+    s = scan(kind, n_frames=n_frames, omega_step=-0.5, omega_end=-2.0)
+    s['pso_start'], s['pso_delta'] = ns['_pso_setpoints'](s)
+    theta = ns['tomo_theta'](s, 5)
+    if n_frames == 1:
+        np.testing.assert_allclose(theta, ns['tomo_theta'](scan('step', omega_step=-0.5, omega_end=-2.0), 5))
+    else:
+        # the mean angle of the averaged triggers, 1/4 of omega_step apart
+        np.testing.assert_allclose(np.diff(theta), -0.5)
+        np.testing.assert_allclose(theta[0], -0.5*3/8)
+
+
+def write_defaults(fn, save_dest, dtype):
+    sec = np.arange(len(save_dest), dtype='i4') + 100
+    with h5py.File(fn, 'w') as h5:
+        h5.create_dataset('/defaults/SaveDest', data=np.array(save_dest, dtype=dtype))
+        h5.create_dataset('/defaults/NDArrayEpicsTSSec', data=sec)
+        h5.create_dataset('/defaults/NDArrayEpicsTSnSec', data=np.full(len(sec), 5e8, dtype='i4'))
+
+
+def test_frame_timestamps_string_save_dest(ns, tmp_path):
+    # the IOC records FrameType as DBR_STRING, i.e. the dataset path
+    paths = ns['HDF5_DATASETS']
+    dest = [paths[0], paths[1], paths[1], paths[1], paths[3]]
+    write_defaults(tmp_path / 'scan.h5', [d.encode() for d in dest], 'S40')
+    with h5py.File(tmp_path / 'scan.h5', 'r') as h5:
+        ts = ns['frame_timestamps'](h5)
+        dark = ns['frame_timestamps'](h5, frame_type=3)
+    epoch = ns['EPICS_EPOCH']
+    np.testing.assert_allclose(ts, epoch + np.array([101.5, 102.5, 103.5]))
+    np.testing.assert_allclose(dark, [epoch + 104.5])
+
+
+def test_frame_timestamps_integer_save_dest(ns, tmp_path):
+    write_defaults(tmp_path / 'scan.h5', [0, 1, 1, 2], 'i4')
+    with h5py.File(tmp_path / 'scan.h5', 'r') as h5:
+        assert len(ns['frame_timestamps'](h5)) == 2
+
+
+def test_frame_timestamps_without_attributes(ns, tmp_path):
+    with h5py.File(tmp_path / 'scan.h5', 'w') as h5:
+        h5.create_dataset('/exchange/data', data=np.zeros((1, 2, 2)))
+        assert ns['frame_timestamps'](h5) is None
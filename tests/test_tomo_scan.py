@@ -0,0 +1,127 @@
+"""tomo_scan runs on the simulated beamline (debug mode) of the profile"""
+import json
+
+import pytest
+
+CODE = """
+import json
+from bluesky import RunEngine
+RE = RunEngine({})  # no database
+config = _merge_config(load_config('configs/tomo_6bma.yml'), json.loads(%r))
+shutter_closed = []
+def prepare_next():
+    shutter_closed.append(A_shutter.isClosed)
+    yield from bps.null()
+RE(tomo_scan(config, prepare_next=prepare_next))
+print('S6BM_TEST', json.dumps({'prepare_next': shutter_closed, 'closed': A_shutter.isClosed}))
+"""
+
+
+@pytest.mark.parametrize('n_dark', [0, 1])
+def test_shutter_closed_before_the_next_scan_is_prepared(run_profile, n_dark):
+    config = {'tomo': {
+        'type': 'step', 'omega_start': 0.0, 'omega_end': 2.0, 'omega_step': 1.0,
+        'n_white': 1, 'n_dark': n_dark,
+    }}
+    result = run_profile(CODE % json.dumps(config))
+    assert result == {'prepare_next': [True], 'closed': True}
+
+
+VOLUME = """
+import json
+from bluesky import RunEngine
+RE = RunEngine({})  # no database
+config = _merge_config(load_config('configs/tomo_6bma.yml'), json.loads(%r))
+openings, triggers = [], {'white': 0, 'dark': 0}
+def on_state(value, old_value=None, **kwargs):
+    if value in A_shutter.pss_state_open_values and old_value not in A_shutter.pss_state_open_values:
+        openings.append(value)
+A_shutter.pss_state.subscribe(on_state, run=False)
+def on_frame_type(value, **kwargs):
+    kind = {0: 'white', 2: 'white', 3: 'dark'}.get(value)
+    if kind is not None:
+        triggers[kind] += 1
+det.cam.frame_type.subscribe(on_frame_type, run=False)
+RE(tomo_volume_scan(config, stage_step=0.5, n_stage=2))
+with open(os.path.join(config['output']['filepath'], config['output']['fileprefix'] + '_tiles.yml')) as f:
+    index = yaml.safe_load(f)
+print('S6BM_TEST', json.dumps({
+    'openings': len(openings),
+    'closed': A_shutter.isClosed,
+    'frame_types': triggers,
+    'tiles': [{k: tile[k] for k in ('fileprefix', 'white', 'dark')} for tile in index['tiles']],
+}))
+"""
+
+
+def test_volume_shares_the_white_dark_of_one_shutter_opening(run_profile, tmp_path):
+    config = {
+        'tomo': {
+            'type': 'step', 'omega_start': 0.0, 'omega_end': 1.0, 'omega_step': 1.0,
+            'n_white': 1, 'n_dark': 1,
+        },
+        'output': {'filepath': str(tmp_path), 'fileprefix': 'vol', 'type': 'tiff'},
+    }
+    result = run_profile(VOLUME % json.dumps(config))
+    assert result['openings'] == 1
+    assert result['closed']
+    # pre-white of the first tile, dark of the last one
+    assert result['frame_types'] == {'white': 1, 'dark': 1}
+    assert result['tiles'] == [
+        {'fileprefix': 'vol_y00_x00', 'white': 'vol_y00_x00', 'dark': 'vol_y00_x01'},
+        {'fileprefix': 'vol_y00_x01', 'white': 'vol_y00_x00', 'dark': 'vol_y00_x01'},
+    ]
+
+
+SESSION_RE = """
+import json
+store = LocalDocumentStore(root=%r)
+RE = getRunEngine(db=store)
+seen = []
+def plan():
+    yield from bps.open_run(md={'tomo_scan': {'type': 'step', 'output_type': 'tiff'}})
+    seen.append(theta_writer._start is not None)
+    yield from bps.close_run()
+RE(plan())
+doc_writer.drain(timeout=10)
+print('S6BM_TEST', json.dumps(seen))
+"""
+
+
+def test_theta_writer_follows_a_new_run_engine(run_profile, tmp_path):
+    assert run_profile(SESSION_RE % str(tmp_path)) == [True]
+
+
+PROFILE = """
+import json
+from bluesky import RunEngine
+RE = RunEngine({})  # no database
+config = _merge_config(load_config('configs/tomo_6bma.yml'), json.loads(%r))
+profiler = MessageProfiler()
+profiler.enable(RE)
+RE(tomo_scan(config))
+profiler.disable()
+print('S6BM_TEST', json.dumps({
+    'hooks': [RE.msg_hook, RE.waiting_hook],
+    'stats': [[*key, n] for key, (n, total, tmax) in profiler.stats.items()],
+    'statuses': [[*key, n] for key, (n, total, tmax) in profiler.statuses.items()],
+}))
+"""
+
+
+def test_profiler_books_the_moves_to_their_phase(run_profile):
+    config = {'tomo': {
+        'type': 'step', 'omega_start': 0.0, 'omega_end': 2.0, 'omega_step': 1.0,
+        'n_white': 1, 'n_dark': 1,
+    }}
+    result = run_profile(PROFILE % json.dumps(config))
+    assert result['hooks'] == [None, None]
+    stats = {(phase, command, name): n for phase, command, name, n in result['stats']}
+    # one move per angle, the sample out/in moves with their white field
+    assert stats[('projections', 'set', 'tomostage_preci')] == 3
+    assert stats[('white_post', 'set', 'tomostage_preci')] == 1
+    assert stats[('white_pre', 'set', 'tomostage_samX')] == 2
+    assert stats[('dark', 'set', 'A_shutter')] == 1
+    statuses = {(phase, action, name) for phase, action, name, n in result['statuses']}
+    assert ('projections', 'set', 'tomostage_preci') in statuses
+    assert ('white_pre', 'trigger', 'det') in statuses